@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Benchmark the response-time anomaly detector on synthetic traces
+For many random monitors (median latency and noise level drawn at random)
+reports false alerts per 10k steady checks, how many checks it takes to
+flag a slowdown of each size, and the cost of one observation.
+
+    python benchmarks/bench_anomaly.py [--monitors 1000] [--checks 2000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.anomaly import LatencyBaseline
+from src.alerts import DEGRADED
+
+
+def trace(rng, median, spread, count):
+    return [median * rng.lognormvariate(0, spread) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--monitors', type=int, default=1000)
+    parser.add_argument('--checks', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    profiles = [(rng.uniform(0.005, 1.5), rng.uniform(0.05, 0.5)) for _ in range(args.monitors)]
+
+    false_alerts = 0
+    observed = 0
+    start = time.perf_counter()
+    for median, spread in profiles:
+        baseline = LatencyBaseline()
+        for latency in trace(rng, median, spread, args.checks):
+            false_alerts += baseline.observe(latency) == DEGRADED
+        observed += args.checks
+    elapsed = time.perf_counter() - start
+    print(f"Steady traffic: {false_alerts / observed * 10000:.2f} false alerts per 10k checks "
+          f"({observed} checks)")
+
+    print(f"{'slowdown':>9} {'caught':>8} {'median delay':>13} {'max delay':>10}  (checks)")
+    for factor in (1.5, 2, 3, 5, 25):
+        delays = []
+        for median, spread in profiles:
+            baseline = LatencyBaseline()
+            for latency in trace(rng, median, spread, 200):
+                baseline.observe(latency)
+            for i, latency in enumerate(trace(rng, median * factor, spread, 100)):
+                if baseline.observe(latency) == DEGRADED:
+                    delays.append(i + 1)
+                    break
+        delays.sort()
+        caught = len(delays) / len(profiles)
+        median_delay = delays[len(delays) // 2] if delays else '-'
+        print(f"{factor:>8}x {caught:>8.1%} {median_delay:>13} {max(delays, default='-'):>10}")
+
+    baseline = LatencyBaseline()
+    samples = trace(rng, 0.08, 0.2, 100000)
+    start = time.perf_counter()
+    for latency in samples:
+        baseline.observe(latency)
+    per_check = (time.perf_counter() - start) / len(samples)
+    print(f"observe(): {per_check * 1e9:.0f} ns per check; steady run {elapsed:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark checks against an endpoint with a large response body
+Runs a batch of concurrent checks of one big download per kind of check
+and reports wall time and peak Python memory (tracemalloc) per batch:
+a plain status check, the same with keep-alive, a body assertion that
+matches near the start, one that never matches (read up to
+MAX_BODY_BYTES) and a JSON assertion.
+
+    python benchmarks/bench_bodies.py [--checks 50] [--size-mb 16]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.config import Config
+from src.engine import CheckEngine
+from src.monitor import APIMonitor
+
+KINDS = [
+    ('status only', {}),
+    ('status, keep-alive', {'keep_alive': True}),
+    ('body match at start', {'assertions': [{'type': 'body', 'contains': 'version=2'}]}),
+    ('body never matches', {'assertions': [{'type': 'body', 'contains': 'missing'}]}),
+    ('json path', {'assertions': [{'type': 'json', 'path': '$.status'}]}),
+]
+
+
+def serve(size):
+    body = b'version=2;' + b'x' * size
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except ConnectionError:
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--checks', type=int, default=50)
+    parser.add_argument('--size-mb', type=int, default=16)
+    args = parser.parse_args()
+    httpd = serve(args.size_mb * 1024 * 1024)
+    url = f"http://127.0.0.1:{httpd.server_port}/"
+
+    print(f"{args.checks} concurrent checks of a {args.size_mb} MiB body, "
+          f"MAX_BODY_BYTES={Config.MAX_BODY_BYTES}")
+    print(f"{'check':>20} {'seconds':>8} {'peak MiB':>9} {'errors':>7}")
+    with tempfile.TemporaryDirectory() as tmp:
+        monitor = APIMonitor(os.path.join(tmp, 'bench.db'))
+        for label, spec in KINDS:
+            ids = monitor.add_monitors([dict({'name': f'big-{i}', 'url': url}, **spec)
+                                        for i in range(args.checks)])
+            engine = CheckEngine(monitor, concurrency=args.checks, per_host=args.checks)
+            tracemalloc.start()
+            start = time.perf_counter()
+            results = engine.run(ids)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            monitor.deactivate_monitors(ids)
+            errors = sum(1 for _, result in results if result['error'])
+            print(f"{label:>20} {elapsed:>8.2f} {peak / 2 ** 20:>9.1f} {errors:>7}")
+    httpd.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Benchmark the async check engine against a local stub server
+Reports checks per second for 100, 1k and 10k monitors, and the average
+time checks spent in each phase.
+
+    python benchmarks/bench_engine.py [--latency 0.05] [--hosts 20] [--keep-alive]
+    python benchmarks/bench_engine.py --hostname localhost [--dns-ttl 60]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.stub_server import StubServer
+from src.monitor import APIMonitor
+from src.engine import CheckEngine
+from src.httpclient import PHASES
+
+
+def seed(monitor, urls, count, keep_alive=False, dns_ttl=0):
+    conn = sqlite3.connect(monitor.db_path)
+    conn.executemany(
+        'INSERT INTO monitors (name, url, check_interval, keep_alive, dns_ttl) VALUES (?, ?, ?, ?, ?)',
+        [(f"stub-{i}", urls[i % len(urls)], 300, keep_alive, dns_ttl) for i in range(count)])
+    conn.commit()
+    ids = [row[0] for row in conn.execute('SELECT id FROM monitors')]
+    conn.close()
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='100,1000,10000')
+    parser.add_argument('--hosts', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.0, help='stub response delay in seconds')
+    parser.add_argument('--concurrency', type=int, default=None)
+    parser.add_argument('--per-host', type=int, default=None)
+    parser.add_argument('--keep-alive', action='store_true', help='reuse pooled connections')
+    parser.add_argument('--hostname', default='127.0.0.1', help='use a name to include DNS lookups')
+    parser.add_argument('--dns-ttl', type=int, default=0, help='seconds lookups are cached for')
+    args = parser.parse_args()
+
+    with StubServer(hosts=args.hosts, latency=args.latency) as server:
+        urls = [url.replace('127.0.0.1', args.hostname) for url in server.urls]
+        print(f"{'monitors':>10} {'seconds':>10} {'checks/s':>10} {'errors':>8} {'reused':>8}  "
+              + ' '.join(f'{phase:>8}' for phase in PHASES) + '  (avg ms)')
+        for size in [int(s) for s in args.sizes.split(',')]:
+            with tempfile.TemporaryDirectory() as tmp:
+                monitor = APIMonitor(os.path.join(tmp, 'bench.db'))
+                ids = seed(monitor, urls, size, args.keep_alive, args.dns_ttl)
+                engine = CheckEngine(monitor, concurrency=args.concurrency, per_host=args.per_host)
+
+                start = time.perf_counter()
+                results = engine.run(ids)
+                elapsed = time.perf_counter() - start
+
+                errors = sum(1 for _, result in results if result['error'])
+                reused = sum(1 for _, result in results if result['connection_reused'])
+                phases = ' '.join(f"{sum(r['timings'][p] or 0 for _, r in results) / size * 1000:>8.2f}"
+                                  for p in PHASES)
+                print(f"{size:>10} {elapsed:>10.2f} {size / elapsed:>10.0f} {errors:>8} {reused:>8}  {phases}")
+
+
+if __name__ == '__main__':
+    main()
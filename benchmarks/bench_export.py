@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark streaming check export
+Loads synthetic check rows, then streams them out in each format and
+reports rows/s, output size and resident memory before and during the
+export (flat RSS means memory does not grow with the range).
+
+    python benchmarks/bench_export.py [--rows 10000000] [--formats csv,ndjson,parquet]
+"""
+
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.monitor import APIMonitor
+from src.export import export_checks, ExportError
+from benchmarks.bench_stats import load
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:  # not Linux: peak so far is the best we have
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class PeakRSS:
+    """Samples RSS on a thread while the block runs"""
+
+    def __enter__(self):
+        self.start = self.peak = rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(0.05):
+            self.peak = max(self.peak, rss_mb())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_mb())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--monitors', type=int, default=1000)
+    parser.add_argument('--formats', default='csv,ndjson,arrow,parquet')
+    parser.add_argument('--by-monitor', action='store_true',
+                        help='export monitor by monitor instead of in id order')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        monitor = APIMonitor(os.path.join(tmp, 'bench.db'))
+        start = time.perf_counter()
+        load(monitor, args.rows, args.monitors)
+        monitor.init_database()
+        print(f"Loaded {args.rows} rows in {time.perf_counter() - start:.1f}s")
+        monitor_ids = list(range(1, args.monitors + 1)) if args.by_monitor else None
+
+        print(f"{'format':>8} {'rows/s':>10} {'MB out':>8} {'RSS before':>11} {'RSS peak':>9}  (MB)")
+        for fmt in args.formats.split(','):
+            size = 0
+            with PeakRSS() as rss:
+                start = time.perf_counter()
+                try:
+                    for chunk in export_checks(monitor.db, fmt, monitor_ids):
+                        size += len(chunk)
+                except ExportError as e:
+                    print(f"{fmt:>8} skipped: {e}")
+                    continue
+                elapsed = time.perf_counter() - start
+            print(f"{fmt:>8} {args.rows / elapsed:>10.0f} {size / 2 ** 20:>8.1f} "
+                  f"{rss.start:>11.1f} {rss.peak:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
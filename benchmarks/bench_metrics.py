@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark the cost of metrics on the check hot path
+Times each metric update on its own and the full set a check makes (lag,
+in-flight, duration, outcome and the three per-monitor gauges), then runs
+the engine against the local stub server with metrics on and with every
+update replaced by a no-op.
+
+    python benchmarks/bench_metrics.py [--ops 1000000] [--checks 10000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.bench_engine import seed
+from benchmarks.stub_server import StubServer
+from src import metrics
+from src.engine import CheckEngine
+from src.monitor import APIMonitor
+
+
+def per_check():
+    metrics.SCHEDULER_LAG.observe(0.002)
+    metrics.IN_FLIGHT.inc()
+    metrics.IN_FLIGHT.dec()
+    metrics.CHECK_DURATION.observe(0.042)
+    metrics.CHECKS.inc(labels=('ok',))
+    metrics.MONITOR_STATUS.set(200, (1,))
+    metrics.MONITOR_LATENCY.set(0.042, (1,))
+    metrics.MONITOR_UP.set(1, (1,))
+
+
+def engine_rate(server, checks):
+    with tempfile.TemporaryDirectory() as tmp:
+        monitor = APIMonitor(os.path.join(tmp, 'bench.db'))
+        ids = seed(monitor, server.urls, checks)
+        engine = CheckEngine(monitor)
+        start = time.perf_counter()
+        engine.run(ids)
+        return checks / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--ops', type=int, default=1000000)
+    parser.add_argument('--checks', type=int, default=10000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    cases = {
+        'counter inc': lambda: metrics.CHECKS.inc(labels=('ok',)),
+        'gauge set': lambda: metrics.MONITOR_UP.set(1, (1,)),
+        'histogram observe': lambda: metrics.CHECK_DURATION.observe(0.042),
+        'all per check': per_check,
+    }
+    for name, case in cases.items():
+        seconds = min(timeit.repeat(case, number=args.ops, repeat=3))
+        print(f"{name:>18}: {seconds / args.ops * 1e9:7.0f} ns")
+
+    with StubServer(hosts=20) as server:
+        enabled = [engine_rate(server, args.checks) for _ in range(args.rounds)]
+        # Swap every update for a no-op to get the uninstrumented rate
+        for metric in metrics.REGISTRY.metrics.values():
+            for method in ('inc', 'dec', 'set', 'observe'):
+                if hasattr(metric, method):
+                    setattr(metric, method, lambda *args, **kwargs: None)
+        disabled = [engine_rate(server, args.checks) for _ in range(args.rounds)]
+    print(f"engine with metrics: {max(enabled):8.0f} checks/s")
+    print(f"engine without:      {max(disabled):8.0f} checks/s "
+          f"({(max(disabled) - max(enabled)) / max(disabled):+.1%} overhead)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Benchmark memory per monitor in the in-memory registry
+Creates monitors through the bulk API, then measures with tracemalloc what
+holding every definition costs as registry records, as the sqlite3.Row
+objects get_monitors returns, and as plain dicts. Also times a full load
+and a change poll.
+
+    python benchmarks/bench_registry.py [--monitors 100000]
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.monitor import APIMonitor
+from src.registry import MonitorRegistry
+
+
+def measure(build):
+    """(object, bytes allocated by build() that are still alive)"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    held = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return held, after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--monitors', type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        monitor = APIMonitor(os.path.join(tmp, 'bench.db'))
+        start = time.perf_counter()
+        for first in range(0, args.monitors, 10000):
+            monitor.add_monitors([
+                {'name': f"Customer {i // 50} endpoint {i}",
+                 'url': f"https://api{i // 50}.example.com/v1/health/{i}",
+                 'check_interval': (30, 60, 300)[i % 3],
+                 'email_alerts': f"ops@customer{i // 50}.example.com"}
+                for i in range(first, min(first + 10000, args.monitors))])
+        print(f"Created {args.monitors} monitors in {time.perf_counter() - start:.1f}s")
+        ids = list(monitor.get_schedule())
+
+        def registry():
+            held = MonitorRegistry(monitor)
+            held.refresh()
+            return held
+
+        start = time.perf_counter()
+        held, size = measure(registry)
+        load = time.perf_counter() - start
+        print(f"{'registry':>10}: {size / len(held):>6.0f} bytes/monitor, {size / 2 ** 20:6.1f} MB"
+              f"  (load {load:.2f}s)")
+
+        rows, size = measure(lambda: {row['id']: row for row in monitor.get_monitors(ids)})
+        print(f"{'rows':>10}: {size / len(rows):>6.0f} bytes/monitor, {size / 2 ** 20:6.1f} MB")
+        del rows
+
+        dicts, size = measure(lambda: {row['id']: dict(row) for row in monitor.get_monitors(ids)})
+        print(f"{'dicts':>10}: {size / len(dicts):>6.0f} bytes/monitor, {size / 2 ** 20:6.1f} MB")
+        del dicts
+
+        monitor.update_monitors([{'id': monitor_id, 'timeout': 10} for monitor_id in ids[:100]])
+        start = time.perf_counter()
+        changes = held.poll()
+        print(f"Poll with {len(changes)} changes: {(time.perf_counter() - start) * 1000:.1f}ms")
+        start = time.perf_counter()
+        held.poll()
+        print(f"Poll with no changes: {(time.perf_counter() - start) * 1000:.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark process startup for each mode
+Every measurement runs in a fresh interpreter so imports are cold (as
+far as the OS file cache allows). Reports, per mode, the import time of
+the entry module, the modules it pulled in, and time to first useful
+work: the first /api/monitors response for web, the first committed
+check for the worker.
+
+    python benchmarks/bench_startup.py [--runs 5] [--monitors 100]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from benchmarks.stub_server import StubServer
+from src.monitor import APIMonitor
+
+WEB = '''
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, 'src')
+from app import create_app
+imported = time.perf_counter()
+app = create_app(sys.argv[1])
+client = app.test_client()
+response = client.get('/api/monitors')
+assert response.status_code == 200, response.status_code
+first = time.perf_counter()
+client.get('/api/monitors')
+second = time.perf_counter()
+print(json.dumps({'import': imported - start, 'first': first - imported,
+                  'second': second - first, 'modules': len(sys.modules)}))
+'''
+
+WORKER = '''
+import json, sqlite3, sys, time
+start = time.perf_counter()
+sys.path.insert(0, 'src')
+from worker import Worker
+imported = time.perf_counter()
+worker = Worker(sys.argv[1], refresh_interval=1)
+worker.start(1)
+conn = sqlite3.connect(sys.argv[1])
+while not conn.execute('SELECT COUNT(*) FROM checks').fetchone()[0]:
+    time.sleep(0.005)
+first = time.perf_counter()
+modules = len(sys.modules)
+worker.stop()
+print(json.dumps({'import': imported - start, 'first': first - imported, 'second': 0.0,
+                  'modules': modules}))
+'''
+
+
+def run(script, db_path):
+    output = subprocess.run([sys.executable, '-c', script, db_path], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--monitors', type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"{'mode':>7} {'import':>8} {'first':>8} {'second':>8} {'modules':>8}  (ms, median of {args.runs})")
+    with StubServer(hosts=4) as server, tempfile.TemporaryDirectory() as tmp:
+        for mode, script in (('web', WEB), ('worker', WORKER)):
+            samples = []
+            for i in range(args.runs):
+                path = os.path.join(tmp, f'{mode}-{i}.db')
+                monitor = APIMonitor(path)
+                # Due within the first second, so the worker's first check
+                # isn't waiting on a long jittered start
+                monitor.add_monitors([{'name': f'stub-{n}', 'url': server.urls[n % len(server.urls)],
+                                       'check_interval': 1} for n in range(args.monitors)])
+                samples.append(run(script, path))
+
+            def median(key):
+                values = sorted(sample[key] for sample in samples)
+                return values[len(values) // 2]
+
+            print(f"{mode:>7} {median('import') * 1000:>8.0f} {median('first') * 1000:>8.0f} "
+                  f"{median('second') * 1000:>8.1f} {median('modules'):>8.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Benchmark get_monitor_stats latency as check history grows
+Loads 1M, 10M and 50M synthetic check rows spread over two weeks and
+times 24h and 7d stats for a sample of monitors.
+
+    python benchmarks/bench_stats.py [--sizes 1000000,10000000] [--no-index]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.monitor import APIMonitor
+
+TWO_WEEKS = 14 * 24 * 3600
+
+
+def load(monitor, rows, monitors):
+    with monitor.db.connect() as conn:
+        # Bulk load without the index, then let init_database build it the
+        # same way the migration does on an existing database
+        conn.execute('DROP INDEX IF EXISTS idx_checks_monitor_time')
+        conn.execute('''
+            WITH RECURSIVE n(x) AS (SELECT 0 UNION ALL SELECT x + 1 FROM n WHERE x < ?)
+            INSERT INTO checks (monitor_id, status_code, response_time, error_message, checked_at)
+            SELECT x % ? + 1, 200, (abs(random()) % 1000) / 1000.0,
+                   CASE WHEN x % 100 = 0 THEN 'Request timed out' END,
+                   datetime('now', '-' || (abs(random()) % ?) || ' seconds')
+            FROM n
+        ''', (rows - 1, monitors, TWO_WEEKS))
+
+
+def timed(monitor, ids, hours):
+    samples = []
+    for monitor_id in ids:
+        start = time.perf_counter()
+        monitor.get_monitor_stats(monitor_id, hours)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='1000000,10000000,50000000')
+    parser.add_argument('--monitors', type=int, default=1000)
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--no-index', action='store_true', help='drop the index to measure a full scan')
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'load s':>8} {'24h p50':>9} {'24h p99':>9} {'7d p50':>9} {'7d p99':>9}  (ms)")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        with tempfile.TemporaryDirectory() as tmp:
+            monitor = APIMonitor(os.path.join(tmp, 'bench.db'))
+            start = time.perf_counter()
+            load(monitor, size, args.monitors)
+            monitor.init_database()
+            # Rows loaded behind the writer's back need their rollups built
+            monitor.rebuild_rollups()
+            load_time = time.perf_counter() - start
+            if args.no_index:
+                with monitor.db.connect() as conn:
+                    conn.execute('DROP INDEX idx_checks_monitor_time')
+
+            ids = [i % args.monitors + 1 for i in range(args.samples)]
+            day = timed(monitor, ids, 24)
+            week = timed(monitor, ids, 168)
+            print(f"{size:>10} {load_time:>8.1f} {day[0] * 1000:>9.2f} {day[1] * 1000:>9.2f} "
+                  f"{week[0] * 1000:>9.2f} {week[1] * 1000:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
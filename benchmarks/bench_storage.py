@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark check ingest and window stats on each storage backend
+Queues check results for the writer as fast as possible with reader
+threads running get_monitor_stats, then reports inserts/s and stats
+latency per backend. PostgreSQL runs when --postgres (or
+TEST_DATABASE_URL) gives a server; it works in a scratch schema that is
+dropped afterwards.
+
+    python benchmarks/bench_storage.py [--rows 100000] [--postgres postgresql://...]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.monitor import APIMonitor
+
+
+def run(monitor, args):
+    ids = monitor.add_monitors([{'name': f'm{i}', 'url': 'http://127.0.0.1/'} for i in range(args.monitors)])
+    rows = monitor.get_monitors(ids)
+    result = {'status_code': 200, 'response_time': 0.05, 'error': None, 'connection_reused': False,
+              'timings': {'dns': 0.001, 'connect': 0.002, 'tls': 0.01, 'ttfb': 0.03, 'transfer': 0.001}}
+
+    stop = threading.Event()
+    latencies = []
+
+    def read():
+        i = 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            monitor.get_monitor_stats(ids[i % len(ids)])
+            latencies.append(time.perf_counter() - start)
+            i += 1
+
+    readers = [threading.Thread(target=read) for _ in range(args.readers)]
+    for reader in readers:
+        reader.start()
+    start = time.perf_counter()
+    for i in range(args.rows):
+        monitor.submit_checks([(rows[i % len(rows)], result)])
+    monitor.writer.flush()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for reader in readers:
+        reader.join()
+    monitor.writer.close()
+
+    latencies.sort()
+    return (args.rows / elapsed, latencies[len(latencies) // 2] if latencies else 0,
+            latencies[int(len(latencies) * 0.99)] if latencies else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--monitors', type=int, default=1000)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--postgres', default=os.environ.get('TEST_DATABASE_URL'))
+    args = parser.parse_args()
+
+    print(f"{'backend':>10} {'inserts/s':>10} {'stats p50':>10} {'stats p99':>10}  (ms)")
+    with tempfile.TemporaryDirectory() as tmp:
+        rate, p50, p99 = run(APIMonitor(os.path.join(tmp, 'bench.db')), args)
+        print(f"{'sqlite':>10} {rate:>10.0f} {p50 * 1000:>10.2f} {p99 * 1000:>10.2f}")
+
+    if args.postgres:
+        import psycopg
+        from src.pg_storage import PostgresStorage
+
+        schema = f'bench_{uuid.uuid4().hex[:12]}'
+        with psycopg.connect(args.postgres, autocommit=True) as admin:
+            admin.execute(f'CREATE SCHEMA {schema}')
+        storage = PostgresStorage(args.postgres, schema=schema, pool_size=args.readers + 2)
+        try:
+            rate, p50, p99 = run(APIMonitor(args.postgres, storage=storage), args)
+            print(f"{'postgres':>10} {rate:>10.0f} {p50 * 1000:>10.2f} {p99 * 1000:>10.2f}")
+        finally:
+            storage.close()
+            with psycopg.connect(args.postgres, autocommit=True) as admin:
+                admin.execute(f'DROP SCHEMA {schema} CASCADE')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Benchmark batched check inserts under concurrent dashboard reads
+Producers queue check results for the single writer thread while reader
+threads run get_monitor_stats; reports inserts/s and reader latency.
+
+    python benchmarks/bench_writer.py [--rows 100000] [--readers 4]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.monitor import APIMonitor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--monitors', type=int, default=1000)
+    parser.add_argument('--readers', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        monitor = APIMonitor(os.path.join(tmp, 'bench.db'))
+        ids = [monitor.add_monitor(f"m{i}", "http://127.0.0.1/") for i in range(args.monitors)]
+        rows = monitor.get_monitors(ids)
+        result = {'status_code': 200, 'response_time': 0.05, 'error': None, 'connection_reused': False}
+
+        stop = threading.Event()
+        latencies = []
+
+        def read():
+            i = 0
+            while not stop.is_set():
+                start = time.perf_counter()
+                monitor.get_monitor_stats(ids[i % len(ids)])
+                latencies.append(time.perf_counter() - start)
+                i += 1
+
+        readers = [threading.Thread(target=read) for _ in range(args.readers)]
+        for reader in readers:
+            reader.start()
+
+        start = time.perf_counter()
+        for i in range(args.rows):
+            monitor.submit_checks([(rows[i % len(rows)], result)])
+        monitor.writer.flush()
+        elapsed = time.perf_counter() - start
+
+        stop.set()
+        for reader in readers:
+            reader.join()
+
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0
+        print(f"inserts:        {args.rows} in {elapsed:.2f}s")
+        print(f"inserts/s:      {args.rows / elapsed:.0f} ({args.rows / elapsed * 60:.0f}/min)")
+        print(f"stats reads:    {len(latencies)}, p99 {p99 * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Load test the whole pipeline and compare against a baseline
+Runs the scheduler and check engine in a process of their own against a
+local stub server with configurable latency, error and timeout rates,
+writes results through the check writer as the worker does, and meanwhile
+reads /api/monitors from a web process over HTTP. Prints the results as
+JSON: check throughput, scheduler lag, check and /api/monitors latency,
+and peak RSS of the checking process and the web process. The first
+--warmup seconds (the first burst of checks, the first report cache
+builds) are run but left out of every metric.
+
+With --baseline the results are compared with a stored run, and any
+metric worse than the baseline by more than --tolerance fails the run
+(exit status 1). Baselines are only comparable on the same machine with
+the same settings; record one with --save-baseline. With --runs N each
+metric is the median over N runs, which steadies the tail latencies.
+
+    python benchmarks/loadtest.py [--monitors 2000] [--interval 5] [--duration 30] [--warmup 5] [--runs 3]
+    python benchmarks/loadtest.py --baseline benchmarks/baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.stub_server import StubServer
+from src.engine import CheckEngine
+from src.monitor import APIMonitor
+from src.scheduler import LagStats, Scheduler
+
+# Both measured processes are spawned rather than forked, so their peak
+# RSS doesn't include pages inherited from this one
+_mp = multiprocessing.get_context('spawn')
+
+# metric -> (True if higher is better, change always tolerated in its own units)
+METRICS = {
+    'checks_per_second': (True, 0),
+    'scheduler_lag_p99': (False, 0.05),
+    'check_time_p99': (False, 0.05),
+    'api_requests_per_second': (True, 0),
+    'api_latency_p99': (False, 0.01),
+    'worker_rss_mb': (False, 10),
+    'web_rss_mb': (False, 10),
+}
+# Settings that must match for results to be comparable
+SETTINGS = ('monitors', 'interval', 'duration', 'warmup', 'hosts', 'latency', 'jitter', 'error_rate',
+            'timeout_rate', 'timeout', 'readers', 'seed')
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def peak_rss_mb(pid='self'):
+    """Peak resident set size of this process or of `pid` (Linux only).
+    VmHWM belongs to the address space, so unlike ru_maxrss, which Linux
+    carries across exec, it doesn't include the parent's peak."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _serve_web(db_path, port, ready):
+    import logging
+    from werkzeug.serving import make_server
+    from src.app import create_app
+
+    # No access log line per request
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    server = make_server('127.0.0.1', port, create_app(db_path), threaded=True)
+    ready.set()
+    server.serve_forever()
+
+
+class WebProcess:
+    """The dashboard and API in their own process, as in production"""
+
+    def __init__(self, db_path):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.port = s.getsockname()[1]
+        self.url = f'http://127.0.0.1:{self.port}/api/monitors'
+        ready = _mp.Event()
+        self.process = _mp.Process(target=_serve_web, args=(db_path, self.port, ready), daemon=True)
+        self.process.start()
+        ready.wait(10)
+
+    def get(self):
+        with urllib.request.urlopen(self.url, timeout=30) as response:
+            return response.read()
+
+    def stop(self):
+        rss = peak_rss_mb(self.process.pid)
+        self.process.terminate()
+        self.process.join()
+        return rss
+
+
+def _run_worker(db_path, warmup, duration, measuring, results):
+    """The checking side, as the worker runs it: scheduler, engine and
+    check writer. Puts the measured window's stats on `results`."""
+    monitor = APIMonitor(db_path)
+    scheduler = Scheduler()
+    engine = CheckEngine(monitor)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(engine.run_scheduled(scheduler, report_interval=warmup + duration + 1))
+        await asyncio.sleep(warmup)
+        # Checks after this id, and lag from here on, are measured
+        await loop.run_in_executor(None, monitor.writer.flush)
+        first_id = monitor.storage.last_check_id()
+        scheduler.lag = LagStats()
+        measuring.set()
+        start = time.perf_counter()
+        await asyncio.sleep(duration)
+        task.cancel()
+        return first_id, time.perf_counter() - start
+
+    first_id, elapsed = asyncio.run(main())
+    monitor.writer.flush()
+    monitor.writer.close()
+    results.put({'first_id': first_id, 'elapsed': elapsed, 'lag': scheduler.lag_stats(),
+                 'rss_mb': peak_rss_mb()})
+
+
+def run(args):
+    """One load test run; returns the results as a dict"""
+    with StubServer(hosts=args.hosts, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                    timeout_rate=args.timeout_rate, seed=args.seed) as server, \
+            tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'loadtest.db')
+        monitor = APIMonitor(db_path)
+        monitor.add_monitors([{'name': f'stub-{i}', 'url': server.urls[i % len(server.urls)],
+                               'check_interval': args.interval, 'timeout': args.timeout}
+                              for i in range(args.monitors)])
+        web = WebProcess(db_path)
+        web.get()  # opens the database and the report cache
+
+        stop = threading.Event()
+        measuring = _mp.Event()
+        latencies = []
+
+        def read():
+            while not stop.is_set():
+                measured = measuring.is_set()
+                start = time.perf_counter()
+                web.get()
+                if measured:
+                    latencies.append(time.perf_counter() - start)
+
+        readers = [threading.Thread(target=read, daemon=True) for _ in range(args.readers)]
+        for reader in readers:
+            reader.start()
+
+        results = _mp.Queue()
+        worker = _mp.Process(target=_run_worker, args=(db_path, args.warmup, args.duration, measuring, results),
+                             daemon=True)
+        worker.start()
+        worker_results = results.get()
+        worker.join()
+        elapsed = worker_results['elapsed']
+        stop.set()
+        for reader in readers:
+            reader.join()
+        web_rss = web.stop()
+
+        with monitor.db.connect() as conn:
+            times = [row[0] for row in conn.execute('SELECT response_time FROM checks WHERE id > ?',
+                                                    (worker_results['first_id'],))]
+            outcomes = dict(conn.execute('''
+                SELECT CASE WHEN error_message IS NULL THEN 'ok'
+                            WHEN error_message = 'Request timed out' THEN 'timeout'
+                            WHEN status_code IS NOT NULL THEN 'http_error'
+                            ELSE 'other' END, COUNT(*)
+                FROM checks WHERE id > ? GROUP BY 1
+            ''', (worker_results['first_id'],)).fetchall())
+
+    lag = worker_results['lag']
+    return {
+        'settings': {name: getattr(args, name) for name in SETTINGS},
+        'checks': len(times),
+        'outcomes': outcomes,
+        'checks_per_second': len(times) / elapsed,
+        'scheduled_per_second': args.monitors / args.interval,
+        'scheduler_lag_p99': lag['p99_lag'],
+        'check_time_p50': percentile(times, 0.50),
+        'check_time_p99': percentile(times, 0.99),
+        'api_requests': len(latencies),
+        'api_requests_per_second': len(latencies) / elapsed,
+        'api_latency_p50': percentile(latencies, 0.50),
+        'api_latency_p99': percentile(latencies, 0.99),
+        'worker_rss_mb': worker_results['rss_mb'],
+        'web_rss_mb': web_rss,
+    }
+
+
+def median_of(runs):
+    """Per-metric median of several run() results"""
+    results = dict(runs[0])
+    for metric, value in runs[0].items():
+        if isinstance(value, (int, float)):
+            results[metric] = sorted(run[metric] for run in runs)[len(runs) // 2]
+    results['runs'] = len(runs)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Descriptions of every metric that regressed past the tolerance"""
+    if baseline.get('settings') != results['settings']:
+        return ["baseline was recorded with different settings: "
+                f"{baseline.get('settings')} vs {results['settings']}"]
+    regressions = []
+    for metric, (higher_is_better, slack) in METRICS.items():
+        old, new = baseline.get(metric), results.get(metric)
+        if old is None or new is None:
+            continue
+        allowed = old * tolerance + slack
+        worse = old - new if higher_is_better else new - old
+        if worse > allowed:
+            regressions.append(f"{metric}: {new:.4g} vs baseline {old:.4g}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--monitors', type=int, default=2000)
+    parser.add_argument('--interval', type=int, default=5, help='check interval in seconds')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to measure for')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds to run before measuring')
+    parser.add_argument('--hosts', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.02, help='minimum response delay in seconds')
+    parser.add_argument('--jitter', type=float, default=0.03, help='mean extra delay (exponential)')
+    parser.add_argument('--error-rate', type=float, default=0.02, help='fraction of 500 responses')
+    parser.add_argument('--timeout-rate', type=float, default=0.01, help='fraction never answered')
+    parser.add_argument('--timeout', type=int, default=1, help='monitor timeout in seconds')
+    parser.add_argument('--readers', type=int, default=2, help='threads reading /api/monitors')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--runs', type=int, default=1, help='report the median of this many runs')
+    parser.add_argument('--output', help='write the results here as well as to stdout')
+    parser.add_argument('--baseline', help='results file to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results to --baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed fraction worse than baseline')
+    args = parser.parse_args()
+
+    results = median_of([run(args) for _ in range(args.runs)])
+    output = json.dumps(results, indent=2, sort_keys=True)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            f.write(output + '\n')
+        print(f"Saved baseline to {args.baseline}", file=sys.stderr)
+    elif args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("PERFORMANCE REGRESSION:\n  " + '\n  '.join(regressions), file=sys.stderr)
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
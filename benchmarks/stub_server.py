@@ -0,0 +1,106 @@
+"""
+Local stub HTTP server for benchmarks
+Answers every request with a fixed status after an optional delay and
+honours keep-alive. Runs in its own process so it doesn't share an event
+loop with the code under test.
+
+For load tests the delay can vary (latency plus an exponentially
+distributed jitter with the given mean), and a fraction of requests can
+fail with a 500 or never be answered at all, so checks time out.
+"""
+
+import asyncio
+import multiprocessing
+import random
+import socket
+
+# How long an unanswered request is held open; longer than any check timeout
+HANG = 3600
+
+
+def _free_ports(count):
+    sockets, ports = [], []
+    for _ in range(count):
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        sockets.append(s)
+        ports.append(s.getsockname()[1])
+    for s in sockets:
+        s.close()
+    return ports
+
+
+async def _serve(ports, status, latency, ready, jitter=0.0, error_rate=0.0, timeout_rate=0.0, seed=None):
+    body = b'ok'
+    head = f"HTTP/1.1 {status} OK\r\nContent-Length: {len(body)}\r\n"
+    error_head = f"HTTP/1.1 500 Internal Server Error\r\nContent-Length: {len(body)}\r\n"
+    rng = random.Random(seed)
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                keep_alive = False
+                line = await reader.readline()
+                if not line:
+                    break
+                while line not in (b'\r\n', b''):
+                    if line.lower() == b'connection: keep-alive\r\n':
+                        keep_alive = True
+                    line = await reader.readline()
+                outcome = rng.random()
+                if outcome < timeout_rate:
+                    await asyncio.sleep(HANG)
+                    break
+                delay = latency + (rng.expovariate(1 / jitter) if jitter else 0)
+                if delay:
+                    await asyncio.sleep(delay)
+                connection = 'keep-alive' if keep_alive else 'close'
+                response_head = error_head if outcome < timeout_rate + error_rate else head
+                writer.write(f"{response_head}Connection: {connection}\r\n\r\n".encode() + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    servers = [await asyncio.start_server(handle, '127.0.0.1', port, backlog=4096) for port in ports]
+    ready.set()
+    await asyncio.gather(*(server.serve_forever() for server in servers))
+
+
+def _run(ports, status, latency, ready, *distribution):
+    asyncio.run(_serve(ports, status, latency, ready, *distribution))
+
+
+class StubServer:
+    """Context manager that serves on `hosts` local ports.
+    Each port counts as a separate host for per-host limits."""
+
+    def __init__(self, hosts=1, status=200, latency=0.0, jitter=0.0, error_rate=0.0, timeout_rate=0.0,
+                 seed=None):
+        """Each response waits latency + an exponential jitter (mean
+        `jitter` seconds); error_rate of them are 500s and timeout_rate
+        are never answered. seed makes the sequence repeatable."""
+        self.ports = _free_ports(hosts)
+        self.status = status
+        self.latency = latency
+        self.distribution = (jitter, error_rate, timeout_rate, seed)
+        self.process = None
+
+    @property
+    def urls(self):
+        return [f"http://127.0.0.1:{port}/" for port in self.ports]
+
+    def __enter__(self):
+        ready = multiprocessing.Event()
+        self.process = multiprocessing.Process(
+            target=_run, args=(self.ports, self.status, self.latency, ready) + self.distribution, daemon=True)
+        self.process.start()
+        ready.wait(10)
+        return self
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.join()
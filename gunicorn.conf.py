@@ -0,0 +1,18 @@
+"""
+gunicorn settings for the web process: gunicorn -c gunicorn.conf.py src.wsgi:app
+
+/api/stream responses never end, so sync workers won't do: one open
+dashboard would hold the only worker until the timeout killed it. gthread
+workers serve each request on its own thread and heartbeat from the main
+loop, so a stream holds just one thread and never trips the timeout.
+Each worker takes at most MAX_STREAMS streams (see app.py) and keeps its
+other threads for the API.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+threads = int(os.environ.get('WEB_THREADS', 32))
+timeout = 30
@@ -25,14 +25,11 @@ setup(
     ],
     python_requires=">=3.8",
     install_requires=[
-        "requests>=2.31.0",
         "flask>=3.0.0",
-        "schedule>=1.2.0",
     ],
     entry_points={
         "console_scripts": [
-            "api-monitor=src.monitor:main",
-            "api-dashboard=src.dashboard:main",
+            "api-monitor=src.main:main",
         ],
     },
 )
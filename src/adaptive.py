@@ -0,0 +1,140 @@
+"""
+Adaptive checking (opt in with ADAPTIVE_CHECKS=1)
+Three adjustments the engine makes from the results it sees:
+
+- Rechecks: after a failure, or the first success after failures, the
+  monitor is checked again after a fraction of its interval (never sooner
+  than RECHECK_MIN_INTERVAL or its tenant's tier allows) until enough
+  results agree to confirm or clear the problem. Confirmed states go back to the normal interval.
+- Timeout backoff: every timeout or connection error in a row on a host
+  halves the timeout its checks get, down to MIN_TIMEOUT, so a dead host
+  stops holding slots for the full timeout.
+- Circuit breaking: after CIRCUIT_FAILURES such errors in a row the host's
+  circuit opens and its checks fail immediately without a request. After
+  a cooldown one probe with the full timeout is let through; success
+  closes the circuit, failure reopens it for twice as long.
+
+Nothing here checks a monitor less often than its interval.
+"""
+
+import time
+
+try:
+    from . import tenants
+    from .config import Config
+except ImportError:  # running from inside src/
+    import tenants
+    from config import Config
+
+# Errors that mean the host itself is unreachable (see engine.perform_check)
+TIMED_OUT = "Request timed out"
+CONNECTION_ERROR = "Connection error"
+CIRCUIT_OPEN = "Circuit open: host unreachable"
+
+RECHECK_FRACTION = 0.2
+MAX_COOLDOWN = 300
+
+
+class HostBreaker:
+    __slots__ = ('failures', 'opens', 'open_until', 'probing')
+
+    def __init__(self):
+        self.failures = 0
+        self.opens = 0
+        self.open_until = None
+        self.probing = False
+
+
+class MonitorStreak:
+    __slots__ = ('ok', 'count')
+
+    def __init__(self, ok, count):
+        self.ok = ok
+        self.count = count
+
+
+class AdaptivePolicy:
+    def __init__(self, confirm=None, min_recheck=None, min_timeout=None, circuit_failures=None,
+                 cooldown=None, clock=time.monotonic):
+        """confirm: results in a row that settle a monitor's state (the
+        alert confirmation count by default)"""
+        self.confirm = confirm or Config.ALERT_CONFIRM_FAILURES
+        self.min_recheck = Config.RECHECK_MIN_INTERVAL if min_recheck is None else min_recheck
+        self.min_timeout = min_timeout or Config.MIN_TIMEOUT
+        self.circuit_failures = circuit_failures or Config.CIRCUIT_FAILURES
+        self.cooldown = cooldown or Config.CIRCUIT_COOLDOWN
+        self.clock = clock
+        self._hosts = {}
+        self._monitors = {}
+
+    def admit(self, host, timeout):
+        """Timeout to check with, or None to fail the check without a
+        request because the host's circuit is open"""
+        breaker = self._hosts.get(host)
+        if breaker is None:
+            return timeout
+        if breaker.open_until is not None:
+            if breaker.probing or self.clock() < breaker.open_until:
+                return None
+            breaker.probing = True
+            return timeout
+        return max(self.min_timeout, timeout / 2 ** breaker.failures)
+
+    def record_host(self, host, result):
+        """Feed the result of a check that was admitted"""
+        if result['error'] not in (TIMED_OUT, CONNECTION_ERROR):
+            # Any response at all, even a wrong status, means the host is there
+            self._hosts.pop(host, None)
+            return
+        breaker = self._hosts.get(host)
+        if breaker is None:
+            breaker = self._hosts[host] = HostBreaker()
+        breaker.failures += 1
+        if breaker.probing or (breaker.open_until is None and breaker.failures >= self.circuit_failures):
+            breaker.probing = False
+            breaker.opens += 1
+            cooldown = min(MAX_COOLDOWN, self.cooldown * 2 ** (breaker.opens - 1))
+            breaker.open_until = self.clock() + cooldown
+            print(f"Circuit open for {host} for {cooldown:g}s after {breaker.failures} failures")
+
+    def is_open(self, host):
+        breaker = self._hosts.get(host)
+        return breaker is not None and breaker.open_until is not None
+
+    def recheck_in(self, monitor, result):
+        """Seconds until `monitor` should be checked again ahead of its
+        interval, or None to keep the interval"""
+        ok = result['error'] is None
+        streak = self._monitors.get(monitor['id'])
+        if streak is None:
+            # Unknown monitors are assumed settled and up
+            streak = self._monitors[monitor['id']] = MonitorStreak(True, self.confirm)
+        if ok == streak.ok:
+            streak.count += 1
+        else:
+            streak.ok, streak.count = ok, 1
+        if streak.count >= self.confirm:
+            return None
+        # A tenant's tier bounds how often rechecks may come
+        tier = tenants.tier_of(monitor)
+        floor = self.min_recheck if tier is None else max(self.min_recheck, tier.min_recheck)
+        delay = max(floor, monitor['check_interval'] * RECHECK_FRACTION)
+        return delay if delay < monitor['check_interval'] else None
+
+    def forget(self, monitor_id):
+        self._monitors.pop(monitor_id, None)
+
+    def retain(self, monitor_ids):
+        """Forget every monitor not in monitor_ids (a full schedule)"""
+        for monitor_id in [m for m in self._monitors if m not in monitor_ids]:
+            self.forget(monitor_id)
+
+
+def circuit_open_result():
+    # Nothing was sent, so there is no response time to average in
+    return {
+        'status_code': None,
+        'response_time': None,
+        'error': CIRCUIT_OPEN,
+        'connection_reused': False,
+    }
@@ -0,0 +1,290 @@
+"""
+Alert state tracking and delivery
+AlertTracker keeps a small state machine per monitor (up, down, flapping)
+and reports only transitions: a monitor goes down once N of its last M
+checks have failed, comes back up once N of them have succeeded, and is
+flapping while its results keep changing. The check writer stores each
+transition as a pending row in the alerts table, in the same transaction
+as the check, and AlertDelivery sends those rows from its own thread with
+retries, a per-recipient rate limit and one email per recipient per batch.
+Slow responses are alerted the same way, as degraded/recovered events
+from the latency detector in anomaly.py.
+"""
+
+import threading
+import time
+from collections import deque
+
+try:
+    from .config import Config
+except ImportError:  # running from inside src/
+    from config import Config
+
+UP = 'up'
+DOWN = 'down'
+FLAPPING = 'flapping'
+# Response-time events (see anomaly.py); they don't change the up/down state
+DEGRADED = 'degraded'
+RECOVERED = 'recovered'
+
+# Share of state changes between consecutive checks that starts and ends flapping
+FLAP_START = 0.5
+FLAP_STOP = 0.25
+FLAP_WINDOW = 20
+# Fewer checks than this are never called flapping
+FLAP_MIN_CHECKS = 10
+
+
+class MonitorState:
+    __slots__ = ('state', 'confirmed', 'recent', 'history')
+
+    def __init__(self, state, window):
+        self.state = state
+        self.confirmed = UP if state == FLAPPING else state
+        self.recent = deque(maxlen=window)
+        self.history = deque(maxlen=FLAP_WINDOW)
+
+
+class AlertTracker:
+    def __init__(self, failures=None, window=None):
+        """A monitor is down when `failures` of its last `window` checks failed"""
+        self.failures = failures or Config.ALERT_CONFIRM_FAILURES
+        self.window = max(window or Config.ALERT_CONFIRM_WINDOW, self.failures)
+        self._states = {}
+
+    def state(self, monitor_id):
+        entry = self._states.get(monitor_id)
+        return entry.state if entry else None
+
+    def observe(self, monitor_id, succeeded, initial=UP):
+        """Feed one check result. Returns (old_state, new_state) on a
+        transition, else None. `initial` is the stored state of a monitor
+        this tracker hasn't seen yet (after a restart or a handover)."""
+        entry = self._states.get(monitor_id)
+        if entry is None:
+            entry = self._states[monitor_id] = MonitorState(initial or UP, self.window)
+        entry.recent.append(succeeded)
+        entry.history.append(succeeded)
+
+        failed = entry.recent.count(False)
+        if failed >= self.failures:
+            entry.confirmed = DOWN
+        elif len(entry.recent) - failed >= self.failures:
+            entry.confirmed = UP
+
+        rate = flap_rate(entry.history)
+        if entry.state == FLAPPING:
+            new = entry.confirmed if rate < FLAP_STOP else FLAPPING
+        else:
+            new = FLAPPING if rate >= FLAP_START else entry.confirmed
+
+        if new == entry.state:
+            return None
+        old, entry.state = entry.state, new
+        return old, new
+
+    def forget(self, monitor_id):
+        self._states.pop(monitor_id, None)
+
+
+def flap_rate(history):
+    if len(history) < FLAP_MIN_CHECKS:
+        return 0.0
+    changes = sum(1 for a, b in zip(history, list(history)[1:]) if a != b)
+    return changes / (len(history) - 1)
+
+
+def alert_message(name, url, state, error=None):
+    if state == DOWN:
+        return f"Monitor '{name}' is DOWN: {error}\nURL: {url}"
+    if state == UP:
+        return f"Monitor '{name}' is back UP\nURL: {url}"
+    if state == DEGRADED:
+        return f"Monitor '{name}' is DEGRADED: {error}\nURL: {url}"
+    if state == RECOVERED:
+        return f"Monitor '{name}' response time is back to normal{f' ({error})' if error else ''}\nURL: {url}"
+    return f"Monitor '{name}' is FLAPPING between up and down{f' (last error: {error})' if error else ''}\nURL: {url}"
+
+
+def recipients(email_alerts):
+    return [address.strip() for address in (email_alerts or '').split(',') if address.strip()]
+
+
+class RateLimiter:
+    """Token bucket per key: `rate` sends per `per` seconds, in bursts of up to `rate`"""
+
+    def __init__(self, rate, per, clock=time.time):
+        self.rate = rate
+        self.per = per
+        self.clock = clock
+        self._buckets = {}
+
+    def _refill(self, key):
+        now = self.clock()
+        tokens, updated = self._buckets.get(key, (self.rate, now))
+        tokens = min(self.rate, tokens + (now - updated) * self.rate / self.per)
+        self._buckets[key] = (tokens, now)
+        return tokens, now
+
+    def acquire(self, key):
+        tokens, now = self._refill(key)
+        if tokens < 1:
+            return False
+        self._buckets[key] = (tokens - 1, now)
+        return True
+
+    def available_at(self, key):
+        tokens, now = self._refill(key)
+        return now + max(0.0, 1 - tokens) * self.per / self.rate
+
+
+class SMTPSender:
+    def __init__(self, host=None, port=None, username=None, password=None,
+                 starttls=None, sender=None, timeout=10):
+        self.host = host or Config.SMTP_HOST
+        self.port = port or Config.SMTP_PORT
+        self.username = username if username is not None else Config.SMTP_USERNAME
+        self.password = password if password is not None else Config.SMTP_PASSWORD
+        self.starttls = Config.SMTP_STARTTLS if starttls is None else starttls
+        self.sender = sender or Config.ALERT_FROM_EMAIL
+        self.timeout = timeout
+
+    def __call__(self, recipient, subject, body):
+        # Only the worker sends mail; keep smtplib and email out of the web process
+        import smtplib
+        from email.mime.text import MIMEText
+
+        message = MIMEText(body)
+        message['Subject'] = subject
+        message['From'] = self.sender
+        message['To'] = recipient
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.sendmail(self.sender, [recipient], message.as_string())
+
+
+def log_sender(recipient, subject, body):
+    """Used when no SMTP server is configured"""
+    print(f"ALERT to {recipient}: {subject}\n{body}")
+
+
+class AlertDelivery:
+    """Drains pending alert rows. Rows are claimed in a write transaction
+    with a short lease, so several worker nodes can run one each without
+    sending anything twice, and a node that dies mid-send only delays its
+    batch until the lease runs out."""
+
+    def __init__(self, db, send=None, rate=None, per=3600, max_attempts=5,
+                 interval=1.0, claim_timeout=60, clock=time.time):
+        if send is None:
+            send = SMTPSender() if Config.SMTP_HOST else log_sender
+        self.db = db
+        self.send = send
+        self.limiter = RateLimiter(rate or Config.ALERT_RATE_LIMIT, per, clock)
+        self.max_attempts = max_attempts
+        self.interval = interval
+        self.claim_timeout = claim_timeout
+        self.clock = clock
+        self.sent = 0
+        self._stop = threading.Event()
+
+    def claim(self, limit=100):
+        """{recipient: [alert rows]} for recipients with at least one alert
+        due; their not-yet-due alerts ride along in the same email"""
+        now = self.clock()
+        with self.db.connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            due = [row[0] for row in conn.execute('''
+                SELECT DISTINCT recipient FROM alerts
+                WHERE delivery_status IN ('pending', 'sending') AND next_attempt_at <= ?
+                LIMIT ?
+            ''', (now, limit))]
+            if not due:
+                return {}
+            placeholders = ','.join('?' * len(due))
+            rows = conn.execute(f'''
+                SELECT id, recipient, event, message, attempts FROM alerts
+                WHERE delivery_status IN ('pending', 'sending')
+                AND recipient IN ({placeholders})
+                AND (delivery_status = 'pending' OR next_attempt_at <= ?)
+                ORDER BY id
+            ''', due + [now]).fetchall()
+            conn.executemany('''
+                UPDATE alerts SET delivery_status = 'sending', next_attempt_at = ? WHERE id = ?
+            ''', [(now + self.claim_timeout, row['id']) for row in rows])
+        batches = {}
+        for row in rows:
+            batches.setdefault(row['recipient'], []).append(row)
+        return batches
+
+    def deliver_once(self):
+        """Send everything currently due; returns the number of emails sent"""
+        emails = 0
+        for recipient, rows in self.claim().items():
+            now = self.clock()
+            ids = [(row['id'],) for row in rows]
+            if not self.limiter.acquire(recipient):
+                # Held back; more alerts may join the batch in the meantime
+                with self.db.connect() as conn:
+                    conn.executemany('''
+                        UPDATE alerts SET delivery_status = 'pending', next_attempt_at = ? WHERE id = ?
+                    ''', [(self.limiter.available_at(recipient), row['id']) for row in rows])
+                continue
+            try:
+                self.send(recipient, *digest(rows))
+            except Exception as e:
+                print(f"Alert delivery to {recipient} failed: {e}")
+                attempts = max(row['attempts'] for row in rows) + 1
+                with self.db.connect() as conn:
+                    if attempts >= self.max_attempts:
+                        conn.executemany('''
+                            UPDATE alerts SET delivery_status = 'failed', attempts = attempts + 1 WHERE id = ?
+                        ''', ids)
+                    else:
+                        conn.executemany('''
+                            UPDATE alerts SET delivery_status = 'pending', attempts = attempts + 1,
+                                              next_attempt_at = ?
+                            WHERE id = ?
+                        ''', [(now + backoff(attempts), row['id']) for row in rows])
+                continue
+            with self.db.connect() as conn:
+                conn.executemany('''
+                    UPDATE alerts SET delivery_status = 'sent', delivered_at = CURRENT_TIMESTAMP WHERE id = ?
+                ''', ids)
+            emails += 1
+            self.sent += len(rows)
+        return emails
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                self.deliver_once()
+            except Exception as e:
+                print(f"Alert delivery error: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        thread = threading.Thread(target=self.run_forever, name='alert-delivery', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+
+
+def backoff(attempts):
+    return min(30 * 2 ** (attempts - 1), 3600)
+
+
+def digest(rows):
+    """(subject, body) for one recipient's batch of alerts"""
+    if len(rows) == 1:
+        subject = rows[0]['message'].split('\n', 1)[0]
+    else:
+        down = sum(1 for row in rows if row['event'] == DOWN)
+        degraded = sum(1 for row in rows if row['event'] == DEGRADED)
+        subject = f"{len(rows)} monitor alerts ({down} down{f', {degraded} degraded' if degraded else ''})"
+    return subject, '\n\n'.join(row['message'] for row in rows)
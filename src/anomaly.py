@@ -0,0 +1,111 @@
+"""
+Response-time anomaly detection
+Each monitor keeps an exponentially weighted mean and variance of its log
+response time (latency is roughly log-normal, so a 2x slowdown looks the
+same at 20ms as at 2s). A successful check whose latency is far above
+that baseline counts as an outlier; a run of them marks the monitor
+degraded, and a run of normal checks clears it. Updates are O(1) and the
+state per monitor is a handful of floats.
+
+Outliers are kept out of the baseline so a regression can't hide itself.
+While degraded the baseline still follows at a much slower rate, so a
+permanent change of level is eventually accepted as the new normal.
+"""
+
+import math
+
+try:
+    from .alerts import DEGRADED, RECOVERED
+except ImportError:  # running from inside src/
+    from alerts import DEGRADED, RECOVERED
+
+# Weight of each new check in the baseline (about the last 50 checks)
+ALPHA = 0.02
+SLOW_ALPHA = ALPHA / 10
+# Checks needed before the baseline is trusted
+WARMUP = 20
+# An outlier is this many standard deviations above the baseline...
+Z_ENTER = 4.0
+Z_EXIT = 2.0
+# ...and at least this many times slower than usual, so very steady
+# endpoints don't alert on a few milliseconds of jitter
+MIN_RATIO = 2.0
+# Standard deviation floor, in log space
+MIN_STD = 0.1
+# Consecutive outliers to become degraded, normal checks to recover
+CONFIRM = 3
+MIN_LATENCY = 0.001
+
+
+class LatencyBaseline:
+    __slots__ = ('mean', 'var', 'count', 'streak', 'degraded')
+
+    def __init__(self):
+        self.mean = 0.0
+        self.var = 0.0
+        self.count = 0
+        self.streak = 0
+        self.degraded = False
+
+    def usual(self):
+        """Typical response time in seconds"""
+        return math.exp(self.mean)
+
+    def update(self, x, alpha):
+        delta = x - self.mean
+        self.mean += alpha * delta
+        self.var = (1 - alpha) * (self.var + alpha * delta * delta)
+
+    def observe(self, response_time):
+        """Feed one successful check; returns DEGRADED or RECOVERED on a
+        change of state, else None"""
+        x = math.log(max(response_time, MIN_LATENCY))
+        self.count += 1
+        if self.count <= WARMUP:
+            # Plain running mean and variance until the EWMA has enough history
+            delta = x - self.mean
+            self.mean += delta / self.count
+            self.var += (delta * (x - self.mean) - self.var) / self.count
+            return None
+
+        deviation = x - self.mean
+        z = deviation / max(math.sqrt(self.var), MIN_STD)
+        outlier = z >= Z_ENTER and deviation >= math.log(MIN_RATIO)
+        normal = z < Z_EXIT
+
+        if not self.degraded:
+            if outlier:
+                self.streak += 1
+                if self.streak >= CONFIRM:
+                    self.degraded = True
+                    self.streak = 0
+                    return DEGRADED
+            else:
+                self.streak = 0
+                self.update(x, ALPHA)
+            return None
+
+        self.update(x, SLOW_ALPHA)
+        self.streak = self.streak + 1 if normal else 0
+        if self.streak >= CONFIRM:
+            self.degraded = False
+            self.streak = 0
+            return RECOVERED
+        return None
+
+
+class LatencyTracker:
+    def __init__(self):
+        self._baselines = {}
+
+    def observe(self, monitor_id, response_time):
+        baseline = self._baselines.get(monitor_id)
+        if baseline is None:
+            baseline = self._baselines[monitor_id] = LatencyBaseline()
+        return baseline.observe(response_time)
+
+    def baseline(self, monitor_id):
+        return self._baselines.get(monitor_id)
+
+    def forget(self, monitor_id):
+        self._baselines.pop(monitor_id, None)
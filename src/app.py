@@ -1,22 +1,28 @@
 """
-Combined web dashboard and monitoring service
-Runs monitoring in a background thread
+Web dashboard and API
+Checks are run by the worker (src/worker.py); this process only reads
+the database and streams new check rows to the dashboard. create_app()
+builds the Flask app without touching the database or starting threads;
+those happen on the first request that needs them.
 """
 
-from flask import Flask, render_template_string, jsonify
-import sqlite3
-import json
+from flask import Blueprint, Flask, current_app, render_template_string, jsonify, request, Response, stream_with_context
+from functools import wraps
+import hmac
 import threading
-import time
 import os
-from datetime import datetime
 
 # Import our monitor
 import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from monitor import APIMonitor
+from report_cache import ReportCache
+from events import EventBroker, CheckPublisher, CheckTailer, TooManySubscribers
+import export
+from config import Config
+from validation import ValidationError
 
-app = Flask(__name__)
+bp = Blueprint('web', __name__)
 
 # HTML template (same as before)
 HTML_TEMPLATE = '''
@@ -53,109 +59,343 @@ HTML_TEMPLATE = '''
         </div>
     </div>
     
+    <template id="monitor-card">
+        <div class="monitor-card">
+            <h3 class="name"></h3>
+            <p>URL: <span class="url"></span></p>
+            <p>Status: <span class="status"></span></p>
+            <div class="stats">
+                <div class="stat-box">
+                    <strong class="uptime"></strong><br>
+                    <small>Uptime (24h)</small>
+                </div>
+                <div class="stat-box">
+                    <strong class="avg"></strong><br>
+                    <small>Avg Response</small>
+                </div>
+                <div class="stat-box">
+                    <strong class="p99"></strong><br>
+                    <small>p99 Response</small>
+                </div>
+                <div class="stat-box">
+                    <strong class="last"></strong><br>
+                    <small>Last Response</small>
+                </div>
+                <div class="stat-box">
+                    <strong class="total"></strong><br>
+                    <small>Total Checks</small>
+                </div>
+            </div>
+        </div>
+    </template>
+    
     <script>
+        const cards = new Map();
+        const seconds = value => value == null ? 'N/A' : value.toFixed(3) + 's';
+        
+        function setStatus(card, up) {
+            const status = card.querySelector('.status');
+            status.className = 'status ' + (up ? 'status-ok' : 'status-error');
+            status.textContent = up ? 'Operational' : 'Issues Detected';
+        }
+        
+        function renderCard(monitor) {
+            let card = cards.get(monitor.id);
+            if (!card) {
+                card = document.getElementById('monitor-card').content.firstElementChild.cloneNode(true);
+                card.dataset.monitorId = monitor.id;
+                cards.set(monitor.id, card);
+            }
+            const stats = monitor.stats_24h;
+            card.querySelector('.name').textContent = monitor.name;
+            card.querySelector('.url').textContent = monitor.url;
+            card.querySelector('.uptime').textContent = stats.uptime_percentage.toFixed(2) + '%';
+            card.querySelector('.avg').textContent = seconds(stats.avg_response_time);
+            card.querySelector('.p99').textContent = seconds(stats.p99_response_time);
+            card.querySelector('.total').textContent = stats.total_checks;
+            setStatus(card, stats.uptime_percentage == 100);
+            return card;
+        }
+        
         function loadMonitors() {
             fetch('/api/monitors')
                 .then(response => response.json())
                 .then(data => {
                     const container = document.getElementById('monitors');
-                    container.innerHTML = '';
                     
                     if (!data.monitors || data.monitors.length === 0) {
                         container.innerHTML = '<p>No monitors yet. Monitoring will start shortly...</p>';
+                        cards.clear();
                         return;
                     }
                     
-                    data.monitors.forEach(monitor => {
-                        const uptime = monitor.stats_24h.uptime_percentage.toFixed(2);
-                        const avgResponse = monitor.stats_24h.avg_response_time ? monitor.stats_24h.avg_response_time.toFixed(3) : 'N/A';
-                        const statusClass = uptime == 100 ? 'status-ok' : 'status-error';
-                        const statusText = uptime == 100 ? 'Operational' : 'Issues Detected';
-                        
-                        const card = `
-                            <div class="monitor-card">
-                                <h3>${monitor.name}</h3>
-                                <p>URL: ${monitor.url}</p>
-                                <p>Status: <span class="${statusClass}">${statusText}</span></p>
-                                <div class="stats">
-                                    <div class="stat-box">
-                                        <strong>${uptime}%</strong><br>
-                                        <small>Uptime (24h)</small>
-                                    </div>
-                                    <div class="stat-box">
-                                        <strong>${avgResponse}s</strong><br>
-                                        <small>Avg Response</small>
-                                    </div>
-                                    <div class="stat-box">
-                                        <strong>${monitor.stats_24h.total_checks}</strong><br>
-                                        <small>Total Checks</small>
-                                    </div>
-                                </div>
-                            </div>
-                        `;
-                        container.innerHTML += card;
-                    });
+                    // Build every card off-document and attach them in one go
+                    const fragment = document.createDocumentFragment();
+                    data.monitors.forEach(monitor => fragment.appendChild(renderCard(monitor)));
+                    container.replaceChildren(fragment);
                 });
         }
         
-        // Load monitors on page load and refresh every 30 seconds
+        // Full reloads: every 5 minutes while streaming, every 30s without
+        let poll = null;
+        function pollEvery(ms) {
+            clearInterval(poll);
+            poll = setInterval(loadMonitors, ms);
+        }
+        
+        // The 24h aggregates come from the server; a burst of checks
+        // triggers one reload (cheap: unchanged reports get a 304)
+        let refresh = null;
+        function refreshSoon() {
+            if (!refresh) refresh = setTimeout(() => { refresh = null; loadMonitors(); }, 30000);
+        }
+        
+        // Live updates patch only the card they belong to
+        let retryDelay = 5000;
+        function connectStream() {
+            const stream = new EventSource('/api/stream');
+            stream.onopen = () => {
+                retryDelay = 5000;
+                pollEvery(300000);
+            };
+            stream.onerror = () => {
+                pollEvery(30000);
+                // Refused (every stream slot taken) or failed: the browser
+                // gives up, so try again later, backing off
+                if (stream.readyState === EventSource.CLOSED) {
+                    setTimeout(connectStream, retryDelay);
+                    retryDelay = Math.min(retryDelay * 2, 300000);
+                }
+            };
+            stream.addEventListener('check', event => {
+                const check = JSON.parse(event.data);
+                const card = cards.get(check.monitor_id);
+                if (!card) return;
+                card.querySelector('.last').textContent = seconds(check.response_time);
+                refreshSoon();
+            });
+            stream.addEventListener('status', event => {
+                const change = JSON.parse(event.data);
+                const card = cards.get(change.monitor_id);
+                if (card) setStatus(card, change.up);
+                else loadMonitors();
+            });
+            stream.addEventListener('reset', loadMonitors);
+        }
+        
+        // Load monitors on page load and stream changes; poll every 30s
+        // until the stream is open
         loadMonitors();
-        setInterval(loadMonitors, 30000);
+        pollEvery(30000);
+        connectStream();
     </script>
 </body>
 </html>
 '''
 
-@app.route('/')
+@bp.route('/')
 def index():
     return render_template_string(HTML_TEMPLATE)
 
-@app.route('/api/monitors')
+class WebState:
+    """Per-app resources, created on first use"""
+
+    def __init__(self, database_path, monitor=None):
+        self.database_path = database_path
+        self.broker = EventBroker()
+        self._monitor = monitor
+        self._report_cache = None
+        self._tailer = None
+        self._lock = threading.Lock()
+
+    @property
+    def monitor(self):
+        """Process-wide APIMonitor; schema setup runs once, not per request"""
+        with self._lock:
+            if self._monitor is None:
+                self._monitor = APIMonitor(self.database_path)
+            if self._report_cache is None:
+                self._report_cache = ReportCache(self._monitor)
+        return self._monitor
+
+    @property
+    def report_cache(self):
+        self.monitor  # opens the database and the cache on first use
+        return self._report_cache
+
+    def start_tailer(self):
+        # Checks are written by the worker process; follow the table once
+        # someone is listening
+        monitor = self.monitor
+        with self._lock:
+            if self._tailer is None:
+                self._tailer = CheckTailer(monitor, CheckPublisher(self.broker))
+                self._tailer.start()
+
+def _state():
+    return current_app.extensions['api_monitor']
+
+def get_monitor():
+    return _state().monitor
+
+def get_report_cache():
+    return _state().report_cache
+
+@bp.route('/api/monitors')
 def api_monitors():
-    # Generate report on the fly
-    monitor = APIMonitor(os.environ.get('DATABASE_PATH', '/tmp/api_monitor.db'))
-    report = monitor.generate_report()
-    return jsonify(report)
-
-def run_monitoring():
-    """Background thread for monitoring"""
-    monitor = APIMonitor(os.environ.get('DATABASE_PATH', '/tmp/api_monitor.db'))
-    
-    # Add initial monitors if database is empty
-    conn = sqlite3.connect(monitor.db_path)
-    cursor = conn.cursor()
-    cursor.execute('SELECT COUNT(*) FROM monitors')
-    count = cursor.fetchone()[0]
-    conn.close()
-    
-    if count == 0:
-        print("Adding initial monitors...")
-        monitor.add_monitor("GitHub API", "https://api.github.com", check_interval=300)
-        monitor.add_monitor("JSONPlaceholder", "https://jsonplaceholder.typicode.com/posts/1", check_interval=300)
-        monitor.add_monitor("httpbin.org", "https://httpbin.org/status/200", check_interval=300)
-    
-    # Run monitoring loop
-    while True:
-        try:
-            conn = sqlite3.connect(monitor.db_path)
-            cursor = conn.cursor()
-            cursor.execute('SELECT id FROM monitors WHERE is_active = 1')
-            monitors = cursor.fetchall()
-            conn.close()
-            
-            for (monitor_id,) in monitors:
-                monitor.check_endpoint(monitor_id)
-            
-            # Wait 5 minutes before next check
-            time.sleep(300)
-        except Exception as e:
-            print(f"Monitoring error: {e}")
-            time.sleep(60)  # Wait 1 minute on error
-
-# Start monitoring in background thread
-monitoring_thread = threading.Thread(target=run_monitoring, daemon=True)
-monitoring_thread.start()
+    # Served from memory; rebuilt only when new checks have landed
+    body, etag = get_report_cache().get()
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@bp.route('/api/stream')
+def api_stream():
+    """Server-Sent Events: one 'check' event per result, 'status' on up/down changes"""
+    last_id = request.headers.get('Last-Event-ID')
+    if last_id is not None and not last_id.isdigit():
+        last_id = None
+    state = _state()
+    try:
+        # Every stream holds a server thread; keep some for everything else
+        stream = state.broker.subscribe(last_id, limit=Config.MAX_STREAMS)
+    except TooManySubscribers:
+        return Response("Too many open streams\n", status=503, mimetype='text/plain',
+                        headers={'Retry-After': '30'})
+    state.start_tailer()
+    return Response(stream, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def admin_only(view):
+    """Refuse the request unless it carries "Authorization: Bearer
+    <ADMIN_TOKEN>"; with no ADMIN_TOKEN configured the route is off"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = Config.ADMIN_TOKEN
+        if not token:
+            return jsonify({'error': "the admin API is disabled; set ADMIN_TOKEN"}), 403
+        given = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(given.encode(), f'Bearer {token}'.encode()):
+            return jsonify({'error': "admin token required"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+MAX_BULK = 10000
+
+def _bulk_payload(key):
+    """The list under `key` in the JSON body (a bare list is accepted too)"""
+    payload = request.get_json(silent=True)
+    items = payload.get(key) if isinstance(payload, dict) else payload
+    if not isinstance(items, list):
+        raise ValidationError([{'index': None, 'field': key, 'message': "must be a list"}])
+    if len(items) > MAX_BULK:
+        raise ValidationError([{'index': None, 'field': key, 'message': f"at most {MAX_BULK} per request"}])
+    return items
+
+@bp.route('/api/monitors/bulk', methods=['POST'])
+@admin_only
+def api_bulk_create():
+    """Create monitors in one transaction: {"monitors": [{"name", "url",
+    "tenant_id", ...}]}; every monitor needs a tenant, whose tier limits
+    it, and a URL on a public address"""
+    try:
+        ids = get_monitor().add_monitors(_bulk_payload('monitors'), require_tenant=True, public_only=True)
+    except ValidationError as e:
+        return jsonify({'errors': e.errors}), 400
+    return jsonify({'ids': ids}), 201
+
+@bp.route('/api/monitors/bulk', methods=['PATCH'])
+@admin_only
+def api_bulk_update():
+    """Partial updates in one transaction: {"monitors": [{"id", field: value}]}"""
+    try:
+        updated = get_monitor().update_monitors(_bulk_payload('monitors'), require_tenant=True,
+                                                 public_only=True)
+    except ValidationError as e:
+        return jsonify({'errors': e.errors}), 400
+    return jsonify({'updated': updated})
+
+@bp.route('/api/monitors/bulk/deactivate', methods=['POST'])
+@admin_only
+def api_bulk_deactivate():
+    """Stop checking monitors: {"ids": [1, 2, 3]}"""
+    try:
+        ids = _bulk_payload('ids')
+        if not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            raise ValidationError([{'index': None, 'field': 'ids', 'message': "must be integers"}])
+    except ValidationError as e:
+        return jsonify({'errors': e.errors}), 400
+    return jsonify({'deactivated': get_monitor().deactivate_monitors(ids)})
+
+@bp.route('/api/tenants', methods=['POST'])
+@admin_only
+def api_create_tenant():
+    """Create a tenant: {"name", "tier": "free"|"pro"|"business"}"""
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'errors': [{'index': None, 'field': None, 'message': "must be an object"}]}), 400
+    try:
+        tenant_id = get_monitor().add_tenant(payload.get('name'), payload.get('tier', 'free'))
+    except ValidationError as e:
+        return jsonify({'errors': e.errors}), 400
+    return jsonify({'id': tenant_id}), 201
+
+@bp.route('/api/tenants/<int:tenant_id>')
+def api_tenant(tenant_id):
+    """The tenant's tier, limits, monitor count and checks per hour; ?hours=24"""
+    hours = request.args.get('hours', 24, type=int)
+    stats = get_monitor().tenant_stats(tenant_id, hours)
+    if stats is None:
+        return jsonify({'error': "no such tenant"}), 404
+    return jsonify(stats)
+
+@bp.route('/api/tenants/<int:tenant_id>', methods=['PATCH'])
+@admin_only
+def api_update_tenant(tenant_id):
+    """Change the tenant's tier: {"tier": ...}"""
+    payload = request.get_json(silent=True)
+    try:
+        found = get_monitor().set_tenant_tier(tenant_id, payload.get('tier') if isinstance(payload, dict) else None)
+    except ValidationError as e:
+        return jsonify({'errors': e.errors}), 400
+    if not found:
+        return jsonify({'error': "no such tenant"}), 404
+    return jsonify({'id': tenant_id})
+
+@bp.route('/api/checks/export')
+def api_export_checks():
+    """Raw check history, streamed page by page with chunked encoding.
+    ?format=csv|ndjson|arrow|parquet&monitor_id=1&monitor_id=2&start=...&end=...
+    Raw checks are only kept for RAW_RETENTION_DAYS: a range that ends before
+    that is refused, and one that starts before it is flagged with an
+    X-Export-Truncated-Before header giving where the raw history starts."""
+    fmt = request.args.get('format', 'csv')
+    headers = {'Content-Disposition': f'attachment; filename=checks.{fmt}'}
+    try:
+        monitor_ids = [int(m) for m in request.args.getlist('monitor_id')] or None
+        start = export.parse_timestamp(request.args.get('start'), None)
+        end = export.parse_timestamp(request.args.get('end'), None)
+        earliest = export.raw_history_start()
+        if end is not None and end <= earliest:
+            raise export.ExportError(f"Raw checks before {earliest} are no longer kept; "
+                                     "older history is only available as stats")
+        if start is None or start < earliest:
+            headers['X-Export-Truncated-Before'] = earliest
+        chunks = export.export_checks(get_monitor().db, fmt, monitor_ids, start, end)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return Response(stream_with_context(chunks), mimetype=export.MIMETYPES[fmt], headers=headers)
+
+def create_app(database_path=None, monitor=None):
+    """The dashboard and API. `monitor` replaces the APIMonitor that would
+    otherwise be opened on DATABASE_PATH at the first request."""
+    app = Flask(__name__)
+    database_path = database_path or os.environ.get('DATABASE_PATH', '/tmp/api_monitor.db')
+    app.extensions['api_monitor'] = WebState(database_path, monitor)
+    app.register_blueprint(bp)
+    return app
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
+    create_app().run(host='0.0.0.0', port=port)
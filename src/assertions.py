@@ -0,0 +1,352 @@
+"""
+Response assertions and multi-step checks
+Beyond its expected status a monitor can carry three optional JSON fields:
+
+- headers: extra request headers, e.g. {"Authorization": "Bearer {{token}}"}
+- assertions: conditions on the response, each one of
+      {"type": "header", "name": "content-type", "contains": "json"}
+      {"type": "body", "contains": "ok"}   or   {"type": "body", "matches": "v\\d+"}
+      {"type": "json", "path": "$.data[0].status", "equals": "up"}
+  Operators are equals, contains and matches (a regex); a header or json
+  assertion without one only requires the value to be there.
+- steps: requests made in order before the monitor's own, each
+      {"url", "method", "headers", "body", "expected_status", "assertions",
+       "extract": {"token": {"json": "$.access_token"}}}
+  An extract source is {"json": path}, {"header": name} or {"regex": pattern}
+  (group 1 if it has one). Extracted values replace {{name}} in the url,
+  headers and body of every later request, the monitor's own included.
+
+Bodies are only read when an assertion or extraction needs them, a chunk
+at a time and never past MAX_BODY_BYTES. Reading stops as soon as every
+body condition is settled, so `contains` on a large download costs the
+bytes up to the match, not the download.
+"""
+
+import json
+import re
+from functools import lru_cache
+
+OPERATORS = ('equals', 'contains', 'matches')
+VERBS = {'equals': 'equal', 'contains': 'contain', 'matches': 'match'}
+ASSERTION_TYPES = ('header', 'body', 'json')
+EXTRACT_SOURCES = ('json', 'header', 'regex')
+STEP_FIELDS = ('name', 'url', 'method', 'headers', 'body', 'expected_status', 'assertions', 'extract')
+MAX_ASSERTIONS = 20
+MAX_STEPS = 5
+# Incremental searches start this far back into data already scanned, so
+# matches split across chunks are found early; longer ones are found by
+# the full search once the body ends
+OVERLAP = 4096
+
+VARIABLE_RE = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+PATH_TOKEN_RE = re.compile(r"\.([A-Za-z_][\w-]*)|\[(\d+)\]|\[(['\"])(.*?)\3\]")
+MISSING = object()
+
+
+def parse_path(path):
+    """Keys for a JSON path in the $.a.b[0]['c d'] subset"""
+    if not isinstance(path, str) or not path.startswith('$'):
+        raise ValueError("path must start with $")
+    keys = []
+    position = 1
+    while position < len(path):
+        match = PATH_TOKEN_RE.match(path, position)
+        if match is None:
+            raise ValueError(f"invalid path {path!r} at position {position}")
+        name, index, _, quoted = match.groups()
+        keys.append(int(index) if index is not None else name if name is not None else quoted)
+        position = match.end()
+    return tuple(keys)
+
+
+def resolve(document, keys):
+    for key in keys:
+        if isinstance(key, int):
+            if not isinstance(document, list) or key >= len(document):
+                return MISSING
+        elif not isinstance(document, dict) or key not in document:
+            return MISSING
+        document = document[key]
+    return document
+
+
+def _text(value):
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def _regex(pattern, binary=False):
+    if not isinstance(pattern, str):
+        raise ValueError("pattern must be a string")
+    try:
+        return re.compile(pattern.encode() if binary else pattern)
+    except re.error as e:
+        raise ValueError(f"invalid regex {pattern!r}: {e}")
+
+
+class Assertion:
+    """One compiled assertion. Body assertions are a bytes pattern found
+    while the body streams in; the others are judged once it's read."""
+
+    def __init__(self, spec):
+        if not isinstance(spec, dict) or spec.get('type') not in ASSERTION_TYPES:
+            raise ValueError(f"assertion type must be one of {', '.join(ASSERTION_TYPES)}")
+        self.kind = spec['type']
+        operators = [op for op in OPERATORS if op in spec]
+        if len(operators) > 1:
+            raise ValueError("assertion takes one of equals, contains or matches")
+        self.op = operators[0] if operators else None
+        self.expected = spec.get(self.op)
+        self.pattern = None
+
+        if self.kind == 'header':
+            if not isinstance(spec.get('name'), str) or not spec['name']:
+                raise ValueError("header assertion needs a name")
+            self.target = spec['name'].lower()
+            self.label = f"header {spec['name']}"
+        elif self.kind == 'json':
+            self.target = parse_path(spec.get('path'))
+            self.label = spec['path']
+        else:
+            if self.op not in ('contains', 'matches'):
+                raise ValueError("body assertion needs contains or matches")
+            self.label = 'body'
+        if self.op in ('contains', 'matches') and not isinstance(self.expected, str):
+            raise ValueError(f"{self.op} takes a string")
+        if self.kind == 'header' and self.op == 'equals' and not isinstance(self.expected, str):
+            raise ValueError("equals takes a string for headers")
+
+        if self.kind == 'body':
+            self.pattern = _regex(self.expected if self.op == 'matches' else re.escape(self.expected),
+                                  binary=True)
+        elif self.op == 'matches':
+            self.pattern = _regex(self.expected)
+
+    def failure(self, value):
+        """Why `value` fails this assertion, or None if it passes"""
+        if value is MISSING:
+            return f"{self.label} is missing"
+        if self.op is None:
+            return None
+        if self.op == 'equals':
+            passed = value == self.expected
+        elif self.op == 'contains':
+            passed = self.expected in _text(value)
+        else:
+            passed = self.pattern.search(_text(value)) is not None
+        if passed:
+            return None
+        return f"{self.label} is {value!r}, expected it to {VERBS[self.op]} {self.expected!r}"
+
+
+class Extraction:
+    """A value taken from a step's response for later requests"""
+
+    def __init__(self, name, spec):
+        if not isinstance(name, str) or not re.fullmatch(r'\w+', name):
+            raise ValueError(f"extract name {name!r} must be letters, digits or _")
+        if not isinstance(spec, dict) or len(spec) != 1 or next(iter(spec)) not in EXTRACT_SOURCES:
+            raise ValueError(f"extract {name} must be one of "
+                             f"{', '.join('{%r: ...}' % s for s in EXTRACT_SOURCES)}")
+        self.name = name
+        [(self.kind, source)] = spec.items()
+        self.pattern = None
+        if self.kind == 'json':
+            self.target = parse_path(source)
+        elif self.kind == 'header':
+            if not isinstance(source, str):
+                raise ValueError(f"extract {name}: header name must be a string")
+            self.target = source.lower()
+        else:
+            self.pattern = _regex(source, binary=True)
+        self.label = f"{self.kind} {source}"
+
+
+class Expectations:
+    """Assertions and extractions for one response"""
+
+    def __init__(self, assertions=None, extract=None):
+        if assertions is None:
+            assertions = []
+        if not isinstance(assertions, list) or len(assertions) > MAX_ASSERTIONS:
+            raise ValueError(f"assertions must be a list of at most {MAX_ASSERTIONS}")
+        if extract is None:
+            extract = {}
+        if not isinstance(extract, dict):
+            raise ValueError("extract must be an object")
+        self.assertions = [Assertion(spec) for spec in assertions]
+        self.extract = [Extraction(name, spec) for name, spec in extract.items()]
+        items = self.assertions + self.extract
+        self.patterns = [item for item in items if item.pattern is not None and item.kind in ('body', 'regex')]
+        self.needs_json = any(item.kind == 'json' for item in items)
+
+    def reader(self, limit):
+        """Body consumer for httpclient.request, or None if the body
+        doesn't matter and needn't be read at all"""
+        if self.patterns or self.needs_json:
+            return BodyReader(self, limit)
+        return None
+
+    def evaluate(self, response, body=None):
+        """(failure message or None, extracted values)"""
+        document = MISSING
+        if self.needs_json:
+            try:
+                document = json.loads(bytes(body.data))
+            except ValueError:
+                if body.truncated:
+                    return f"body is not valid JSON in its first {body.limit} bytes", {}
+                return "body is not valid JSON", {}
+
+        for assertion in self.assertions:
+            if assertion.kind == 'header':
+                message = assertion.failure(response.headers.get(assertion.target, MISSING))
+            elif assertion.kind == 'json':
+                message = assertion.failure(resolve(document, assertion.target))
+            elif assertion in body.found:
+                message = None
+            else:
+                message = f"body does not {VERBS[assertion.op]} {assertion.expected!r}"
+                if body.truncated:
+                    message += f" in its first {body.limit} bytes"
+            if message:
+                return message, {}
+
+        values = {}
+        for extraction in self.extract:
+            if extraction.kind == 'header':
+                value = response.headers.get(extraction.target, MISSING)
+            elif extraction.kind == 'json':
+                value = resolve(document, extraction.target)
+            else:
+                match = body.found.get(extraction)
+                value = MISSING if match is None else \
+                    match.group(1 if match.re.groups else 0).decode('utf-8', 'replace')
+            if value is MISSING:
+                return f"could not extract {extraction.name} from {extraction.label}", {}
+            values[extraction.name] = _text(value)
+        return None, values
+
+
+class BodyReader:
+    """Collects one response body, up to `limit` bytes, for an
+    Expectations. feed() returns True once nothing more is needed."""
+
+    def __init__(self, expectations, limit):
+        self.limit = limit
+        self.data = bytearray()
+        self.truncated = False
+        self.found = {}
+        self._pending = list(expectations.patterns)
+        # JSON can only be judged on the whole body
+        self._needs_all = expectations.needs_json
+        self._scanned = 0
+
+    def feed(self, chunk):
+        self.data += chunk[:self.limit - len(self.data)]
+        self._search(max(0, self._scanned - OVERLAP))
+        self._scanned = len(self.data)
+        return len(self.data) >= self.limit or not (self._pending or self._needs_all)
+
+    def finish(self, complete):
+        """Called once reading stops; complete is False if the body was
+        cut short, by the byte limit or because nothing more was needed"""
+        self.truncated = not complete
+        self._search(0)
+
+    def _search(self, start):
+        for item in list(self._pending):
+            match = item.pattern.search(self.data, start)
+            if match is not None:
+                self.found[item] = match
+                self._pending.remove(item)
+
+
+def _headers(headers):
+    if headers is None:
+        return {}
+    if not isinstance(headers, dict) or not all(isinstance(k, str) and isinstance(v, str)
+                                                and k and '\n' not in k + v and '\r' not in k + v
+                                                for k, v in headers.items()):
+        raise ValueError("headers must be an object of single-line strings")
+    return headers
+
+
+class Step:
+    """One request of a multi-step check"""
+
+    def __init__(self, spec, number):
+        if not isinstance(spec, dict):
+            raise ValueError(f"step {number} must be an object")
+        unknown = [field for field in spec if field not in STEP_FIELDS]
+        if unknown:
+            raise ValueError(f"step {number}: {unknown[0]} is not a step field")
+        self.name = spec.get('name') or f"step {number}"
+        self.url = spec.get('url')
+        if not isinstance(self.url, str) or not re.match(r'https?://', self.url):
+            raise ValueError(f"{self.name}: url must be an http(s) URL")
+        self.method = str(spec.get('method', 'GET')).upper()
+        self.headers = _headers(spec.get('headers'))
+        self.body = spec.get('body')
+        if self.body is not None and not isinstance(self.body, str):
+            raise ValueError(f"{self.name}: body must be a string")
+        self.expected_status = spec.get('expected_status', 200)
+        if isinstance(self.expected_status, bool) or not isinstance(self.expected_status, int):
+            raise ValueError(f"{self.name}: expected_status must be an integer")
+        try:
+            self.expectations = Expectations(spec.get('assertions'), spec.get('extract'))
+        except ValueError as e:
+            raise ValueError(f"{self.name}: {e}")
+
+
+class CheckPlan:
+    """Everything a monitor checks beyond its status: the steps before
+    its own request, and its own headers and assertions"""
+
+    def __init__(self, headers=None, assertions=None, steps=None):
+        if steps is None:
+            steps = []
+        if not isinstance(steps, list) or len(steps) > MAX_STEPS:
+            raise ValueError(f"steps must be a list of at most {MAX_STEPS}")
+        self.steps = [Step(spec, number) for number, spec in enumerate(steps, 1)]
+        self.headers = _headers(headers)
+        self.expectations = Expectations(assertions)
+
+
+def substitute(text, values):
+    """Fill {{name}} from values extracted by earlier steps"""
+    def replace(match):
+        if match.group(1) not in values:
+            raise KeyError(f"{{{{{match.group(1)}}}}} is not set by an earlier step")
+        return values[match.group(1)]
+    return VARIABLE_RE.sub(replace, text)
+
+
+@lru_cache(maxsize=4096)
+def _compile(headers, assertions, steps):
+    load = lambda text: None if text is None else json.loads(text)
+    return CheckPlan(load(headers), load(assertions), load(steps))
+
+
+def plan_for(monitor):
+    """CheckPlan for a monitors row or record, or None for a plain status
+    check. Plans are compiled once per distinct definition."""
+    headers, assertions, steps = monitor['headers'], monitor['assertions'], monitor['steps']
+    if headers is None and assertions is None and steps is None:
+        return None
+    return _compile(headers, assertions, steps)
+
+
+def problem(field, value):
+    """Validation message for a headers/assertions/steps value, or None"""
+    if value is None:
+        return None
+    try:
+        if field == 'headers':
+            _headers(value)
+        elif field == 'assertions':
+            Expectations(value)
+        else:
+            CheckPlan(steps=value)
+    except ValueError as e:
+        return str(e)
+    return None
@@ -14,6 +14,52 @@ class Config:
     # Monitoring settings
     DEFAULT_CHECK_INTERVAL = int(os.environ.get('CHECK_INTERVAL', 300))
     DEFAULT_TIMEOUT = int(os.environ.get('DEFAULT_TIMEOUT', 30))
+    CHECK_CONCURRENCY = int(os.environ.get('CHECK_CONCURRENCY', 200))
+    PER_HOST_CONCURRENCY = int(os.environ.get('PER_HOST_CONCURRENCY', 10))
+    HOST_POOL_SIZE = int(os.environ.get('HOST_POOL_SIZE', PER_HOST_CONCURRENCY))
+    # Most of a response body an assertion reads; bounds memory per check
+    MAX_BODY_BYTES = int(os.environ.get('MAX_BODY_BYTES', 256 * 1024))
+    WORKER_SHARDS = int(os.environ.get('WORKER_SHARDS', os.cpu_count() or 1))
+    # Seconds a worker node holds a monitor without renewing; a dead node's
+    # monitors move to the others after about this long
+    LEASE_TTL = float(os.environ.get('LEASE_TTL', 30))
+    # Adaptive checking (see adaptive.py): rechecks to confirm failures,
+    # shorter timeouts and circuit breaking for unreachable hosts
+    ADAPTIVE_CHECKS = os.environ.get('ADAPTIVE_CHECKS', '0') == '1'
+    RECHECK_MIN_INTERVAL = int(os.environ.get('RECHECK_MIN_INTERVAL', 10))
+    MIN_TIMEOUT = float(os.environ.get('MIN_TIMEOUT', 2))
+    CIRCUIT_FAILURES = int(os.environ.get('CIRCUIT_FAILURES', 5))
+    CIRCUIT_COOLDOWN = float(os.environ.get('CIRCUIT_COOLDOWN', 30))
+    # Seconds between writes of per-tenant check counts, and at most
+    # between re-reads of per-tenant monitor counts (see tenants.py)
+    USAGE_FLUSH_INTERVAL = float(os.environ.get('USAGE_FLUSH_INTERVAL', 60))
+    # Open /api/stream connections per web worker; each holds a thread,
+    # so keep it below gunicorn's threads (WEB_THREADS, gunicorn.conf.py)
+    MAX_STREAMS = int(os.environ.get('MAX_STREAMS', 24))
+    # Bearer token for the admin API (bulk monitor changes, tenants);
+    # unset disables it
+    ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+    # Prometheus /metrics from the worker; 0 turns it off
+    METRICS_PORT = int(os.environ.get('METRICS_PORT', 9108))
+    
+    # Alerting: a monitor is down once N of its last M checks failed
+    ALERT_CONFIRM_FAILURES = int(os.environ.get('ALERT_CONFIRM_FAILURES', 2))
+    ALERT_CONFIRM_WINDOW = int(os.environ.get('ALERT_CONFIRM_WINDOW', 3))
+    ALERT_RATE_LIMIT = int(os.environ.get('ALERT_RATE_LIMIT', 10))  # emails per recipient per hour
+    ALERT_FROM_EMAIL = os.environ.get('ALERT_FROM_EMAIL', 'alerts@apimonitor.io')
+    SMTP_HOST = os.environ.get('SMTP_HOST')
+    SMTP_PORT = int(os.environ.get('SMTP_PORT', 587))
+    SMTP_USERNAME = os.environ.get('SMTP_USERNAME')
+    SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD')
+    SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '1') == '1'
+    
+    # History retention, in days. Raw checks must outlive the longest stats
+    # window (7 days); older history is served from the rollups.
+    RAW_RETENTION_DAYS = int(os.environ.get('RAW_RETENTION_DAYS', 8))
+    MINUTE_ROLLUP_RETENTION_DAYS = int(os.environ.get('MINUTE_ROLLUP_RETENTION_DAYS', 30))
+    HOUR_ROLLUP_RETENTION_DAYS = int(os.environ.get('HOUR_ROLLUP_RETENTION_DAYS', 365))
+    ALERT_RETENTION_DAYS = int(os.environ.get('ALERT_RETENTION_DAYS', 365))
+    RETENTION_INTERVAL = int(os.environ.get('RETENTION_INTERVAL', 3600))
     
     # Flask settings
     DEBUG = os.environ.get('FLASK_ENV') == 'development'
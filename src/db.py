@@ -0,0 +1,187 @@
+"""
+SQLite connection management
+One Database per file hands out a connection per thread, configured for
+concurrent readers (WAL, synchronous=NORMAL, busy timeout). Check results
+are written by a single CheckWriter thread in batched transactions so the
+check loop never waits on disk and Flask readers never fight over locks.
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+try:
+    from . import metrics
+except ImportError:  # running from inside src/
+    import metrics
+
+BUSY_TIMEOUT_MS = 5000
+
+
+class Database:
+    # Worth retrying: usually "database is locked" past the busy timeout
+    transient_errors = (sqlite3.OperationalError,)
+
+    def __init__(self, path, busy_timeout=BUSY_TIMEOUT_MS, setup=None):
+        """setup(conn) runs on every new connection, e.g. to register SQL functions"""
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.setup = setup
+        self._local = threading.local()
+        # ':memory:' is a new empty database per connection, so in-memory
+        # databases share a single connection guarded by a lock instead
+        self.memory = path == ':memory:'
+        self._lock = threading.RLock()
+        self._shared = self._open() if self.memory else None
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout / 1000,
+                               check_same_thread=not self.memory)
+        conn.row_factory = sqlite3.Row
+        # Only takes effect on a new file, so it must precede journal_mode
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        if not self.memory:
+            conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout)}')
+        if self.setup is not None:
+            self.setup(conn)
+        return conn
+
+    def connection(self):
+        """This thread's connection, opened on first use"""
+        if self.memory:
+            return self._shared
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._open()
+        return conn
+
+    @contextmanager
+    def connect(self):
+        """Yield a connection inside a transaction: commit on success,
+        roll back on error. Don't nest on the same thread."""
+        with self._lock if self.memory else nullcontext():
+            conn = self.connection()
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def close(self):
+        """Close the calling thread's connection"""
+        if self.memory:
+            return
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def utc_timestamp(ts=None):
+    """Format like SQLite's CURRENT_TIMESTAMP so stored values compare the same"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts))
+
+
+class CheckWriter:
+    """Single writer thread that drains a queue of check results and
+    writes them with executemany, one transaction per batch."""
+
+    def __init__(self, db, write_batch, batch_size=1000, flush_interval=0.25, on_commit=None,
+                 prepare=None):
+        """db: a Database or a storage.Storage; write_batch(conn, items)
+        does the inserts for one batch; on_commit(items) runs after the
+        batch is committed. prepare(items), if given, runs once per batch
+        before the first attempt and write_batch gets its result instead
+        of the items: a failed attempt is retried with only the SQL run
+        again, so in-memory state changes go in prepare."""
+        self.db = db
+        self.write_batch = write_batch
+        self.on_commit = on_commit
+        self.prepare = prepare
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='check-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        self._queue.put(item)
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def flush(self, timeout=None):
+        """Block until everything submitted before this call is committed"""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch, waiters = [], []
+            stop = False
+            # Keep gathering for up to flush_interval so batches stay large,
+            # but write straight away if someone is waiting on a flush
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                if stop or waiters or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+
+            metrics.WRITE_QUEUE.set(self._queue.qsize())
+            if batch:
+                self._write(batch)
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                return
+
+    def _write(self, batch, attempts=3):
+        try:
+            prepared = batch if self.prepare is None else self.prepare(batch)
+        except Exception as e:
+            print(f"Check writer error: {e}")
+            print(f"Check writer dropped {len(batch)} results")
+            return
+        for attempt in range(attempts):
+            try:
+                start = time.perf_counter()
+                with self.db.connect() as conn:
+                    self.write_batch(conn, prepared)
+                metrics.DB_WRITE.observe(time.perf_counter() - start)
+                self.written += len(batch)
+            except self.db.transient_errors as e:
+                print(f"Check writer error (attempt {attempt + 1}): {e}")
+                time.sleep(0.1 * (attempt + 1))
+                continue
+            except Exception as e:
+                print(f"Check writer error: {e}")
+                break
+            if self.on_commit is not None:
+                try:
+                    self.on_commit(batch)
+                except Exception as e:
+                    print(f"Check writer listener error: {e}")
+            return
+        print(f"Check writer dropped {len(batch)} results")
@@ -0,0 +1,267 @@
+"""
+Async check engine
+Runs many endpoint checks concurrently on one event loop, bounded by a
+global concurrency limit and a per-host limit so one slow or dead host
+cannot stall the rest of the cycle. Global slots are shared between
+tenants by the weight of their tier (see fairqueue.py).
+"""
+
+import asyncio
+import time
+from collections import defaultdict
+
+try:
+    from . import assertions, httpclient, metrics, tenants
+    from .fairqueue import FairLimiter
+    from .adaptive import AdaptivePolicy, TIMED_OUT, CONNECTION_ERROR, circuit_open_result
+    from .config import Config
+except ImportError:  # running from inside src/
+    import assertions
+    import httpclient
+    import metrics
+    import tenants
+    from fairqueue import FairLimiter
+    from adaptive import AdaptivePolicy, TIMED_OUT, CONNECTION_ERROR, circuit_open_result
+    from config import Config
+
+
+class CheckEngine:
+    def __init__(self, monitor, concurrency=None, per_host=None, pool_size=None, policy=None):
+        """policy: an adaptive.AdaptivePolicy; one is created when
+        ADAPTIVE_CHECKS is set"""
+        self.monitor = monitor
+        self.concurrency = concurrency or Config.CHECK_CONCURRENCY
+        self.per_host = per_host or Config.PER_HOST_CONCURRENCY
+        self.pool_size = pool_size or Config.HOST_POOL_SIZE
+        if policy is None and Config.ADAPTIVE_CHECKS:
+            policy = AdaptivePolicy()
+        self.policy = policy
+
+    def run(self, monitor_ids):
+        """Check the given monitors and record the results. Blocks until done."""
+        return asyncio.run(self.run_checks(monitor_ids))
+
+    async def run_checks(self, monitor_ids):
+        monitors = self.monitor.get_monitors(monitor_ids)
+        if not monitors:
+            return []
+
+        self._reset_limits()
+        try:
+            results = await asyncio.gather(*(self._bounded(m) for m in monitors))
+        finally:
+            self._pool.close()
+        self.monitor.record_checks(results)
+        return results
+
+    def run_forever(self, scheduler, **kwargs):
+        """Fire each monitor when the scheduler says it's due. Never returns."""
+        asyncio.run(self.run_scheduled(scheduler, **kwargs))
+
+    async def run_scheduled(self, scheduler, refresh_interval=300, tick=1.0, report_interval=300):
+        loop = asyncio.get_running_loop()
+        self._reset_limits()
+        registry = self.monitor.registry
+        running = set()
+        tasks = set()
+        last_refresh = float('-inf')
+        last_report = scheduler.clock()
+
+        async def fire(monitor, intended):
+            try:
+                result = await self._bounded(monitor, scheduler, intended)
+                # Hand off to the writer thread; never block the loop on disk
+                self.monitor.submit_checks([result])
+                # A monitor dropped while its check was in flight stays forgotten
+                if self.policy is not None and monitor['id'] in registry:
+                    delay = self.policy.recheck_in(monitor, result[1])
+                    if delay is not None:
+                        scheduler.expedite(monitor['id'], delay)
+            finally:
+                running.discard(monitor['id'])
+
+        async def start_delays(ids):
+            # Monitors new to this scheduler pick up where their last check left off
+            new_ids = [monitor_id for monitor_id in ids if monitor_id not in scheduler]
+            if not new_ids:
+                return {}
+            return await loop.run_in_executor(None, self.monitor.get_start_delays, new_ids)
+
+        while True:
+            now = scheduler.clock()
+            if now - last_refresh >= refresh_interval:
+                schedule = await loop.run_in_executor(None, registry.refresh)
+                scheduler.sync(schedule, await start_delays(schedule))
+                if self.policy is not None:
+                    self.policy.retain(schedule)
+                last_refresh = now
+            else:
+                # Creates, edits and deactivations between full refreshes
+                changes = await loop.run_in_executor(None, registry.poll)
+                if changes:
+                    added = [m for m, interval in changes.items() if interval is not None]
+                    scheduler.apply(changes, await start_delays(added))
+                    if self.policy is not None:
+                        for monitor_id, interval in changes.items():
+                            if interval is None:
+                                self.policy.forget(monitor_id)
+
+            fired = dict(scheduler.pop_due())
+            # A check still in flight (e.g. waiting on a timeout) is not
+            # started again; it simply keeps its next slot
+            for monitor_id, intended in fired.items():
+                monitor = registry.get(monitor_id)
+                if monitor is None or monitor_id in running:
+                    continue
+                running.add(monitor_id)
+                task = asyncio.ensure_future(fire(monitor, intended))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            if now - last_report >= report_interval:
+                lag = scheduler.lag_stats()
+                print(f"Scheduler: {len(scheduler)} monitors, {len(running)} in flight, "
+                      f"{self.monitor.writer.qsize()} queued writes, "
+                      f"lag avg {lag['avg_lag']:.3f}s p99 {lag['p99_lag']:.3f}s max {lag['max_lag']:.3f}s")
+                last_report = now
+
+            await asyncio.sleep(min(scheduler.time_until_next(), tick))
+
+    def _reset_limits(self):
+        # Semaphores and the pool are created per run so they belong to the running loop
+        self._limit = FairLimiter(self.concurrency)
+        self._host_limits = defaultdict(lambda: asyncio.Semaphore(self.per_host))
+        self._pool = httpclient.ConnectionPool(max_per_host=self.pool_size)
+
+    async def _bounded(self, monitor, scheduler=None, intended=None):
+        host = self._host_key(monitor['url'])
+        timeout = monitor['timeout']
+        if self.policy is not None:
+            timeout = self.policy.admit(host, timeout)
+            if timeout is None:
+                # Circuit open: fail at once instead of waiting on a dead host
+                if scheduler is not None:
+                    metrics.SCHEDULER_LAG.observe(scheduler.record_fire(intended))
+                metrics.CHECKS.inc(labels=('circuit_open',))
+                return monitor, circuit_open_result()
+
+        # Take the host slot first so requests queued behind a slow host
+        # don't hold global slots other hosts could use
+        async with self._host_limits[host]:
+            async with self._limit.slot(tenants.tenant_of(monitor), tenants.weight_of(monitor)):
+                if scheduler is not None:
+                    metrics.SCHEDULER_LAG.observe(scheduler.record_fire(intended))
+                metrics.IN_FLIGHT.inc()
+                start = time.perf_counter()
+                try:
+                    result = await self.check(monitor, timeout)
+                finally:
+                    metrics.IN_FLIGHT.dec()
+                metrics.CHECK_DURATION.observe(time.perf_counter() - start)
+                metrics.CHECKS.inc(labels=('ok' if result['error'] is None else 'error',))
+        if self.policy is not None:
+            self.policy.record_host(host, result)
+        return monitor, result
+
+    async def check(self, monitor, timeout=None):
+        """Perform one check; the result has the same shape as check_endpoint's"""
+        return await perform_check(monitor, self._pool, timeout)
+
+    @staticmethod
+    def _host_key(url):
+        try:
+            return httpclient.host_key(url)
+        except ValueError:
+            return url
+
+
+async def perform_check(monitor, pool=None, timeout=None):
+    """Check one monitor row. Monitors with keep_alive set borrow a pooled
+    connection; the rest open a fresh one so cold-connect latency is measured.
+    `timeout` overrides the monitor's own, and bounds all of a multi-step
+    check's requests together. Times come from a monotonic clock, and a
+    check that times out records how long it actually ran."""
+    expected_status = monitor['expected_status']
+    timeout = monitor['timeout'] if timeout is None else timeout
+    timings = httpclient.Timings()
+    options = {'timeout': timeout, 'pool': pool if monitor['keep_alive'] else None,
+               'timings': timings, 'dns_ttl': monitor['dns_ttl']}
+
+    start_time = time.perf_counter()
+    error_message = None
+    status_code = None
+    connection_reused = False
+
+    try:
+        plan = assertions.plan_for(monitor)
+        if plan is None:
+            # Plain status check: the body is never read
+            response = await httpclient.request(monitor['method'], monitor['url'], **options)
+            failure = None
+        else:
+            response, failure = await asyncio.wait_for(_run_plan(plan, monitor, options), timeout)
+        if response is not None:
+            status_code = response.status_code
+            connection_reused = response.connection_reused
+
+        if failure is not None:
+            error_message = failure
+        elif status_code != expected_status:
+            error_message = f"Expected status {expected_status}, got {status_code}"
+
+    except (httpclient.RequestTimeout, asyncio.TimeoutError):
+        error_message = TIMED_OUT
+    except httpclient.ConnectError:
+        error_message = CONNECTION_ERROR
+    except Exception as e:
+        error_message = str(e)
+    # A phase cut short by an error or the timeout still counts
+    timings.stop()
+
+    return {
+        'status_code': status_code,
+        'response_time': time.perf_counter() - start_time,
+        'error': error_message,
+        'connection_reused': connection_reused,
+        'timings': timings.as_dict(),
+    }
+
+
+async def _run_plan(plan, monitor, options):
+    """Run a monitor's steps and then its own request. Returns the last
+    response and why the check failed, or None if every step passed (the
+    monitor's expected status is left to the caller)."""
+    values = {}
+    for step in plan.steps:
+        try:
+            url = assertions.substitute(step.url, values)
+            headers = {name: assertions.substitute(value, values) for name, value in step.headers.items()}
+            data = None if step.body is None else assertions.substitute(step.body, values)
+        except KeyError as e:
+            return None, f"{step.name}: {e.args[0]}"
+        response, body = await _fetch(step.method, url, step.expectations, options, headers, data)
+        if response.status_code != step.expected_status:
+            return response, f"{step.name}: Expected status {step.expected_status}, got {response.status_code}"
+        failure, extracted = step.expectations.evaluate(response, body)
+        if failure is not None:
+            return response, f"{step.name}: Assertion failed: {failure}"
+        values.update(extracted)
+
+    try:
+        url = assertions.substitute(monitor['url'], values)
+        headers = {name: assertions.substitute(value, values) for name, value in plan.headers.items()}
+    except KeyError as e:
+        return None, e.args[0]
+    response, body = await _fetch(monitor['method'], url, plan.expectations, options, headers)
+    if response.status_code != monitor['expected_status']:
+        return response, None
+    failure, _ = plan.expectations.evaluate(response, body)
+    return response, None if failure is None else f"Assertion failed: {failure}"
+
+
+async def _fetch(method, url, expectations, options, headers=None, data=None):
+    """(response, body reader or None if no assertion needed the body);
+    options are httpclient.request keywords shared by a check's requests"""
+    body = expectations.reader(Config.MAX_BODY_BYTES)
+    response = await httpclient.request(method, url, headers=headers, data=data, consumer=body, **options)
+    return response, body
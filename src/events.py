@@ -0,0 +1,176 @@
+"""
+Fan-out of live check events to Server-Sent Events subscribers
+Each event is serialized once into a shared ring buffer; subscribers only
+keep a cursor into it and wait on one condition variable, so adding
+subscribers never adds SQLite queries or per-subscriber copies.
+"""
+
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+try:
+    from .rollups import PHASES
+except ImportError:  # running from inside src/
+    from rollups import PHASES
+
+KEEPALIVE_SECONDS = 15
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Subscription:
+    """Iterator of SSE messages for one subscriber. Counted from the moment
+    it is opened until close(), whether or not it was ever read."""
+
+    def __init__(self, broker, messages):
+        self._broker = broker
+        self._messages = messages
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._messages)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._messages.close()
+            self._broker._leave()
+
+
+class EventBroker:
+    def __init__(self, history=1000):
+        self._events = deque(maxlen=history)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self.subscribers = 0
+
+    @property
+    def last_id(self):
+        return self._seq
+
+    def publish(self, event, data):
+        self.publish_many([(event, data)])
+
+    def publish_many(self, events):
+        """Publish (event, data) pairs with a single wake-up of subscribers"""
+        with self._cond:
+            for event, data in events:
+                self._seq += 1
+                message = f"id: {self._seq}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+                self._events.append((self._seq, message))
+            self._cond.notify_all()
+
+    def subscribe(self, last_id=None, keepalive=KEEPALIVE_SECONDS, limit=None):
+        """A Subscription of SSE messages. Resumes after last_id (the
+        browser's Last-Event-ID) when it is still in the buffer, else
+        starts live. Raises TooManySubscribers if `limit` are already open."""
+        with self._cond:
+            if limit is not None and self.subscribers >= limit:
+                raise TooManySubscribers()
+            cursor = self._seq if last_id is None else min(int(last_id), self._seq)
+            self.subscribers += 1
+        return Subscription(self, self._messages(cursor, keepalive))
+
+    def _leave(self):
+        with self._cond:
+            self.subscribers -= 1
+
+    def _messages(self, cursor, keepalive):
+        yield "retry: 3000\n\n"
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(lambda: self._seq > cursor, keepalive):
+                    message = None
+                else:
+                    if self._events and self._events[0][0] > cursor + 1:
+                        # Fell behind the ring buffer; tell the client to resync
+                        message = "event: reset\ndata: {}\n\n"
+                        cursor = self._seq
+                    else:
+                        # Sequence numbers are contiguous, so skip straight to the cursor
+                        start = cursor + 1 - self._events[0][0]
+                        message = ''.join(m for _, m in itertools.islice(self._events, start, None))
+                        cursor = self._seq
+            # Write outside the lock so a slow client never blocks publishers
+            yield message if message is not None else ": keepalive\n\n"
+
+
+class CheckPublisher:
+    """Check writer listener that turns committed check results into
+    'check' events, plus a 'status' event when a monitor goes up or down"""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self._up = {}
+
+    def __call__(self, batch):
+        events = []
+        for monitor, result, checked_at in batch:
+            monitor_id = monitor['id']
+            up = result['error'] is None
+            events.append(('check', {
+                'monitor_id': monitor_id,
+                'status_code': result['status_code'],
+                'response_time': result['response_time'],
+                'timings': result.get('timings'),
+                'error': result['error'],
+                'checked_at': checked_at,
+            }))
+            if self._up.get(monitor_id) != up:
+                self._up[monitor_id] = up
+                events.append(('status', {'monitor_id': monitor_id, 'up': up, 'error': result['error']}))
+        self.broker.publish_many(events)
+
+
+class CheckTailer:
+    """Follows the checks table and hands new rows to a listener in the
+    same (monitor, result, checked_at) batches the check writer produces.
+    The web process uses it to publish checks written by the worker."""
+
+    def __init__(self, monitor, listener, interval=1.0, batch_size=1000):
+        self.monitor = monitor
+        self.listener = listener
+        self.interval = interval
+        self.batch_size = batch_size
+        # Live events only; history is what /api/monitors is for
+        self.last_id = monitor.storage.last_check_id()
+
+    def poll(self):
+        """Publish checks committed since the last poll; returns how many"""
+        rows = self.monitor.storage.checks_after(self.last_id, self.batch_size)
+        if not rows:
+            return 0
+        self.last_id = rows[-1]['id']
+        self.listener([({'id': row['monitor_id']},
+                        {'status_code': row['status_code'],
+                         'response_time': row['response_time'],
+                         'error': row['error_message'],
+                         'connection_reused': row['connection_reused'],
+                         'timings': {phase: None if row[f'{phase}_us'] is None else row[f'{phase}_us'] / 1e6
+                                     for phase in PHASES}},
+                        row['checked_at'])
+                       for row in rows])
+        return len(rows)
+
+    def run_forever(self):
+        while True:
+            try:
+                # Keep going without sleeping while there is a backlog
+                if self.poll() < self.batch_size:
+                    time.sleep(self.interval)
+            except Exception as e:
+                print(f"Check tailer error: {e}")
+                time.sleep(self.interval)
+
+    def start(self):
+        thread = threading.Thread(target=self.run_forever, name='check-tailer', daemon=True)
+        thread.start()
+        return thread
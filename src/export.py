@@ -0,0 +1,218 @@
+"""
+Streaming export of raw check history
+Checks are read one page at a time with keyset pagination, each page in
+its own short read transaction, and every page is encoded and handed on
+before the next one is read. Memory use depends on the page size, not on
+the size of the range, and no read transaction stays open long enough to
+hold up WAL checkpoints.
+
+Formats: csv, ndjson, and with pyarrow installed, arrow (IPC stream, one
+record batch per page) and parquet (row groups of PARQUET_ROW_GROUP rows).
+
+Raw checks are only kept for RAW_RETENTION_DAYS (see retention.py); older
+history survives only as rollups, so raw_history_start() tells callers
+where an export is cut short.
+"""
+
+import csv
+import io
+import json
+import time
+from datetime import datetime
+
+try:
+    from .config import Config
+    from .db import utc_timestamp
+except ImportError:  # running from inside src/
+    from config import Config
+    from db import utc_timestamp
+
+PAGE_SIZE = 5000
+PARQUET_ROW_GROUP = 100000
+
+COLUMNS = ('id', 'monitor_id', 'checked_at', 'status_code', 'response_time',
+           'error_message', 'connection_reused',
+           'dns_us', 'connect_us', 'tls_us', 'ttfb_us', 'transfer_us')
+REUSED = COLUMNS.index('connection_reused')
+
+# One monitor's checks in (checked_at, id) order after a cursor, served by
+# idx_checks_monitor_time (the index carries the rowid)
+MONITOR_PAGE_QUERY = f'''
+    SELECT {', '.join(COLUMNS)} FROM checks
+    WHERE monitor_id = ?
+    AND (checked_at, id) > (?, ?) AND checked_at < ?
+    ORDER BY checked_at, id
+    LIMIT ?
+'''
+
+# Every monitor's checks in (checked_at, id) order after a cursor; used
+# when no monitors are given, served by idx_checks_time
+ALL_PAGE_QUERY = f'''
+    SELECT {', '.join(COLUMNS)} FROM checks
+    WHERE (checked_at, id) > (?, ?) AND checked_at < ?
+    ORDER BY checked_at, id
+    LIMIT ?
+'''
+
+MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+START_OF_TIME = '0000-01-01 00:00:00'
+END_OF_TIME = '9999-12-31 23:59:59'
+
+
+class ExportError(ValueError):
+    pass
+
+
+def parse_timestamp(value, default):
+    """Accept 'YYYY-MM-DD', 'YYYY-MM-DD HH:MM:SS' or ISO 8601 (UTC)"""
+    if not value:
+        return default
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            continue
+    raise ExportError(f"Invalid timestamp: {value}")
+
+
+def raw_history_start(now=None):
+    """Oldest checked_at the retention job keeps raw checks for"""
+    return utc_timestamp((time.time() if now is None else now) - Config.RAW_RETENTION_DAYS * 86400)
+
+
+def iter_pages(db, monitor_ids=None, start=None, end=None, page_size=PAGE_SIZE):
+    """Yield lists of check tuples (in COLUMNS order) for checks in
+    [start, end), monitor by monitor, or in time order across all monitors
+    when none are given"""
+    start = start or START_OF_TIME
+    end = end or END_OF_TIME
+    for monitor_id in [None] if monitor_ids is None else monitor_ids:
+        # Just before the first check at `start`
+        cursor = (start, -1)
+        while True:
+            with db.connect() as conn:
+                if monitor_id is None:
+                    rows = conn.execute(ALL_PAGE_QUERY, (cursor[0], cursor[1], end, page_size))
+                else:
+                    rows = conn.execute(MONITOR_PAGE_QUERY, (monitor_id, cursor[0], cursor[1], end, page_size))
+                page = [tuple(row) for row in rows]
+            if not page:
+                break
+            yield page
+            if len(page) < page_size:
+                break
+            cursor = (page[-1][2], page[-1][0])
+
+
+def csv_chunks(pages):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for page in pages:
+        writer.writerows(page)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def ndjson_chunks(pages):
+    for page in pages:
+        yield ''.join(json.dumps(dict(zip(COLUMNS, row))) + '\n' for row in page).encode()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that collects what pyarrow writes until it is taken"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportError("Arrow and Parquet export need pyarrow (pip install pyarrow)")
+    return pa
+
+
+def arrow_chunks(pages, parquet=False):
+    pa = _pyarrow()
+    schema = pa.schema([
+        ('id', pa.int64()),
+        ('monitor_id', pa.int64()),
+        ('checked_at', pa.string()),
+        ('status_code', pa.int32()),
+        ('response_time', pa.float64()),
+        ('error_message', pa.string()),
+        ('connection_reused', pa.bool_()),
+    ] + [(column, pa.int64()) for column in COLUMNS[REUSED + 1:]])
+    sink = _ChunkSink()
+    writer = pa.parquet.ParquetWriter(sink, schema) if parquet else pa.ipc.new_stream(sink, schema)
+    pending, pending_rows = [], 0
+    try:
+        for page in pages:
+            columns = list(zip(*page))
+            # SQLite stores booleans as 0/1
+            columns[REUSED] = [None if value is None else bool(value) for value in columns[REUSED]]
+            batch = pa.record_batch([pa.array(column, type=field.type)
+                                     for column, field in zip(columns, schema)], schema=schema)
+            if not parquet:
+                writer.write_batch(batch)
+                yield sink.take()
+                continue
+            # Parquet keeps metadata per row group until the footer, so
+            # pages are gathered into fewer, larger row groups
+            pending.append(batch)
+            pending_rows += len(page)
+            if pending_rows >= PARQUET_ROW_GROUP:
+                writer.write_table(pa.Table.from_batches(pending))
+                pending, pending_rows = [], 0
+                yield sink.take()
+        if pending:
+            writer.write_table(pa.Table.from_batches(pending))
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def export_checks(db, fmt='csv', monitor_ids=None, start=None, end=None, page_size=PAGE_SIZE):
+    """Generator of encoded chunks, one (or so) per page of checks"""
+    if db is None:
+        raise ExportError("Export reads the SQLite database; it isn't available with PostgreSQL storage")
+    if fmt not in MIMETYPES:
+        raise ExportError(f"Unknown format '{fmt}'; expected one of {', '.join(MIMETYPES)}")
+    pages = iter_pages(db, monitor_ids, start, end, page_size)
+    if fmt == 'csv':
+        return csv_chunks(pages)
+    if fmt == 'ndjson':
+        return ndjson_chunks(pages)
+    # Fail on a missing pyarrow now, before any response is started
+    _pyarrow()
+    return arrow_chunks(pages, parquet=fmt == 'parquet')
@@ -0,0 +1,74 @@
+"""
+Weighted fair sharing of check slots across tenants
+FairLimiter stands in for the engine's global asyncio.Semaphore. A plain
+semaphore wakes waiters first come, first served, so a tenant with
+thousands of monitors due at once fills the queue and everyone else's
+checks wait behind it. Here each tenant has its own queue, and a freed
+slot goes to the waiting tenant with the lowest virtual start time
+(start-time fair queuing): every slot a tenant gets advances its clock by
+1/weight, so under contention tenants get slots in proportion to their
+weights, and an idle tenant's next check goes straight to the front.
+"""
+
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+class FairLimiter:
+    def __init__(self, limit):
+        self.free = limit
+        self._queues = {}    # tenant -> deque of (future, weight)
+        self._finish = {}    # tenant -> virtual finish time of its last slot
+        self._virtual = 0.0
+
+    def waiting(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    @asynccontextmanager
+    async def slot(self, tenant, weight=1):
+        await self.acquire(tenant, weight)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, tenant, weight=1):
+        if self.free > 0 and not self._queues:
+            self.free -= 1
+            self._account(tenant, weight)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(tenant, deque()).append((future, weight))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as we were cancelled; hand the slot on
+                self.release()
+            raise
+
+    def release(self):
+        self.free += 1
+        self._wake()
+
+    def _start(self, tenant):
+        return max(self._virtual, self._finish.get(tenant, 0.0))
+
+    def _account(self, tenant, weight):
+        start = self._start(tenant)
+        self._finish[tenant] = start + 1 / weight
+        self._virtual = start
+
+    def _wake(self):
+        while self.free > 0 and self._queues:
+            tenant = min(self._queues, key=self._start)
+            queue = self._queues[tenant]
+            future, weight = queue.popleft()
+            if not queue:
+                del self._queues[tenant]
+            if future.done():
+                continue  # cancelled while waiting
+            self.free -= 1
+            self._account(tenant, weight)
+            future.set_result(None)
@@ -0,0 +1,655 @@
+"""
+Minimal asyncio HTTP/1.1 client used by the check engine
+Only speaks as much HTTP as a check needs - gzip and deflate bodies are
+decoded, but there are no cookies - so thousands of checks can share one
+event loop.
+Connections are either opened fresh per request or borrowed from a
+keep-alive ConnectionPool. Response bodies are never held whole: they are
+skipped, drained in chunks for reuse, or streamed to a consumer.
+
+Callers can pass a Timings to see where a request spent its time: DNS,
+TCP connect, TLS handshake, time to first byte and the rest of the
+transfer. Name lookups go through a DNSCache with a TTL chosen per call.
+
+Proxies come from the environment as they did with requests: HTTP_PROXY
+and HTTPS_PROXY (http:// proxies, optionally with user:password@) and
+NO_PROXY. https:// URLs are tunnelled with CONNECT; the DNS and connect
+timings are then the proxy's.
+"""
+
+import asyncio
+import base64
+import ipaddress
+import socket
+import ssl
+import threading
+import time
+import urllib.request
+import zlib
+from collections import defaultdict, deque
+from urllib.parse import unquote, urlsplit, urljoin
+
+USER_AGENT = 'api-monitor/0.1'
+MAX_REDIRECTS = 30
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+# Bodies larger than this are not drained for reuse; the connection is dropped
+MAX_DRAIN_BYTES = 1024 * 1024
+CHUNK_SIZE = 16 * 1024
+PHASES = ('dns', 'connect', 'tls', 'ttfb', 'transfer')
+
+
+class HTTPClientError(Exception):
+    pass
+
+
+class RequestTimeout(HTTPClientError):
+    pass
+
+
+class ConnectError(HTTPClientError):
+    pass
+
+
+class Response:
+    def __init__(self, url, status_code, reason, headers, connection_reused=False):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.connection_reused = connection_reused
+
+
+class Timings:
+    """Seconds spent in each phase, summed over every request it is passed
+    to (redirects, steps). Phases that never ran stay None; a phase cut
+    short by a timeout is closed with stop()."""
+
+    __slots__ = PHASES + ('_phase', '_started')
+
+    def __init__(self):
+        for phase in PHASES:
+            setattr(self, phase, None)
+        self._phase = None
+
+    def start(self, phase):
+        self.stop()
+        self._phase, self._started = phase, time.perf_counter()
+
+    def stop(self):
+        """End the phase in progress, if any"""
+        if self._phase is not None:
+            self.add(self._phase, time.perf_counter() - self._started)
+            self._phase = None
+
+    def add(self, phase, seconds):
+        setattr(self, phase, (getattr(self, phase) or 0.0) + seconds)
+
+    def as_dict(self):
+        return {phase: getattr(self, phase) for phase in PHASES}
+
+
+def _ip_literal(host, port):
+    """getaddrinfo's answer for an IP address, without the round trip
+    through the resolver thread pool"""
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return None
+    if address.version == 4:
+        return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (host, port))]
+    return [(socket.AF_INET6, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (host, port, 0, 0))]
+
+
+class DNSCache:
+    """getaddrinfo results per (host, port). Each lookup says how long an
+    answer may be reused; a TTL of 0 always resolves afresh."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = {}
+
+    async def resolve(self, host, port, ttl=0):
+        literal = _ip_literal(host, port)
+        if literal is not None:
+            return literal
+        key = (host, port)
+        now = time.monotonic()
+        if ttl:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < ttl:
+                return entry[1]
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        if not infos:
+            raise socket.gaierror(f"No addresses for {host}")
+        if ttl:
+            if len(self._entries) >= self.max_entries:
+                # Oldest lookups first
+                for stale in list(self._entries)[:self.max_entries // 10 or 1]:
+                    del self._entries[stale]
+            self._entries.pop(key, None)
+            self._entries[key] = (now, infos)
+        return infos
+
+    def clear(self):
+        self._entries.clear()
+
+
+dns_cache = DNSCache()
+
+_ssl_context = None
+
+
+def get_ssl_context():
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+
+_proxies = None
+
+
+def get_proxies():
+    """Proxy settings from the environment, read once per process"""
+    global _proxies
+    if _proxies is None:
+        _proxies = urllib.request.getproxies_environment()
+    return _proxies
+
+
+class Proxy:
+    __slots__ = ('host', 'port', 'authorization')
+
+    def __init__(self, url):
+        if '://' not in url:
+            url = 'http://' + url
+        parts = urlsplit(url)
+        if parts.scheme != 'http' or not parts.hostname:
+            raise ValueError(f"Unsupported proxy '{url}': only http:// proxies are")
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.authorization = None
+        if parts.username is not None:
+            credentials = f"{unquote(parts.username)}:{unquote(parts.password or '')}"
+            self.authorization = 'Basic ' + base64.b64encode(credentials.encode('utf-8')).decode('ascii')
+
+
+def proxy_for(scheme, host):
+    """The Proxy the environment names for this scheme and host, or None"""
+    proxies = get_proxies()
+    url = proxies.get(scheme)
+    if not url or urllib.request.proxy_bypass_environment(host, proxies):
+        return None
+    return Proxy(url)
+
+
+def host_key(url):
+    """Key used for per-host limits: scheme, host and port"""
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    return f"{parts.scheme}://{parts.hostname}:{port}"
+
+
+def _parse_url(url):
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https'):
+        raise ValueError(f"Invalid URL '{url}': unsupported scheme")
+    if not parts.hostname:
+        raise ValueError(f"Invalid URL '{url}': No host supplied")
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    default_port = 443 if parts.scheme == 'https' else 80
+    host_header = parts.hostname if port == default_port else f"{parts.hostname}:{port}"
+    return parts.scheme, parts.hostname, port, path, host_header
+
+
+class Connection:
+    def __init__(self, key, reader, writer):
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.idle_since = None
+
+    def is_open(self):
+        return not self.reader.at_eof() and not self.writer.is_closing()
+
+    def close(self):
+        self.writer.close()
+
+
+async def _connect(infos):
+    """Socket connected to the first of the resolved addresses that answers"""
+    loop = asyncio.get_running_loop()
+    error = None
+    for family, type_, proto, _, address in infos:
+        sock = socket.socket(family, type_, proto)
+        sock.setblocking(False)
+        try:
+            await loop.sock_connect(sock, address)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+        except BaseException:
+            sock.close()
+            raise
+    raise error
+
+
+async def _tunnel(reader, transport, host, port, proxy):
+    """CONNECT through the proxy to host:port"""
+    lines = [f"CONNECT {host}:{port} HTTP/1.1", f"Host: {host}:{port}"]
+    if proxy.authorization:
+        lines.append(f"Proxy-Authorization: {proxy.authorization}")
+    transport.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+    status_line = await reader.readline()
+    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+        pass
+    parts = status_line.split(b' ', 2)
+    if len(parts) < 2 or parts[1] != b'200':
+        raise ConnectError(f"Proxy refused CONNECT: {status_line.decode('latin-1').strip() or 'no response'}")
+
+
+async def _open(scheme, host, port, timings=None, dns_ttl=0, proxy=None):
+    """Open a connection one phase at a time (lookup, connect, handshake)
+    so each can be timed"""
+    timings = timings or Timings()
+    loop = asyncio.get_running_loop()
+    try:
+        timings.start('dns')
+        if proxy is None:
+            infos = await dns_cache.resolve(host, port, dns_ttl)
+        else:
+            infos = await dns_cache.resolve(proxy.host, proxy.port, dns_ttl)
+        timings.start('connect')
+        sock = await _connect(infos)
+        reader = asyncio.StreamReader()
+        protocol = asyncio.StreamReaderProtocol(reader)
+        try:
+            transport, _ = await loop.create_connection(lambda: protocol, sock=sock)
+        except BaseException:
+            sock.close()
+            raise
+        if proxy is not None and scheme == 'https':
+            try:
+                await _tunnel(reader, transport, host, port, proxy)
+            except BaseException:
+                transport.close()
+                raise
+        if scheme == 'https':
+            timings.start('tls')
+            try:
+                transport = await loop.start_tls(transport, protocol, get_ssl_context(),
+                                                 server_hostname=host)
+            except BaseException:
+                transport.close()
+                raise
+        timings.stop()
+    except (OSError, ssl.SSLError, asyncio.IncompleteReadError) as e:
+        raise ConnectError(str(e)) from e
+    writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+    return Connection((scheme, host, port), reader, writer)
+
+
+class ConnectionPool:
+    """Keep-alive connections for one event loop, keyed by scheme/host/port.
+    At most max_per_host idle connections are kept for each host."""
+
+    def __init__(self, max_per_host=10, idle_timeout=60):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self._idle = defaultdict(deque)
+
+    async def acquire(self, scheme, host, port, timings=None, dns_ttl=0, proxy=None):
+        """Return (connection, reused)"""
+        idle = self._idle.get((scheme, host, port))
+        now = time.monotonic()
+        while idle:
+            # Most recently used first; it is the least likely to have been
+            # closed by the server's own keep-alive timeout
+            conn = idle.pop()
+            if conn.is_open() and now - conn.idle_since < self.idle_timeout:
+                return conn, True
+            conn.close()
+        return await _open(scheme, host, port, timings, dns_ttl, proxy), False
+
+    def release(self, conn):
+        idle = self._idle[conn.key]
+        if len(idle) >= self.max_per_host or not conn.is_open():
+            conn.close()
+            return
+        conn.idle_since = time.monotonic()
+        idle.append(conn)
+
+    def idle_count(self):
+        return sum(len(idle) for idle in self._idle.values())
+
+    def close(self):
+        for idle in self._idle.values():
+            while idle:
+                idle.pop().close()
+
+
+async def _read_head(reader, timings):
+    status_line = await reader.readline()
+    # The first byte is in; the rest of the head and the body are transfer
+    timings.start('transfer')
+    if not status_line:
+        raise ConnectError('Connection closed before response')
+    try:
+        version, code, *reason = status_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+        status_code = int(code)
+    except ValueError:
+        raise HTTPClientError(f"Malformed status line: {status_line!r}")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return status_code, reason[0] if reason else '', headers
+
+
+def _has_body(method, status_code):
+    return not (method == 'HEAD' or status_code in (204, 304) or 100 <= status_code < 200)
+
+
+async def _read_exactly(reader, size):
+    """Yield the next `size` bytes in chunks of at most CHUNK_SIZE"""
+    while size:
+        chunk = await reader.read(min(size, CHUNK_SIZE))
+        if not chunk:
+            raise asyncio.IncompleteReadError(b'', size)
+        size -= len(chunk)
+        yield chunk
+
+
+async def _body_chunks(reader, headers):
+    """Yield the body in chunks; ends after its last byte (or at EOF for
+    a body delimited by connection close)"""
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                return
+            async for chunk in _read_exactly(reader, size):
+                yield chunk
+            await reader.readexactly(2)
+    elif 'content-length' in headers:
+        async for chunk in _read_exactly(reader, int(headers['content-length'])):
+            yield chunk
+    else:
+        while chunk := await reader.read(CHUNK_SIZE):
+            yield chunk
+
+
+async def _drain_body(reader, method, status_code, headers):
+    """Consume the response body so the connection can be reused.
+    Returns False if the body is unbounded or too large to bother with."""
+    if not _has_body(method, status_code):
+        return True
+    if 'content-length' in headers and int(headers['content-length']) > MAX_DRAIN_BYTES:
+        return False
+    if 'content-length' not in headers and headers.get('transfer-encoding', '').lower() != 'chunked':
+        # Body delimited by connection close
+        return False
+    total = 0
+    async for chunk in _body_chunks(reader, headers):
+        total += len(chunk)
+        if total > MAX_DRAIN_BYTES:
+            return False
+    return True
+
+
+async def _stream_body(reader, method, status_code, headers, consumer):
+    """Feed the body to consumer.feed(chunk) until it returns True or the
+    body ends, then call consumer.finish(complete). Returns complete: True
+    if the whole body was read."""
+    complete = False
+    try:
+        if not _has_body(method, status_code):
+            complete = True
+            return complete
+        chunked = headers.get('transfer-encoding', '').lower() == 'chunked'
+        length = None if chunked or 'content-length' not in headers else int(headers['content-length'])
+        received = 0
+        chunks = _body_chunks(reader, headers)
+        try:
+            async for chunk in chunks:
+                received += len(chunk)
+                if consumer.feed(chunk):
+                    # The rest is never read; a body that ends with this
+                    # chunk is still whole
+                    complete = received == length
+                    break
+            else:
+                complete = True
+        finally:
+            await chunks.aclose()
+        return complete
+    finally:
+        consumer.finish(complete)
+
+
+class _Decoder:
+    """Sits in front of a body consumer and hands it the decoded body of
+    a gzip or deflate response"""
+
+    def __init__(self, consumer, encoding):
+        self.consumer = consumer
+        self.deflate = encoding == 'deflate'
+        self.failed = False
+        self.cut = False  # the consumer stopped before the end of the decoded body
+        self._first = True
+        self._zlib = zlib.decompressobj(zlib.MAX_WBITS if self.deflate else 16 + zlib.MAX_WBITS)
+
+    def feed(self, chunk):
+        first, self._first = self._first, False
+        try:
+            # Bounded steps, so a small compressed body can't expand into
+            # more memory than the consumer is willing to take
+            data = self._zlib.decompress(chunk, CHUNK_SIZE)
+            while True:
+                if data and self.consumer.feed(data):
+                    self.cut = bool(self._zlib.unconsumed_tail) or not self._zlib.eof
+                    return True
+                if not self._zlib.unconsumed_tail:
+                    return False
+                data = self._zlib.decompress(self._zlib.unconsumed_tail, CHUNK_SIZE)
+        except zlib.error:
+            if not (self.deflate and first):
+                self.failed = True
+                return True
+            # Some servers send raw deflate without the zlib header
+            self._zlib = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self.feed(chunk)
+
+    def finish(self, complete):
+        if complete and not (self.failed or self.cut):
+            try:
+                rest = self._zlib.flush()
+            except zlib.error:
+                rest, self.failed = b'', True
+            if rest:
+                self.consumer.feed(rest)
+        self.consumer.finish(complete and not (self.failed or self.cut))
+
+
+def _decoding(consumer, headers):
+    encoding = headers.get('content-encoding', '').strip().lower()
+    if encoding in ('gzip', 'x-gzip', 'deflate'):
+        return _Decoder(consumer, 'deflate' if encoding == 'deflate' else 'gzip')
+    return consumer
+
+
+def _is_redirect(response):
+    return response.status_code in REDIRECT_CODES and 'location' in response.headers
+
+
+# Headers the client sets itself; a monitor's own headers can't replace them
+RESERVED_HEADERS = ('host', 'connection', 'content-length', 'transfer-encoding')
+
+
+def _request_head(method, path, host_header, keep_alive, headers, data, proxy_authorization=None):
+    lines = [f"{method} {path} HTTP/1.1", f"Host: {host_header}"]
+    if proxy_authorization:
+        lines.append(f"Proxy-Authorization: {proxy_authorization}")
+    given = {name.lower() for name in headers or ()}
+    if 'user-agent' not in given:
+        lines.append(f"User-Agent: {USER_AGENT}")
+    if 'accept' not in given:
+        lines.append("Accept: */*")
+    if 'accept-encoding' not in given:
+        lines.append("Accept-Encoding: gzip, deflate")
+    lines.extend(f"{name}: {value}" for name, value in (headers or {}).items()
+                 if name.lower() not in RESERVED_HEADERS)
+    if data is not None:
+        lines.append(f"Content-Length: {len(data)}")
+    lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (data or b'')
+
+
+async def _request_once(method, url, pool=None, headers=None, data=None, consumer=None,
+                        allow_redirects=True, timings=None, dns_ttl=0):
+    scheme, host, port, path, host_header = _parse_url(url)
+    proxy = proxy_for(scheme, host)
+    if proxy is not None and scheme == 'http':
+        # Plain HTTP goes to the proxy itself, with the full URL
+        message = _request_head(method, f"http://{host_header}{path}", host_header, pool is not None,
+                                headers, data, proxy.authorization)
+    else:
+        message = _request_head(method, path, host_header, pool is not None, headers, data)
+    timings = timings or Timings()
+
+    while True:
+        if pool is not None:
+            conn, reused = await pool.acquire(scheme, host, port, timings, dns_ttl, proxy)
+        else:
+            conn, reused = await _open(scheme, host, port, timings, dns_ttl, proxy), False
+        try:
+            timings.start('ttfb')
+            conn.writer.write(message)
+            await conn.writer.drain()
+            status_code, reason, response_headers = await _read_head(conn.reader, timings)
+            break
+        except (OSError, ssl.SSLError, asyncio.IncompleteReadError, ConnectError) as e:
+            conn.close()
+            if reused:
+                # The server closed an idle connection under us; retry fresh
+                continue
+            raise ConnectError(str(e)) from e
+        except BaseException:
+            conn.close()
+            raise
+
+    response = Response(url, status_code, reason, response_headers, connection_reused=reused)
+    if allow_redirects and _is_redirect(response):
+        # Only the final response's body is of interest
+        consumer = None
+    reusable = pool is not None and response_headers.get('connection', '').lower() != 'close'
+    if consumer is None and not reusable:
+        timings.stop()
+        conn.close()
+        return response
+    try:
+        if consumer is not None:
+            reusable = await _stream_body(conn.reader, method, status_code, response_headers,
+                                          _decoding(consumer, response_headers)) and reusable
+        else:
+            reusable = await _drain_body(conn.reader, method, status_code, response_headers)
+    except (OSError, ValueError, asyncio.IncompleteReadError):
+        # A body cut short is judged on what arrived
+        reusable = False
+    except BaseException:
+        conn.close()
+        raise
+    timings.stop()
+    if reusable:
+        pool.release(conn)
+    else:
+        conn.close()
+    return response
+
+
+async def request(method, url, timeout=30, allow_redirects=True, pool=None, headers=None,
+                  data=None, consumer=None, timings=None, dns_ttl=0):
+    """Send a request and return once the response head has arrived.
+    Without a pool the body is never read and the connection is closed
+    after the headers; with one the body is drained and the connection
+    returned to the pool for reuse.
+
+    headers: extra request headers; data: request body (str or bytes).
+    consumer: gets the final response's body instead, through
+    consumer.feed(chunk) -> True to stop reading and consumer.finish(complete);
+    the response is returned once it stops.
+    timings: a Timings to add this request's phases to.
+    dns_ttl: seconds a cached lookup of the host may be reused.
+    Redirects to another scheme, host or port are followed without the
+    extra headers, which may carry the monitor's credentials."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    origin = _parse_url(url)[:3]
+
+    async def follow():
+        current_method, current_url, current_data = method.upper(), url, data
+        current_headers = headers
+        reused = None
+        for _ in range(MAX_REDIRECTS + 1):
+            response = await _request_once(current_method, current_url, pool, current_headers,
+                                           current_data, consumer, allow_redirects, timings, dns_ttl)
+            if reused is None:
+                reused = response.connection_reused
+            if not allow_redirects or not _is_redirect(response):
+                # Report reuse for the first hop, which is what the check measured
+                response.connection_reused = reused
+                return response
+            current_url = urljoin(current_url, response.headers['location'])
+            if current_headers and _parse_url(current_url)[:3] != origin:
+                # Authorization, Cookie and the like are for the monitored
+                # origin only; once off it they stay off
+                current_headers = None
+            # Same method rewriting as requests/browsers
+            if response.status_code == 303 and current_method != 'HEAD':
+                current_method, current_data = 'GET', None
+            elif response.status_code in (301, 302) and current_method == 'POST':
+                current_method, current_data = 'GET', None
+        raise HTTPClientError(f"Exceeded {MAX_REDIRECTS} redirects.")
+
+    try:
+        return await asyncio.wait_for(follow(), timeout)
+    except asyncio.TimeoutError:
+        raise RequestTimeout(f"Request to {url} timed out after {timeout}s")
+
+
+_shared_loop = None
+_shared_pool = None
+_shared_lock = threading.Lock()
+
+
+def _shared():
+    global _shared_loop, _shared_pool
+    with _shared_lock:
+        if _shared_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='httpclient', daemon=True).start()
+            _shared_pool = ConnectionPool()
+            _shared_loop = loop
+    return _shared_loop, _shared_pool
+
+
+def shared_pool():
+    """Pool owned by the shared background loop used by run_sync"""
+    return _shared()[1]
+
+
+def run_sync(coro):
+    """Run a coroutine on the shared background loop from any thread.
+    All use of shared_pool() happens on that loop, which keeps it thread-safe."""
+    loop, _ = _shared()
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
@@ -0,0 +1,183 @@
+"""
+Lease-based coordination between worker nodes
+Every active monitor is leased to exactly one worker node at a time. Nodes
+claim unowned or expired leases in batches, renew their own before they
+expire and hand back anything above their fair share so a newly started
+node gets work. A node that dies stops renewing and its monitors are
+claimed by the others once the lease runs out.
+
+Shards only schedule monitors whose lease is good for at least one more
+schedule refresh (see owned_schedule), so a node that cannot renew stops
+checking before anyone else may claim its monitors. Node clocks need to
+agree to well within that margin.
+"""
+
+import math
+import os
+import socket
+import threading
+import time
+
+# Monitors leased to `owner` that are safe to check until the next refresh
+OWNED_SCHEDULE_QUERY = '''
+    SELECT m.id, m.check_interval
+    FROM monitor_leases l
+    JOIN monitors m ON m.id = l.monitor_id
+    WHERE l.owner = ? AND l.lease_expires > ? AND m.is_active = 1
+'''
+
+
+def default_owner():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def create_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS monitor_leases (
+            monitor_id INTEGER PRIMARY KEY,
+            owner TEXT,
+            lease_expires REAL NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_leases_owner
+        ON monitor_leases (owner, monitor_id)
+    ''')
+    # One heartbeat row per live node, used to work out fair shares
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS lease_owners (
+            owner TEXT PRIMARY KEY,
+            heartbeat REAL NOT NULL
+        )
+    ''')
+
+
+def owned_schedule(cursor, owner, margin, now=None):
+    """{monitor_id: check_interval} for monitors `owner` may check for at
+    least the next `margin` seconds"""
+    now = time.time() if now is None else now
+    return {row[0]: row[1] for row in cursor.execute(OWNED_SCHEDULE_QUERY, (owner, now + margin))}
+
+
+class LeaseManager:
+    def __init__(self, db, owner=None, ttl=30, margin=None, batch_size=1000, clock=time.time):
+        """margin is how long before expiry the node's shards stop checking a
+        monitor; it must cover the shards' schedule refresh interval"""
+        self.db = db
+        self.owner = owner or default_owner()
+        self.ttl = ttl
+        self.margin = ttl / 3 if margin is None else margin
+        self.batch_size = batch_size
+        self.clock = clock
+        self._stop = threading.Event()
+
+    def run_once(self):
+        """Heartbeat, renew, then claim or release towards a fair share.
+        Returns the number of monitors this node holds afterwards."""
+        now = self.clock()
+        with self.db.connect() as conn:
+            conn.execute('''
+                INSERT INTO lease_owners (owner, heartbeat) VALUES (?, ?)
+                ON CONFLICT (owner) DO UPDATE SET heartbeat = excluded.heartbeat
+            ''', (self.owner, now))
+            conn.execute('DELETE FROM lease_owners WHERE heartbeat < ?', (now - self.ttl,))
+            # Leases of deactivated or deleted monitors
+            conn.execute('''
+                DELETE FROM monitor_leases
+                WHERE monitor_id NOT IN (SELECT id FROM monitors WHERE is_active = 1)
+            ''')
+            owners = conn.execute('SELECT COUNT(*) FROM lease_owners').fetchone()[0]
+            active = conn.execute('SELECT COUNT(*) FROM monitors WHERE is_active = 1').fetchone()[0]
+
+        self._renew(now)
+        held = self.held(now)
+        share = math.ceil(active / max(1, owners))
+        if held > share:
+            self._release(held - share, now)
+        elif held < share:
+            self._claim(share - held, now)
+        return self.held(now)
+
+    def held(self, now=None):
+        now = self.clock() if now is None else now
+        with self.db.connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM monitor_leases WHERE owner = ? AND lease_expires > ?',
+                                (self.owner, now)).fetchone()[0]
+
+    def _renew(self, now):
+        # Batched by monitor_id so the check writer never waits long
+        after = -1
+        while True:
+            with self.db.connect() as conn:
+                ids = [row[0] for row in conn.execute('''
+                    SELECT monitor_id FROM monitor_leases
+                    WHERE owner = ? AND monitor_id > ? AND lease_expires > ?
+                    ORDER BY monitor_id LIMIT ?
+                ''', (self.owner, after, now, self.batch_size))]
+                if not ids:
+                    return
+                conn.execute(f'''
+                    UPDATE monitor_leases SET lease_expires = ?
+                    WHERE owner = ? AND lease_expires > ? AND monitor_id IN ({','.join('?' * len(ids))})
+                ''', [now + self.ttl, self.owner, now] + ids)
+            after = ids[-1]
+
+    def _claim(self, wanted, now):
+        """Take expired leases first, then monitors nobody has leased yet.
+        Each batch is a single write transaction, so two nodes can never
+        both take the same monitor."""
+        while wanted > 0 and not self._stop.is_set():
+            limit = min(wanted, self.batch_size)
+            with self.db.connect() as conn:
+                claimed = conn.execute('''
+                    UPDATE monitor_leases SET owner = ?, lease_expires = ?
+                    WHERE monitor_id IN (
+                        SELECT monitor_id FROM monitor_leases WHERE lease_expires <= ? LIMIT ?
+                    )
+                ''', (self.owner, now + self.ttl, now, limit)).rowcount
+                if claimed < limit:
+                    claimed += conn.execute('''
+                        INSERT INTO monitor_leases (monitor_id, owner, lease_expires)
+                        SELECT id, ?, ? FROM monitors
+                        WHERE is_active = 1 AND id NOT IN (SELECT monitor_id FROM monitor_leases)
+                        LIMIT ?
+                    ''', (self.owner, now + self.ttl, limit - claimed)).rowcount
+            if claimed == 0:
+                return
+            wanted -= claimed
+
+    def _release(self, count, now):
+        # Released leases stay unclaimable for one margin so our shards
+        # drop them at their next refresh before another node starts
+        with self.db.connect() as conn:
+            conn.execute('''
+                UPDATE monitor_leases SET owner = NULL, lease_expires = ?
+                WHERE monitor_id IN (
+                    SELECT monitor_id FROM monitor_leases WHERE owner = ?
+                    ORDER BY monitor_id DESC LIMIT ?
+                )
+            ''', (now + self.margin, self.owner, count))
+
+    def release_all(self):
+        """Give everything back at shutdown, once this node's shards have
+        stopped, so the other nodes take over straight away"""
+        with self.db.connect() as conn:
+            conn.execute('UPDATE monitor_leases SET owner = NULL, lease_expires = 0 WHERE owner = ?',
+                         (self.owner,))
+            conn.execute('DELETE FROM lease_owners WHERE owner = ?', (self.owner,))
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Lease manager error: {e}")
+            self._stop.wait(self.ttl / 3)
+
+    def start(self):
+        thread = threading.Thread(target=self.run_forever, name='lease-manager', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
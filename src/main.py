@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Process entry point: one mode per process
+
+    python src/main.py web       dashboard and API (production: gunicorn -c gunicorn.conf.py src.wsgi:app)
+    python src/main.py worker    checks, result writes, retention, alert delivery
+
+The mode can also come from APP_MODE. Each mode imports only what it
+runs: the web process never loads the check engine, HTTP client or mail
+code, and the worker never loads Flask.
+"""
+
+import os
+import sys
+
+MODES = ('web', 'worker')
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    mode = argv.pop(0) if argv and argv[0] in MODES else os.environ.get('APP_MODE', 'web')
+    if mode not in MODES:
+        sys.exit(f"Unknown mode '{mode}'; expected one of {', '.join(MODES)}")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    if mode == 'web':
+        from app import create_app
+        port = int(os.environ.get('PORT', 5000))
+        create_app().run(host='0.0.0.0', port=port)
+    else:
+        import worker
+        sys.argv = [sys.argv[0]] + argv
+        worker.main()
+
+
+if __name__ == '__main__':
+    main()
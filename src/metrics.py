@@ -0,0 +1,228 @@
+"""
+Service metrics in the Prometheus text exposition format
+Counters, gauges and histograms are plain in-process objects, cheap enough
+to update on every check. Shard processes send snapshots of theirs to the
+worker parent (see worker.ResultQueue), which merges them into its own
+registry and serves everything from one /metrics endpoint.
+"""
+
+import bisect
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def remove(self, labels):
+        with self._lock:
+            self._values.pop(labels, None)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def combine(values, other):
+        """Fold another process's snapshot into `values` (summed)"""
+        for labels, value in other.items():
+            values[labels] = values.get(labels, 0) + value
+
+    def samples(self, values):
+        for labels, value in sorted(values.items()):
+            yield self.name + _format_labels(self.labels, labels), value
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount=1, labels=()):
+        self.inc(-amount, labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        # Per-bucket (not cumulative) counts; the last slot is +Inf
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: [list(counts), total, count]
+                    for labels, (counts, total, count) in self._values.items()}
+
+    @staticmethod
+    def combine(values, other):
+        for labels, (counts, total, count) in other.items():
+            mine = values.setdefault(labels, [[0] * len(counts), 0.0, 0])
+            mine[0] = [a + b for a, b in zip(mine[0], counts)]
+            mine[1] += total
+            mine[2] += count
+
+    def samples(self, values):
+        for labels, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket
+                le = f'le="{_format_value(bound)}"'
+                yield self.name + '_bucket' + _format_labels(self.labels, labels, le), cumulative
+            yield self.name + '_sum' + _format_labels(self.labels, labels), total
+            yield self.name + '_count' + _format_labels(self.labels, labels), count
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self._remote = {}  # source -> {metric name: snapshot}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def merge(self, source, snapshot):
+        """Replace what `source` (e.g. a shard) last reported"""
+        with self._lock:
+            self._remote[source] = snapshot
+
+    def forget(self, source):
+        with self._lock:
+            self._remote.pop(source, None)
+
+    def render(self):
+        with self._lock:
+            remote = list(self._remote.values())
+        lines = []
+        for name, metric in self.metrics.items():
+            values = metric.snapshot()
+            for snapshot in remote:
+                metric.combine(values, snapshot.get(name, {}))
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            lines.extend(f'{sample} {_format_value(value)}' for sample, value in metric.samples(values))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+CHECK_DURATION = REGISTRY.histogram(
+    'api_monitor_check_duration_seconds', 'Time to run one check, including waiting on the host')
+CHECKS = REGISTRY.counter(
+    'api_monitor_checks_total', 'Checks run, by outcome (rate() gives checks per second)', ('result',))
+IN_FLIGHT = REGISTRY.gauge(
+    'api_monitor_checks_in_flight', 'Checks currently running')
+SCHEDULER_LAG = REGISTRY.histogram(
+    'api_monitor_scheduler_lag_seconds', 'How late checks started relative to their due time',
+    buckets=LAG_BUCKETS)
+DB_WRITE = REGISTRY.histogram(
+    'api_monitor_db_write_seconds', 'Time to write and commit one batch of check results')
+WRITE_QUEUE = REGISTRY.gauge(
+    'api_monitor_write_queue_depth', 'Check results waiting for the writer')
+MONITOR_STATUS = REGISTRY.gauge(
+    'api_monitor_monitor_status_code', 'HTTP status of the last check (0 if none)', ('monitor_id',))
+MONITOR_LATENCY = REGISTRY.gauge(
+    'api_monitor_monitor_response_seconds', 'Response time of the last check', ('monitor_id',))
+MONITOR_UP = REGISTRY.gauge(
+    'api_monitor_monitor_up', '1 if the last check succeeded', ('monitor_id',))
+MONITOR_DEGRADED = REGISTRY.gauge(
+    'api_monitor_monitor_degraded', '1 while response times are well above normal', ('monitor_id',))
+PER_MONITOR = (MONITOR_STATUS, MONITOR_LATENCY, MONITOR_UP, MONITOR_DEGRADED)
+
+
+def forget_monitor(monitor_id):
+    """Drop a monitor's series once this process stops checking or
+    observing it (deactivated, or moved to another shard or node)"""
+    for metric in PER_MONITOR:
+        metric.remove((monitor_id,))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port, host='0.0.0.0', registry=REGISTRY):
+    """Serve /metrics on a background thread; returns the server"""
+    handler = type('Handler', (_Handler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    print(f"Metrics: serving http://{host}:{server.server_port}/metrics")
+    return server
@@ -9,194 +9,374 @@ Features:
 - SQLite database for history
 """
 
-import requests
-import sqlite3
 import json
 import time
-import smtplib
-import schedule
 from datetime import datetime
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import os
 
+try:
+    from . import alerts, metrics, rollups, tenants
+    from .anomaly import LatencyTracker
+    from .registry import MonitorRegistry
+    from .storage import open_storage
+    from .validation import ValidationError, validate_monitors
+    from .db import CheckWriter, utc_timestamp
+except ImportError:  # running from inside src/
+    import alerts
+    import metrics
+    import rollups
+    import tenants
+    from anomaly import LatencyTracker
+    from registry import MonitorRegistry
+    from storage import open_storage
+    from validation import ValidationError, validate_monitors
+    from db import CheckWriter, utc_timestamp
+
 class APIMonitor:
-    def __init__(self, db_path='/home/daytona/data/api_monitor.db'):
+    def __init__(self, db_path='/home/daytona/data/api_monitor.db', storage=None):
+        """db_path: a SQLite path, unless a Storage is given (see storage.py)"""
         self.db_path = db_path
+        self.storage = storage or open_storage(db_path)
+        # The SQLite database, for the parts that only run on SQLite
+        # (leases, retention, alert delivery, export); None otherwise
+        self.db = getattr(self.storage, 'db', None)
+        self._writer = None
+        self._registry = None
+        self._listeners = []
+        self.alert_states = alerts.AlertTracker()
+        self.latency = LatencyTracker()
         self.init_database()
+        self.usage = tenants.TenantUsage()
         
     def init_database(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create tables
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS monitors (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                url TEXT NOT NULL,
-                method TEXT DEFAULT 'GET',
-                expected_status INTEGER DEFAULT 200,
-                timeout INTEGER DEFAULT 30,
-                check_interval INTEGER DEFAULT 300,
-                email_alerts TEXT,
-                is_active BOOLEAN DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS checks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                monitor_id INTEGER,
-                status_code INTEGER,
-                response_time REAL,
-                error_message TEXT,
-                checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (monitor_id) REFERENCES monitors (id)
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS alerts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                monitor_id INTEGER,
-                alert_type TEXT,
-                message TEXT,
-                sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (monitor_id) REFERENCES monitors (id)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        self.storage.init_schema()
     
-    def add_monitor(self, name, url, email_alerts=None, check_interval=300):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO monitors (name, url, email_alerts, check_interval)
-            VALUES (?, ?, ?, ?)
-        ''', (name, url, email_alerts, check_interval))
-        
-        conn.commit()
-        conn.close()
-        
-        return cursor.lastrowid
+    @property
+    def writer(self):
+        """Single writer thread for check results, started on first use"""
+        if self._writer is None:
+            self._writer = CheckWriter(self.storage, self._write_checks, on_commit=self._notify,
+                                       prepare=self._observe)
+        return self._writer
+    
+    @property
+    def registry(self):
+        """In-memory monitor definitions, loaded on first use"""
+        if self._registry is None:
+            self._registry = MonitorRegistry(self)
+            self._registry.refresh()
+        return self._registry
+    
+    def add_listener(self, listener):
+        """listener(batch) is called on the writer thread after each batch of
+        (monitor_row, result, checked_at) is committed"""
+        self._listeners.append(listener)
+    
+    def _notify(self, batch):
+        # Counted after the commit, so a retried batch isn't counted twice
+        for monitor, result, checked_at in batch:
+            tenant_id = tenants.tenant_of(monitor)
+            if tenant_id is not None:
+                self.usage.count(tenant_id, checked_at, result['error'] is not None)
+        if self.usage.due():
+            self.flush_usage()
+        for listener in self._listeners:
+            listener(batch)
+
+    def flush_usage(self):
+        """Write the per-tenant check counts gathered since the last flush"""
+        rows = self.usage.take()
+        if not rows:
+            return
+        try:
+            with self.storage.connect() as conn:
+                self.storage.add_usage(conn, rows)
+        except Exception as e:
+            print(f"Usage flush error: {e}")
+            self.usage.restore(rows)
+    
+    def add_monitor(self, name, url, email_alerts=None, check_interval=300, keep_alive=False):
+        """keep_alive lets checks reuse pooled connections; leave it off to
+        measure cold-connect latency (DNS, TCP and TLS) on every check"""
+        return self.add_monitors([{'name': name, 'url': url, 'email_alerts': email_alerts,
+                                   'check_interval': check_interval, 'keep_alive': keep_alive}])[0]
+    
+    def add_monitors(self, specs, require_tenant=False, public_only=False):
+        """Validate and insert monitor dicts in one transaction; returns
+        their ids in order. Raises ValidationError without writing anything
+        if any of them is invalid. The API sets require_tenant, refusing
+        monitors without a tenant (which would have no tier limits), and
+        public_only, refusing URLs on private and local addresses."""
+        monitors = validate_monitors(specs, public_only=public_only)
+        if not monitors:
+            return []
+        return self.storage.insert_monitors(monitors, check=self._quota_check(require_tenant))
+    
+    def update_monitors(self, updates, require_tenant=False, public_only=False):
+        """Apply partial updates ({'id': ..., field: value, ...}) in one
+        transaction; returns the number of monitors updated.
+        require_tenant and public_only are as for add_monitors."""
+        updates = validate_monitors(updates, partial=True, public_only=public_only)
+        if not updates:
+            return 0
+        # Only intervals are limited by tier (tenant_id can't be changed)
+        check = None
+        if require_tenant or any('check_interval' in update for update in updates):
+            check = self._quota_check(require_tenant)
+        missing = self.storage.update_monitors(updates, check=check)
+        if missing:
+            raise ValidationError([{'index': i, 'field': 'id', 'message': "no such monitor"}
+                                   for i, update in enumerate(updates) if update['id'] in missing])
+        return len(updates)
+    
+    def deactivate_monitors(self, monitor_ids):
+        """Stop checking the given monitors; returns how many were active"""
+        return len(self.storage.deactivate_monitors(list(dict.fromkeys(monitor_ids))))
+
+    @staticmethod
+    def _quota_check(require_tenant):
+        def check(monitors, limits, owners=None):
+            # Called by the storage inside the write transaction
+            problems = tenants.quota_problems(monitors, limits, owners, require_tenant)
+            if problems:
+                raise ValidationError(problems)
+        return check
+
+    def add_tenant(self, name, tier='free'):
+        """Returns the new tenant's id"""
+        errors = []
+        if not isinstance(name, str) or not name.strip():
+            errors.append({'index': None, 'field': 'name', 'message': "is required"})
+        if tier not in tenants.TIERS:
+            errors.append({'index': None, 'field': 'tier', 'message': f"must be one of {', '.join(tenants.TIERS)}"})
+        if errors:
+            raise ValidationError(errors)
+        return self.storage.add_tenant(name.strip(), tier)
+
+    def set_tenant_tier(self, tenant_id, tier):
+        """Move a tenant to another tier; its monitors' intervals are raised
+        to the tier's minimum. Monitors over a lower tier's cap stay active,
+        but no more can be added. Returns False if there is no such tenant."""
+        if tier not in tenants.TIERS:
+            raise ValidationError([{'index': None, 'field': 'tier',
+                                    'message': f"must be one of {', '.join(tenants.TIERS)}"}])
+        return self.storage.set_tenant_tier(tenant_id, tier, tenants.TIERS[tier].min_interval)
+
+    def tenant_stats(self, tenant_id, hours=24):
+        """The tenant, its tier's limits, its active monitors and its checks
+        per hour (as last flushed by the workers), or None"""
+        tenant = self.storage.get_tenant(tenant_id)
+        if tenant is None:
+            return None
+        tier = tenants.TIERS[tenant['tier']]
+        since = utc_timestamp(time.time() - hours * 3600)[:13] + ':00:00'
+        usage = [{'hour': str(row['hour']), 'checks': row['checks'], 'failed_checks': row['failed_checks']}
+                 for row in self.storage.tenant_usage(tenant_id, since)]
+        return {
+            'id': tenant['id'],
+            'name': tenant['name'],
+            'tier': tier.name,
+            'limits': {'max_monitors': tier.max_monitors, 'min_interval': tier.min_interval},
+            'monitors': self.storage.tenant_monitor_counts().get(tenant_id, 0),
+            'checks': sum(hour['checks'] for hour in usage),
+            'failed_checks': sum(hour['failed_checks'] for hour in usage),
+            'usage': usage,
+        }
+    
+    def change_version(self):
+        return self.storage.change_version()
+    
+    def get_changes(self, since):
+        """(version, {monitor_id: check_interval, or None once inactive})
+        for monitors changed after change version `since`"""
+        return self.storage.get_changes(since)
     
     def check_endpoint(self, monitor_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Get monitor details
-        cursor.execute('SELECT * FROM monitors WHERE id = ? AND is_active = 1', (monitor_id,))
-        monitor = cursor.fetchone()
+        # Catch up on monitor changes, then read the definition from memory
+        self.registry.poll()
+        monitor = self.registry.get(monitor_id)
         
         if not monitor:
-            conn.close()
             return
         
-        url = monitor[2]
-        method = monitor[3]
-        expected_status = monitor[4]
-        timeout = monitor[5]
-        
-        # Perform the check
-        start_time = time.time()
-        error_message = None
-        status_code = None
-        
+        # The check engine and HTTP client are only loaded where checks run
         try:
-            response = requests.request(method, url, timeout=timeout)
-            status_code = response.status_code
-            response_time = time.time() - start_time
-            
-            if status_code != expected_status:
-                error_message = f"Expected status {expected_status}, got {status_code}"
-                
-        except requests.exceptions.Timeout:
-            error_message = "Request timed out"
-            response_time = timeout
-        except requests.exceptions.ConnectionError:
-            error_message = "Connection error"
-            response_time = time.time() - start_time
-        except Exception as e:
-            error_message = str(e)
-            response_time = time.time() - start_time
-        
-        # Record the check
-        cursor.execute('''
-            INSERT INTO checks (monitor_id, status_code, response_time, error_message)
-            VALUES (?, ?, ?, ?)
-        ''', (monitor_id, status_code, response_time, error_message))
+            from . import httpclient
+            from .engine import perform_check
+        except ImportError:  # running from inside src/
+            import httpclient
+            from engine import perform_check
         
-        # Send alert if needed
-        if error_message and monitor[7]:  # email_alerts field
-            self.send_alert(monitor_id, monitor[1], url, error_message, monitor[7])
+        # Perform the check on the shared client, reusing pooled
+        # connections if the monitor opted in
+        result = httpclient.run_sync(perform_check(monitor, httpclient.shared_pool()))
         
-        conn.commit()
-        conn.close()
+        # Record the check (and alert, if needed) and wait for it to land
+        self.submit_checks([(monitor, result)])
+        self.writer.flush()
         
-        return {
-            'status_code': status_code,
-            'response_time': response_time,
-            'error': error_message
-        }
+        return result
     
     def send_alert(self, monitor_id, name, url, error_message, email):
-        # For MVP, we'll just log alerts. In production, integrate with email service
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        message = f"Monitor '{name}' failed: {error_message}\nURL: {url}"
-        
-        cursor.execute('''
-            INSERT INTO alerts (monitor_id, alert_type, message)
-            VALUES (?, ?, ?)
-        ''', (monitor_id, 'email', message))
+        # Queued for the delivery worker (alerts.AlertDelivery)
+        with self.storage.connect() as conn:
+            self._insert_alert(conn, monitor_id, name, url, error_message, email)
+    
+    def _insert_alert(self, conn, monitor_id, name, url, error_message, email, event=alerts.DOWN,
+                      batch_delay=5):
+        message = alerts.alert_message(name, url, event, error_message)
+        # Held for a few seconds so alerts from a wider outage share an email
+        send_at = time.time() + batch_delay
         
-        conn.commit()
-        conn.close()
+        self.storage.insert_alerts(conn, [(monitor_id, 'email', message, event, recipient, send_at)
+                                          for recipient in alerts.recipients(email)])
         
         print(f"ALERT: {message}")
     
-    def get_monitor_stats(self, monitor_id, hours=24):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def get_monitors(self, monitor_ids):
+        """Load active monitor rows for the given ids in a single query"""
+        return self.storage.get_monitors(monitor_ids)
+    
+    def get_schedule(self):
+        """Map of active monitor id to its check_interval in seconds"""
+        return self.storage.get_schedule()
+    
+    def get_start_delays(self, monitor_ids, now=None):
+        """Seconds until each monitor is next due going by its last check,
+        so a restart or a handover to another node keeps the monitor's
+        phase. Monitors never checked or already overdue are left out."""
+        now = time.time() if now is None else now
+        delays = {}
+        for monitor_id, (interval, last) in self.storage.last_checked(monitor_ids).items():
+            if last is None:
+                continue
+            delay = last + interval - now
+            if delay > 0:
+                delays[monitor_id] = delay
+        return delays
+    
+    def submit_checks(self, results):
+        """Queue (monitor_row, result) pairs for the writer thread; returns immediately"""
+        checked_at = utc_timestamp()
+        for monitor, result in results:
+            self.writer.submit((monitor, result, result.get('checked_at') or checked_at))
+    
+    def record_checks(self, results):
+        """Write (monitor_row, result) pairs and wait until they are committed.
+        Produces the same checks/alerts rows as check_endpoint."""
+        self.submit_checks(results)
+        self.writer.flush()
+    
+    @staticmethod
+    def _phases(result):
+        """Phase times in microseconds in rollups.PHASES order"""
+        timings = result.get('timings') or {}
+        return tuple(None if timings.get(phase) is None else round(timings[phase] * 1e6)
+                     for phase in rollups.PHASES)
+    
+    def _held(self, monitor_id):
+        # A check still in flight when its monitor was dropped mustn't bring
+        # back the state forget_monitor just removed
+        return self._registry is None or monitor_id in self._registry
+
+    def forget_monitor(self, monitor_id):
+        """Drop a monitor's metric series and alert and latency state once
+        this process no longer handles it; called as the registry drops it"""
+        metrics.forget_monitor(monitor_id)
+        self.alert_states.forget(monitor_id)
+        self.latency.forget(monitor_id)
+
+    def _observe(self, batch):
+        """Runs once per batch on the writer thread, before the transaction
+        (which the writer may retry): feeds the results to the in-memory
+        alert and latency trackers and returns what _write_checks writes"""
+        for monitor, result, checked_at in batch:
+            if not self._held(monitor['id']):
+                continue
+            labels = (monitor['id'],)
+            metrics.MONITOR_STATUS.set(result['status_code'] or 0, labels)
+            if result['response_time'] is not None:
+                metrics.MONITOR_LATENCY.set(result['response_time'], labels)
+            metrics.MONITOR_UP.set(int(result['error'] is None), labels)
         
-        # Get recent checks
-        cursor.execute('''
-            SELECT 
-                COUNT(*) as total_checks,
-                COUNT(CASE WHEN error_message IS NULL THEN 1 END) as successful_checks,
-                AVG(response_time) as avg_response_time,
-                MIN(response_time) as min_response_time,
-                MAX(response_time) as max_response_time
-            FROM checks
-            WHERE monitor_id = ?
-            AND checked_at > datetime('now', '-' || ? || ' hours')
-        ''', (monitor_id, hours))
+        states = []
+        notices = []  # (monitor, message, event)
+        # Alert on confirmed state changes only, not on every failed check
+        for monitor, result, checked_at in batch:
+            if not self._held(monitor['id']):
+                continue
+            transition = self.alert_states.observe(monitor['id'], result['error'] is None,
+                                                   initial=monitor['alert_state'])
+            if transition is None:
+                continue
+            old, new = transition
+            states.append((new, monitor['id']))
+            if monitor['email_alerts']:
+                notices.append((monitor, result['error'], new))
         
-        stats = cursor.fetchone()
-        conn.close()
+        # Successful but unusually slow responses (see anomaly.py)
+        for monitor, result, checked_at in batch:
+            if result['error'] is not None or not self._held(monitor['id']):
+                continue
+            event = self.latency.observe(monitor['id'], result['response_time'])
+            if event is None:
+                continue
+            metrics.MONITOR_DEGRADED.set(int(event == alerts.DEGRADED), (monitor['id'],))
+            if monitor['email_alerts']:
+                usual = self.latency.baseline(monitor['id']).usual()
+                detail = f"response time {result['response_time'] * 1000:.0f}ms, usually {usual * 1000:.0f}ms"
+                notices.append((monitor, detail, event))
+        return batch, states, notices
+    
+    def _write_checks(self, conn, prepared):
+        # Runs on the writer thread, inside one transaction per batch; only
+        # SQL here, since a failed transaction is run again
+        batch, states, notices = prepared
+        self.storage.insert_checks(conn, [
+            (monitor['id'], result['status_code'], result['response_time'], result['error'],
+             result['connection_reused'], checked_at) + self._phases(result)
+            for monitor, result, checked_at in batch])
+        if states:
+            self.storage.set_alert_states(conn, states)
+        for monitor, message, event in notices:
+            self._insert_alert(conn, monitor['id'], monitor['name'], monitor['url'], message,
+                               monitor['email_alerts'], event=event)
+    
+    def get_monitor_stats(self, monitor_id, hours=24):
+        (total, successful, rt_sum, rt_min, rt_max, latency,
+         timed, phase_sums) = self.storage.window_stats(monitor_id, hours)
         
-        return {
-            'total_checks': stats[0],
-            'successful_checks': stats[1],
-            'uptime_percentage': (stats[1] / stats[0] * 100) if stats[0] > 0 else 0,
-            'avg_response_time': stats[2],
-            'min_response_time': stats[3],
-            'max_response_time': stats[4]
+        stats = {
+            'total_checks': total,
+            'successful_checks': successful,
+            'uptime_percentage': (successful / total * 100) if total > 0 else 0,
+            # Over the checks that have a response time (the sketch counts
+            # them); rollups from before sketches were kept count them all
+            'avg_response_time': rt_sum / (latency.count or total) if rt_sum is not None else None,
+            'min_response_time': rt_min,
+            'max_response_time': rt_max,
+            'p50_response_time': latency.quantile(0.50),
+            'p95_response_time': latency.quantile(0.95),
+            'p99_response_time': latency.quantile(0.99)
         }
+        # Average seconds per phase over the checks that got a response
+        for phase, micros in zip(rollups.PHASES, phase_sums):
+            stats[f'avg_{phase}_time'] = micros / timed / 1e6 if timed else None
+        return stats
     
-    def generate_report(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+    def rebuild_rollups(self):
+        """Recompute rollups after checks were written outside the writer"""
+        self.storage.rebuild_rollups()
+    
+    def data_version(self):
+        """Cheap fingerprint that changes whenever checks land or monitors
+        change, including writes from other processes"""
+        return self.storage.data_version()
+    
+    def build_report(self):
+        """Report for all active monitors, without touching the filesystem"""
         # Get all active monitors
-        cursor.execute('SELECT * FROM monitors WHERE is_active = 1')
-        monitors = cursor.fetchall()
+        monitors = self.storage.active_monitors()
         
         report = {
             'generated_at': datetime.now().isoformat(),
@@ -204,19 +384,25 @@ class APIMonitor:
         }
         
         for monitor in monitors:
-            monitor_data = {
-                'id': monitor[0],
-                'name': monitor[1],
-                'url': monitor[2],
-                'stats_24h': self.get_monitor_stats(monitor[0], 24),
-                'stats_7d': self.get_monitor_stats(monitor[0], 168)
-            }
-            report['monitors'].append(monitor_data)
+            report['monitors'].append(self.report_entry(monitor))
         
-        conn.close()
+        return report
+    
+    def report_entry(self, monitor):
+        """One monitor's part of the report"""
+        return {
+            'id': monitor['id'],
+            'name': monitor['name'],
+            'url': monitor['url'],
+            'stats_24h': self.get_monitor_stats(monitor['id'], 24),
+            'stats_7d': self.get_monitor_stats(monitor['id'], 168)
+        }
+    
+    def generate_report(self, path='/home/daytona/data/monitor_report.json'):
+        report = self.build_report()
         
         # Save report
-        with open('/home/daytona/data/monitor_report.json', 'w') as f:
+        with open(path, 'w') as f:
             json.dump(report, f, indent=2)
         
         return report
@@ -236,13 +422,8 @@ if __name__ == "__main__":
     print("\nPerforming initial checks...")
     
     # Check all monitors
-    conn = sqlite3.connect(monitor.db_path)
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, name FROM monitors WHERE is_active = 1')
-    monitors = cursor.fetchall()
-    conn.close()
-    
-    for mon_id, mon_name in monitors:
+    for row in monitor.storage.active_monitors():
+        mon_id, mon_name = row['id'], row['name']
         print(f"\nChecking {mon_name}...")
         result = monitor.check_endpoint(mon_id)
         if result['error']:
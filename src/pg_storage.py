@@ -0,0 +1,556 @@
+"""
+PostgreSQL storage (see storage.py) - EXPERIMENTAL
+Needs psycopg 3 and psycopg_pool (pip install "psycopg[binary]" psycopg_pool).
+
+Nothing in the app or the worker opens this backend yet: open_storage
+refuses postgres URLs, because leases, retention, alert delivery and
+export only run on SQLite. It is exercised by the storage conformance
+tests and benchmarks/bench_storage.py, and its interface may change
+until those parts run here too.
+
+Checks are partitioned by day on checked_at, so window queries only touch
+the partitions they cover and old history goes with a DROP TABLE rather
+than a DELETE. Partitions are created the first time a check falls in
+them. Check batches are ingested with COPY; rollups are merged in Python
+(the sketches are opaque to Postgres) under an advisory lock, so any
+number of processes can write. The same lock is taken before check ids
+are drawn, so ids become visible in order (see insert_checks).
+
+Timestamps are UTC in TIMESTAMP (without time zone) columns, the same
+values SQLite stores as text.
+"""
+
+import time
+from datetime import datetime, timedelta
+
+try:
+    from . import rollups
+    from .db import utc_timestamp
+    from .storage import ALERT_COLUMNS, CHECK_COLUMNS, MONITORS_QUERY, Storage, rollup_checks
+    from .validation import FIELDS
+except ImportError:  # running from inside src/
+    import rollups
+    from db import utc_timestamp
+    from storage import ALERT_COLUMNS, CHECK_COLUMNS, MONITORS_QUERY, Storage, rollup_checks
+    from validation import FIELDS
+
+# Serializes check batches across writers; any constant other code doesn't use
+ROLLUP_LOCK = 0x726f6c6c
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS monitors (
+        id BIGSERIAL PRIMARY KEY,
+        name TEXT NOT NULL,
+        url TEXT NOT NULL,
+        method TEXT DEFAULT 'GET',
+        expected_status INTEGER DEFAULT 200,
+        timeout INTEGER DEFAULT 30,
+        check_interval INTEGER DEFAULT 300,
+        email_alerts TEXT,
+        is_active BOOLEAN DEFAULT TRUE,
+        created_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'UTC'),
+        keep_alive BOOLEAN DEFAULT FALSE,
+        alert_state TEXT DEFAULT 'up',
+        headers TEXT,
+        assertions TEXT,
+        steps TEXT,
+        dns_ttl INTEGER DEFAULT 0,
+        tenant_id BIGINT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS tenants (
+        id BIGSERIAL PRIMARY KEY,
+        name TEXT NOT NULL,
+        tier TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'UTC')
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS tenant_usage (
+        tenant_id BIGINT NOT NULL,
+        hour TIMESTAMP NOT NULL,
+        checks INTEGER NOT NULL,
+        failed_checks INTEGER NOT NULL,
+        PRIMARY KEY (tenant_id, hour)
+    )
+    ''',
+    'CREATE SEQUENCE IF NOT EXISTS checks_id_seq',
+    f'''
+    CREATE TABLE IF NOT EXISTS checks (
+        id BIGINT NOT NULL DEFAULT nextval('checks_id_seq'),
+        monitor_id BIGINT NOT NULL,
+        status_code INTEGER,
+        response_time DOUBLE PRECISION,
+        error_message TEXT,
+        checked_at TIMESTAMP NOT NULL,
+        connection_reused BOOLEAN,
+        {', '.join(f'{phase}_us BIGINT' for phase in rollups.PHASES)}
+    ) PARTITION BY RANGE (checked_at)
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS alerts (
+        id BIGSERIAL PRIMARY KEY,
+        monitor_id BIGINT,
+        alert_type TEXT,
+        message TEXT,
+        sent_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'UTC'),
+        event TEXT,
+        recipient TEXT,
+        delivery_status TEXT,
+        attempts INTEGER DEFAULT 0,
+        next_attempt_at DOUBLE PRECISION,
+        delivered_at TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS monitor_changes (
+        id BIGSERIAL PRIMARY KEY,
+        monitor_id BIGINT NOT NULL,
+        change TEXT NOT NULL,
+        changed_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'UTC')
+    )
+    ''',
+] + [f'''
+    CREATE TABLE IF NOT EXISTS check_rollups_{granularity} (
+        monitor_id BIGINT NOT NULL,
+        bucket TIMESTAMP NOT NULL,
+        total_checks INTEGER NOT NULL,
+        successful_checks INTEGER NOT NULL,
+        response_time_sum DOUBLE PRECISION,
+        response_time_min DOUBLE PRECISION,
+        response_time_max DOUBLE PRECISION,
+        response_time_sketch BYTEA,
+        timed_checks INTEGER NOT NULL DEFAULT 0,
+        {', '.join(f'{phase}_us_sum BIGINT NOT NULL DEFAULT 0' for phase in rollups.PHASES)},
+        PRIMARY KEY (monitor_id, bucket)
+    )
+    ''' for granularity in rollups.GRANULARITIES]
+
+# Columns added to the tables above since they were first created. CREATE
+# TABLE IF NOT EXISTS leaves an existing table as it is, so a database from
+# an earlier release gets them here; a new column goes in its CREATE TABLE
+# and at the end of this list.
+ADDED_COLUMNS = [
+    ('monitors', 'keep_alive', 'BOOLEAN DEFAULT FALSE'),
+    ('monitors', 'alert_state', "TEXT DEFAULT 'up'"),
+    ('monitors', 'headers', 'TEXT'),
+    ('monitors', 'assertions', 'TEXT'),
+    ('monitors', 'steps', 'TEXT'),
+    ('monitors', 'dns_ttl', 'INTEGER DEFAULT 0'),
+    ('monitors', 'tenant_id', 'BIGINT'),
+    ('checks', 'connection_reused', 'BOOLEAN'),
+] + [('checks', f'{phase}_us', 'BIGINT') for phase in rollups.PHASES] + [
+    ('alerts', 'event', 'TEXT'),
+    ('alerts', 'recipient', 'TEXT'),
+    ('alerts', 'delivery_status', 'TEXT'),
+    ('alerts', 'attempts', 'INTEGER DEFAULT 0'),
+    ('alerts', 'next_attempt_at', 'DOUBLE PRECISION'),
+    ('alerts', 'delivered_at', 'TIMESTAMP'),
+] + [(f'check_rollups_{granularity}', column, definition)
+     for granularity in rollups.GRANULARITIES
+     for column, definition in [('response_time_sketch', 'BYTEA'),
+                                ('timed_checks', 'INTEGER NOT NULL DEFAULT 0')] +
+     [(f'{phase}_us_sum', 'BIGINT NOT NULL DEFAULT 0') for phase in rollups.PHASES]]
+
+# After ADDED_COLUMNS, since some cover added columns
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_monitors_tenant ON monitors (tenant_id, is_active)',
+    'CREATE INDEX IF NOT EXISTS idx_checks_monitor_time ON checks (monitor_id, checked_at)',
+    'CREATE INDEX IF NOT EXISTS idx_alerts_monitor_time ON alerts (monitor_id, sent_at)',
+    'CREATE INDEX IF NOT EXISTS idx_alerts_delivery ON alerts (delivery_status, next_attempt_at)',
+]
+
+# Raw checks as rollups.update tuples
+RAW_CHECKS = f'''
+    SELECT monitor_id, to_char(checked_at, 'YYYY-MM-DD HH24:MI:SS') AS checked_at,
+           error_message IS NULL AS succeeded, response_time,
+           CASE WHEN status_code IS NOT NULL
+                THEN ARRAY[{', '.join(f'{phase}_us' for phase in rollups.PHASES)}] END AS phases
+    FROM checks
+'''
+# The partial minute at the start of a window; a handful of rows at most
+RAW_QUERY = RAW_CHECKS + '''
+    WHERE monitor_id = %s
+    AND checked_at > %s AND checked_at < %s
+'''
+
+ROLLUP_QUERY = f'''
+    SELECT {', '.join(rollups.ROLLUP_COLUMNS)}
+    FROM check_rollups_{{granularity}}
+    WHERE monitor_id = %s
+    AND bucket >= %s AND bucket < %s
+'''
+
+
+def partition_name(day):
+    """checks_pYYYYMMDD for a 'YYYY-MM-DD' day"""
+    return 'checks_p' + day.replace('-', '')
+
+
+def next_day(day):
+    return (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+
+
+class PostgresStorage(Storage):
+    def __init__(self, url, schema=None, pool_size=10):
+        """schema: search_path for every connection (default: the server's)"""
+        try:
+            import psycopg
+            from psycopg.rows import dict_row
+            from psycopg_pool import ConnectionPool
+        except ImportError:
+            raise ImportError('PostgreSQL storage needs psycopg and psycopg_pool '
+                              '(pip install "psycopg[binary]" psycopg_pool)')
+        self.url = url
+        self.schema = schema
+        self.transient_errors = (psycopg.OperationalError,)
+        kwargs = {'row_factory': dict_row}
+        if schema is not None:
+            kwargs['options'] = f'-c search_path={schema}'
+        self.pool = ConnectionPool(url, min_size=1, max_size=pool_size, kwargs=kwargs,
+                                   name='api-monitor', open=True)
+        # Days known to have a checks partition
+        self._partitions = set()
+
+    def connect(self):
+        """Pooled connection in a transaction: committed when the block
+        exits, rolled back on error"""
+        return self.pool.connection()
+
+    def close(self):
+        self.pool.close()
+
+    def init_schema(self):
+        with self.connect() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            for table, column, definition in ADDED_COLUMNS:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {definition}')
+            for statement in INDEXES:
+                conn.execute(statement)
+
+    def _ensure_partitions(self, days):
+        """Create the daily checks partitions for `days` that don't exist
+        yet. Committed on their own connection, so a rolled back batch
+        doesn't leave the cache pointing at a partition that isn't there."""
+        days = [day for day in days if day not in self._partitions]
+        if not days:
+            return
+        with self.connect() as conn:
+            # Another process may be creating the same partition
+            conn.execute('SELECT pg_advisory_xact_lock(%s)', (ROLLUP_LOCK + 1,))
+            for day in sorted(days):
+                conn.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {partition_name(day)} PARTITION OF checks
+                    FOR VALUES FROM ('{day}') TO ('{next_day(day)}')
+                ''')
+        self._partitions.update(days)
+
+    def drop_partitions_before(self, day):
+        """Drop whole days of raw checks older than 'YYYY-MM-DD'; returns
+        the partitions dropped. Rollups are kept. Meant to replace the
+        batched DELETE in retention.py on this backend; nothing calls it
+        until the worker runs on PostgreSQL."""
+        with self.connect() as conn:
+            names = [row['name'] for row in conn.execute('''
+                SELECT c.relname AS name
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                JOIN pg_class p ON p.oid = i.inhparent
+                WHERE p.relname = 'checks' AND p.relnamespace = to_regnamespace(current_schema())
+                AND c.relname < %s
+            ''', (partition_name(day),))]
+            for name in names:
+                conn.execute(f'DROP TABLE {name}')
+        self._partitions.clear()
+        return sorted(names)
+
+    @staticmethod
+    def _tenant_limits(conn, tenant_ids):
+        # The tenant rows stay locked until the transaction ends, against
+        # other inserts for the same tenants and tier changes
+        tenant_ids = sorted(set(tenant_ids) - {None})
+        limits = {tenant_id: (None, 0) for tenant_id in tenant_ids}
+        if tenant_ids:
+            tiers = {row['id']: row['tier'] for row in conn.execute(
+                'SELECT id, tier FROM tenants WHERE id = ANY(%s) ORDER BY id FOR UPDATE', (tenant_ids,))}
+            counts = {row['tenant_id']: row['n'] for row in conn.execute('''
+                SELECT tenant_id, COUNT(*) AS n FROM monitors
+                WHERE tenant_id = ANY(%s) AND is_active
+                GROUP BY tenant_id
+            ''', (list(tiers),))}
+            limits.update((tenant_id, (tier, counts.get(tenant_id, 0))) for tenant_id, tier in tiers.items())
+        return limits
+
+    def insert_monitors(self, monitors, check=None):
+        columns = list(FIELDS)
+        with self.connect() as conn:
+            if check is not None:
+                check(monitors, self._tenant_limits(conn, [monitor['tenant_id'] for monitor in monitors]))
+            ids = [row['id'] for row in conn.execute(
+                "SELECT nextval('monitors_id_seq') AS id FROM generate_series(1, %s)", (len(monitors),))]
+            with conn.cursor() as cur:
+                cur.executemany(f'''
+                    INSERT INTO monitors (id, {', '.join(columns)})
+                    VALUES (%s, {', '.join(['%s'] * len(columns))})
+                ''', [[monitor_id] + [monitor[c] for c in columns] for monitor_id, monitor in zip(ids, monitors)])
+            self._log_changes(conn, ids, 'create')
+        return ids
+
+    def update_monitors(self, updates, check=None):
+        with self.connect() as conn:
+            ids = [update['id'] for update in updates]
+            missing = set(ids) - set(self._existing_ids(conn, ids))
+            if missing:
+                return missing
+            if check is not None:
+                owners = {row['id']: row['tenant_id'] for row in conn.execute(
+                    'SELECT id, tenant_id FROM monitors WHERE id = ANY(%s)', (ids,))}
+                check(updates, self._tenant_limits(conn, owners.values()), owners)
+            groups = {}
+            for update in updates:
+                fields = tuple(sorted(f for f in update if f != 'id'))
+                groups.setdefault(fields, []).append([update[f] for f in fields] + [update['id']])
+            with conn.cursor() as cur:
+                for fields, rows in groups.items():
+                    cur.executemany(f'''
+                        UPDATE monitors SET {', '.join(f'{f} = %s' for f in fields)} WHERE id = %s
+                    ''', rows)
+            self._log_changes(conn, ids, 'update')
+        return set()
+
+    def deactivate_monitors(self, monitor_ids):
+        with self.connect() as conn:
+            active = [row['id'] for row in conn.execute('''
+                UPDATE monitors SET is_active = FALSE
+                WHERE id = ANY(%s) AND is_active
+                RETURNING id
+            ''', (list(monitor_ids),))]
+            self._log_changes(conn, active, 'deactivate')
+        return active
+
+    @staticmethod
+    def _existing_ids(conn, ids):
+        return [row['id'] for row in conn.execute('SELECT id FROM monitors WHERE id = ANY(%s)', (ids,))]
+
+    @staticmethod
+    def _log_changes(conn, monitor_ids, change):
+        if monitor_ids:
+            conn.execute('''
+                INSERT INTO monitor_changes (monitor_id, change)
+                SELECT unnest(%s::bigint[]), %s
+            ''', (list(monitor_ids), change))
+
+    def change_version(self):
+        with self.connect() as conn:
+            return conn.execute('SELECT COALESCE(MAX(id), 0) AS v FROM monitor_changes').fetchone()['v']
+
+    def get_changes(self, since):
+        with self.connect() as conn:
+            rows = conn.execute('''
+                SELECT c.id, c.monitor_id, m.is_active, m.check_interval
+                FROM monitor_changes c LEFT JOIN monitors m ON m.id = c.monitor_id
+                WHERE c.id > %s
+                ORDER BY c.id
+            ''', (since,)).fetchall()
+        changes = {}
+        for row in rows:
+            since = row['id']
+            changes[row['monitor_id']] = row['check_interval'] if row['is_active'] else None
+        return since, changes
+
+    def get_monitors(self, monitor_ids):
+        with self.connect() as conn:
+            return conn.execute(MONITORS_QUERY + 'WHERE m.is_active AND m.id = ANY(%s)',
+                                (list(monitor_ids),)).fetchall()
+
+    def active_monitors(self):
+        with self.connect() as conn:
+            return conn.execute(MONITORS_QUERY + 'WHERE m.is_active ORDER BY m.id').fetchall()
+
+    def get_schedule(self):
+        with self.connect() as conn:
+            rows = conn.execute('SELECT id, check_interval FROM monitors WHERE is_active')
+            return {row['id']: row['check_interval'] for row in rows}
+
+    def last_checked(self, monitor_ids):
+        with self.connect() as conn:
+            rows = conn.execute('''
+                SELECT id, check_interval,
+                       EXTRACT(EPOCH FROM (SELECT MAX(checked_at) FROM checks
+                                           WHERE monitor_id = monitors.id))::float AS last
+                FROM monitors WHERE id = ANY(%s)
+            ''', (list(monitor_ids),))
+            return {row['id']: (row['check_interval'], row['last']) for row in rows}
+
+    def insert_checks(self, conn, rows):
+        if not rows:
+            return
+        # Before the COPY: the partitions are created on another connection
+        self._ensure_partitions({row[5][:10] for row in rows})
+        # Ids are drawn from the sequence during the COPY. Holding the lock
+        # from before then until commit means a batch that got lower ids
+        # has always committed first, so CheckTailer (which follows ids)
+        # can't pass over a batch that commits late. Also covers the
+        # rollup merge below.
+        conn.execute('SELECT pg_advisory_xact_lock(%s)', (ROLLUP_LOCK,))
+        with conn.cursor() as cur:
+            with cur.copy(f"COPY checks ({', '.join(CHECK_COLUMNS)}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+        self._update_rollups(conn, rollup_checks(rows))
+
+    def _update_rollups(self, conn, checks):
+        # Called with ROLLUP_LOCK held
+        for granularity in rollups.GRANULARITIES:
+            buckets = rollups.aggregate(checks, granularity)
+            monitor_ids, keys = zip(*buckets)
+            stored = conn.execute(f'''
+                SELECT monitor_id, to_char(bucket, 'YYYY-MM-DD HH24:MI:SS') AS bucket,
+                       {', '.join(rollups.ROLLUP_COLUMNS)}
+                FROM check_rollups_{granularity}
+                WHERE (monitor_id, bucket) IN (SELECT * FROM unnest(%s::bigint[], %s::timestamp[]))
+            ''', (list(monitor_ids), list(keys))).fetchall()
+            for row in stored:
+                key = (row['monitor_id'], row['bucket'])
+                buckets[key] = rollups.as_row(rollups.combine(
+                    [tuple(row[c] for c in rollups.ROLLUP_COLUMNS), buckets[key]]))
+            # COPY the merged rows into a scratch table and upsert from
+            # there; one statement instead of a round trip per bucket
+            conn.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS rollup_staging
+                (LIKE check_rollups_minute) ON COMMIT DELETE ROWS
+            ''')
+            with conn.cursor() as cur:
+                with cur.copy(f"COPY rollup_staging (monitor_id, bucket, {', '.join(rollups.ROLLUP_COLUMNS)}) "
+                              "FROM STDIN") as copy:
+                    for key, row in buckets.items():
+                        copy.write_row(key + row)
+            conn.execute(f'''
+                INSERT INTO check_rollups_{granularity} SELECT * FROM rollup_staging
+                ON CONFLICT (monitor_id, bucket) DO UPDATE SET
+                    {', '.join(f'{c} = excluded.{c}' for c in rollups.ROLLUP_COLUMNS)}
+            ''')
+            conn.execute('TRUNCATE rollup_staging')
+
+    def set_alert_states(self, conn, states):
+        with conn.cursor() as cur:
+            cur.executemany('UPDATE monitors SET alert_state = %s WHERE id = %s', states)
+
+    def insert_alerts(self, conn, rows):
+        with conn.cursor() as cur:
+            cur.executemany(f'''
+                INSERT INTO alerts ({', '.join(ALERT_COLUMNS)}, delivery_status)
+                VALUES ({', '.join(['%s'] * len(ALERT_COLUMNS))}, 'pending')
+            ''', rows)
+
+    def last_check_id(self):
+        with self.connect() as conn:
+            return conn.execute('SELECT COALESCE(MAX(id), 0) AS id FROM checks').fetchone()['id']
+
+    def checked_monitors_after(self, check_id):
+        with self.connect() as conn:
+            rows = conn.execute('''
+                SELECT monitor_id, MAX(id) AS last FROM checks WHERE id > %s GROUP BY monitor_id
+            ''', (check_id,)).fetchall()
+        return max((row['last'] for row in rows), default=check_id), {row['monitor_id'] for row in rows}
+
+    def checks_after(self, check_id, limit):
+        with self.connect() as conn:
+            return conn.execute(f'''
+                SELECT id, {', '.join(c for c in CHECK_COLUMNS if c != 'checked_at')},
+                       to_char(checked_at, 'YYYY-MM-DD HH24:MI:SS') AS checked_at
+                FROM checks WHERE id > %s ORDER BY id LIMIT %s
+            ''', (check_id, limit)).fetchall()
+
+    def window_stats(self, monitor_id, hours):
+        start = utc_timestamp(time.time() - hours * 3600)
+        first_minute, first_hour = rollups.window_bounds(start)
+        with self.connect() as conn:
+            head = [tuple(row.values()) for row in conn.execute(RAW_QUERY, (monitor_id, start, first_minute))]
+            parts = list(rollups.aggregate(head).values())
+            for granularity, low, high in (('minute', first_minute, first_hour),
+                                           ('hour', first_hour, rollups.END_OF_TIME)):
+                parts.extend(tuple(row.values()) for row in conn.execute(
+                    ROLLUP_QUERY.format(granularity=granularity), (monitor_id, low, high)))
+        return rollups.combine(parts)
+
+    def rebuild_rollups(self):
+        with self.connect() as conn:
+            conn.execute('SELECT pg_advisory_xact_lock(%s)', (ROLLUP_LOCK,))
+            for granularity in rollups.GRANULARITIES:
+                conn.execute(f'DELETE FROM check_rollups_{granularity}')
+            # One monitor at a time keeps memory to one monitor's buckets
+            monitor_ids = [row['id'] for row in conn.execute('SELECT id FROM monitors ORDER BY id')]
+            for monitor_id in monitor_ids:
+                checks = [tuple(row.values()) for row in conn.execute(
+                    RAW_CHECKS + 'WHERE monitor_id = %s', (monitor_id,))]
+                if not checks:
+                    continue
+                for granularity in rollups.GRANULARITIES:
+                    with conn.cursor() as cur:
+                        cur.executemany(f'''
+                            INSERT INTO check_rollups_{granularity}
+                                (monitor_id, bucket, {', '.join(rollups.ROLLUP_COLUMNS)})
+                            VALUES ({', '.join(['%s'] * (len(rollups.ROLLUP_COLUMNS) + 2))})
+                        ''', [key + row for key, row in rollups.aggregate(checks, granularity).items()])
+
+    def data_version(self):
+        with self.connect() as conn:
+            return tuple(conn.execute('''
+                SELECT (SELECT CASE WHEN is_called THEN last_value END FROM checks_id_seq) AS checks,
+                       (SELECT MAX(id) FROM monitors) AS monitors,
+                       (SELECT MAX(id) FROM monitor_changes) AS changes
+            ''').fetchone().values())
+
+    def add_tenant(self, name, tier):
+        with self.connect() as conn:
+            return conn.execute('INSERT INTO tenants (name, tier) VALUES (%s, %s) RETURNING id',
+                                (name, tier)).fetchone()['id']
+
+    def get_tenants(self):
+        with self.connect() as conn:
+            return conn.execute('SELECT id, name, tier, created_at FROM tenants ORDER BY id').fetchall()
+
+    def get_tenant(self, tenant_id):
+        with self.connect() as conn:
+            return conn.execute('SELECT id, name, tier, created_at FROM tenants WHERE id = %s',
+                                (tenant_id,)).fetchone()
+
+    def set_tenant_tier(self, tenant_id, tier, min_interval):
+        with self.connect() as conn:
+            if not conn.execute('UPDATE tenants SET tier = %s WHERE id = %s', (tier, tenant_id)).rowcount:
+                return False
+            ids = [row['id'] for row in conn.execute('''
+                UPDATE monitors SET check_interval = GREATEST(check_interval, %s)
+                WHERE tenant_id = %s
+                RETURNING id, is_active
+            ''', (min_interval, tenant_id)) if row['is_active']]
+            self._log_changes(conn, ids, 'update')
+        return True
+
+    def tenant_monitor_counts(self):
+        with self.connect() as conn:
+            return {row['tenant_id']: row['n'] for row in conn.execute('''
+                SELECT tenant_id, COUNT(*) AS n FROM monitors
+                WHERE tenant_id IS NOT NULL AND is_active
+                GROUP BY tenant_id
+            ''')}
+
+    def add_usage(self, conn, rows):
+        with conn.cursor() as cur:
+            cur.executemany('''
+                INSERT INTO tenant_usage (tenant_id, hour, checks, failed_checks) VALUES (%s, %s, %s, %s)
+                ON CONFLICT (tenant_id, hour) DO UPDATE SET
+                    checks = tenant_usage.checks + excluded.checks,
+                    failed_checks = tenant_usage.failed_checks + excluded.failed_checks
+            ''', rows)
+
+    def tenant_usage(self, tenant_id, since):
+        with self.connect() as conn:
+            return conn.execute('''
+                SELECT to_char(hour, 'YYYY-MM-DD HH24:MI:SS') AS hour, checks, failed_checks
+                FROM tenant_usage WHERE tenant_id = %s AND hour >= %s ORDER BY hour
+            ''', (tenant_id, since)).fetchall()
@@ -0,0 +1,111 @@
+"""
+Sampling profiler that can be switched on in a running process
+A background thread snapshots every thread's stack at a fixed interval
+and counts identical stacks. Stopping writes them in the folded format
+flamegraph.pl and speedscope read ("frame;frame;frame count" per line)
+and prints the functions that showed up most.
+
+In the worker, SIGPROF toggles it in the parent and every shard:
+
+    kill -PROF <worker pid>    # start sampling
+    kill -PROF <worker pid>    # stop and write profile-<name>-<pid>-<time>.folded
+"""
+
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+INTERVAL = 0.005
+
+
+def _stack(frame):
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(frames))
+
+
+class SamplingProfiler:
+    def __init__(self, name='process', interval=INTERVAL, directory=None):
+        self.name = name
+        self.interval = interval
+        self.directory = directory or tempfile.gettempdir()
+        self.stacks = Counter()
+        self.samples = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self.running:
+            return
+        self.stacks.clear()
+        self.samples = 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+        print(f"Profiler: {self.name} sampling every {self.interval * 1000:g}ms")
+
+    def stop(self):
+        """Stop sampling and write the profile; returns its path"""
+        if not self.running:
+            return None
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        return self.dump()
+
+    def toggle(self):
+        return self.stop() if self.running else self.start()
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                self.stacks[f"{names.get(thread_id, thread_id)};{_stack(frame)}"] += 1
+            self.samples += 1
+
+    def dump(self, path=None):
+        path = path or os.path.join(
+            self.directory, f"profile-{self.name}-{os.getpid()}-{int(time.time())}.folded")
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        # Innermost functions by share of samples (idle threads show up as
+        # their wait call)
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        print(f"Profiler: {self.name} wrote {self.samples} samples to {path}")
+        for leaf, count in leaves.most_common(10):
+            print(f"  {count / max(1, self.samples):6.1%}  {leaf}")
+        return path
+
+
+def install(name='process', signum=signal.SIGPROF, also=None):
+    """Toggle a profiler for this process on `signum`; `also()` runs after
+    each toggle (the worker uses it to pass the signal on to its shards)"""
+    profiler = SamplingProfiler(name)
+
+    def handler(signum, frame):
+        # Dumping does file I/O; keep it off the interrupted thread
+        threading.Thread(target=profiler.toggle, daemon=True).start()
+        if also is not None:
+            also()
+
+    signal.signal(signum, handler)
+    return profiler
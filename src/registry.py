@@ -0,0 +1,140 @@
+"""
+In-memory registry of monitor definitions
+Checks read their monitor from here instead of the database. The registry
+is loaded once and then kept current from the monitor_changes log, so the
+only per-tick query is the (usually empty) change poll.
+"""
+
+import threading
+
+# Columns a check needs; everything else stays in the database
+FIELDS = ('id', 'name', 'url', 'method', 'expected_status', 'timeout', 'check_interval',
+          'email_alerts', 'keep_alive', 'dns_ttl', 'alert_state', 'headers', 'assertions', 'steps',
+          'tenant_id', 'tier')
+
+# Fields whose values most monitors share (methods, timeouts, intervals,
+# alert lists); each distinct value is stored once rather than once per record
+SHARED = ('method', 'expected_status', 'timeout', 'check_interval', 'email_alerts', 'dns_ttl',
+          'alert_state', 'headers', 'assertions', 'steps', 'tier')
+
+# value -> [value, number of records holding it]; dropped at zero so
+# deleted monitors' values don't stay for the life of the process
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def _share(value):
+    if value is None:
+        return None
+    with _shared_lock:
+        entry = _shared.get(value)
+        if entry is None:
+            entry = _shared[value] = [value, 0]
+        entry[1] += 1
+        return entry[0]
+
+
+def _unshare(value):
+    if value is None:
+        return
+    with _shared_lock:
+        entry = _shared.get(value)
+        if entry is not None:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del _shared[value]
+
+
+class MonitorRecord:
+    """One monitor's definition. Reads like a sqlite3.Row (record['url'],
+    dict(record)) so it can stand in wherever a monitors row was used."""
+
+    __slots__ = FIELDS
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.name = row['name']
+        self.url = row['url']
+        self.method = _share(row['method'])
+        self.expected_status = _share(row['expected_status'])
+        self.timeout = _share(row['timeout'])
+        self.check_interval = _share(row['check_interval'])
+        self.email_alerts = _share(row['email_alerts'] or None)
+        self.keep_alive = bool(row['keep_alive'])
+        self.dns_ttl = _share(row['dns_ttl'] or 0)
+        self.alert_state = _share(row['alert_state'])
+        # JSON text, None for plain status checks; compiled on use
+        # (assertions.plan_for), once per distinct definition
+        self.headers = _share(row['headers'] or None)
+        self.assertions = _share(row['assertions'] or None)
+        self.steps = _share(row['steps'] or None)
+        # The tenant's tier name, joined in by Storage.get_monitors
+        self.tenant_id = row['tenant_id']
+        self.tier = _share(row['tier'] or None)
+
+    def release(self):
+        """Give back the shared values; called once the record is dropped"""
+        for field in SHARED:
+            _unshare(getattr(self, field))
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def keys(self):
+        return FIELDS
+
+    def __repr__(self):
+        return f"MonitorRecord(id={self.id}, url={self.url!r})"
+
+
+class MonitorRegistry:
+    def __init__(self, monitor):
+        """monitor: the APIMonitor (or ShardMonitor) whose schedule and
+        change log decide which monitors are held"""
+        self.monitor = monitor
+        self.records = {}
+        self.version = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, monitor_id):
+        return monitor_id in self.records
+
+    def get(self, monitor_id):
+        return self.records.get(monitor_id)
+
+    def refresh(self):
+        """Full resync against the schedule; returns it. Records already
+        held are kept as they are (the change log keeps them current), so
+        only monitors new to this registry are read."""
+        # Read the version first so no change made during the read is missed
+        self.version = self.monitor.change_version()
+        schedule = self.monitor.get_schedule()
+        for monitor_id in [m for m in self.records if m not in schedule]:
+            self._drop(monitor_id)
+        self._load([monitor_id for monitor_id in schedule if monitor_id not in self.records])
+        return schedule
+
+    def poll(self):
+        """Apply changes logged since the last poll; returns them as
+        {monitor_id: check_interval, or None once dropped}"""
+        self.version, changes = self.monitor.get_changes(self.version)
+        if changes:
+            for monitor_id, interval in changes.items():
+                if interval is None and monitor_id in self.records:
+                    self._drop(monitor_id)
+            self._load([monitor_id for monitor_id, interval in changes.items() if interval is not None])
+        return changes
+
+    def _drop(self, monitor_id):
+        self.records.pop(monitor_id).release()
+        self.monitor.forget_monitor(monitor_id)
+
+    def _load(self, monitor_ids):
+        if monitor_ids:
+            for row in self.monitor.get_monitors(monitor_ids):
+                old = self.records.get(row['id'])
+                self.records[row['id']] = MonitorRecord(row)
+                if old is not None:
+                    old.release()
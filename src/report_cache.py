@@ -0,0 +1,73 @@
+"""
+In-memory cache for the /api/monitors report
+The whole report is built once, then kept up to date piece by piece: each
+request asks which monitors have had checks since the last one and
+recomputes only their stats. It is rebuilt in full when monitors are
+created, changed or deactivated, or when it is older than max_age (windows
+slide even without new checks). Each version carries an ETag so unchanged
+polls can be answered with a 304.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime
+
+
+class ReportCache:
+    def __init__(self, monitor, max_age=60, clock=time.monotonic):
+        self.monitor = monitor
+        self.max_age = max_age
+        self.clock = clock
+        self.builds = 0
+        self.refreshes = 0
+        self._lock = threading.Lock()
+        self._body = None
+        self._etag = None
+        self._entries = {}       # monitor id -> report entry, in report order
+        self._changes = None     # monitor change version the entries are from
+        self._last_check = 0     # highest check id reflected in the entries
+        self._built_at = None
+
+    def _stale(self, changes):
+        return (self._body is None or changes != self._changes
+                or self.clock() - self._built_at >= self.max_age)
+
+    def get(self):
+        """Return (json_body_bytes, etag) for the current report"""
+        # One thread updates; the others wait and reuse its result
+        with self._lock:
+            storage = self.monitor.storage
+            changes = storage.change_version()
+            if self._stale(changes):
+                # Checks landing during the build are applied again next time
+                last_check = storage.last_check_id()
+                report = self.monitor.build_report()
+                self.builds += 1
+                self._entries = {entry['id']: entry for entry in report['monitors']}
+                self._changes = changes
+                self._last_check = last_check
+                self._built_at = self.clock()
+                self._publish(report['generated_at'])
+                return self._body, self._etag
+
+            self._last_check, checked = storage.checked_monitors_after(self._last_check)
+            checked = [monitor_id for monitor_id in checked if monitor_id in self._entries]
+            if checked:
+                for monitor_id in checked:
+                    entry = self._entries[monitor_id]
+                    entry['stats_24h'] = self.monitor.get_monitor_stats(monitor_id, 24)
+                    entry['stats_7d'] = self.monitor.get_monitor_stats(monitor_id, 168)
+                self.refreshes += 1
+                self._publish(datetime.now().isoformat())
+            return self._body, self._etag
+
+    def _publish(self, generated_at):
+        monitors = list(self._entries.values())
+        # generated_at changes every time, so leave it out of the tag: new
+        # stats identical to the old keep the old ETag (and body)
+        digest = hashlib.sha1(json.dumps(monitors, sort_keys=True).encode()).hexdigest()
+        if digest != self._etag:
+            self._body = json.dumps({'generated_at': generated_at, 'monitors': monitors}).encode()
+            self._etag = digest
@@ -0,0 +1,214 @@
+"""
+Retention for check history
+Raw checks are kept only as long as the stats windows need them; older
+history lives on in the per-minute and per-hour rollups, which are written
+in the same transaction as the raw rows (see rollups.py) and are expired in
+turn. Deletes run in small batches, each in its own short transaction, so
+the check writer never waits long for the lock. Freed pages are handed back
+to the filesystem with incremental vacuum.
+"""
+
+import threading
+import time
+
+try:
+    from .config import Config
+    from .db import utc_timestamp
+except ImportError:  # running from inside src/
+    from config import Config
+    from db import utc_timestamp
+
+BATCH_SIZE = 2000
+# Pause between batches so queued writes get the lock in between
+BATCH_PAUSE = 0.01
+# Monitors whose expired rollups one batch looks for
+MONITORS_PER_BATCH = 500
+# Pages released per incremental_vacuum call
+VACUUM_PAGES = 2000
+
+DAY = 86400
+CHANGE_LOG_DAYS = 1
+
+
+class RetentionJob:
+    def __init__(self, db, raw_days=None, minute_days=None, hour_days=None, alert_days=None,
+                 batch_size=BATCH_SIZE, batch_pause=BATCH_PAUSE, clock=time.time):
+        self.db = db
+        self.raw_days = Config.RAW_RETENTION_DAYS if raw_days is None else raw_days
+        self.minute_days = Config.MINUTE_ROLLUP_RETENTION_DAYS if minute_days is None else minute_days
+        self.hour_days = Config.HOUR_ROLLUP_RETENTION_DAYS if hour_days is None else hour_days
+        self.alert_days = Config.ALERT_RETENTION_DAYS if alert_days is None else alert_days
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.clock = clock
+        self._stop = threading.Event()
+
+    def cutoff(self, days):
+        return utc_timestamp(self.clock() - days * DAY)
+
+    def run_once(self):
+        """Expire everything past its retention and vacuum; returns a report
+        of rows deleted per table and bytes given back to the filesystem"""
+        started = time.monotonic()
+        report = {
+            'checks': self.expire_checks(self.cutoff(self.raw_days)),
+            'check_rollups_minute': self.expire_rollups('minute', self.cutoff(self.minute_days)),
+            'check_rollups_hour': self.expire_rollups('hour', self.cutoff(self.hour_days)),
+            'alerts': self.expire_alerts(self.cutoff(self.alert_days)),
+            'monitor_changes': self.expire_changes(self.cutoff(CHANGE_LOG_DAYS)),
+        }
+        report['bytes_reclaimed'] = self.vacuum()
+        report['duration'] = round(time.monotonic() - started, 3)
+        print(f"Retention: deleted {report['checks']} checks, "
+              f"{report['check_rollups_minute'] + report['check_rollups_hour']} rollups, "
+              f"{report['alerts']} alerts; reclaimed {report['bytes_reclaimed']} bytes "
+              f"in {report['duration']}s")
+        return report
+
+    def expire_checks(self, cutoff):
+        # idx_checks_time would find the expired rows too, but ids grow with
+        # checked_at, so walking the rowid from the oldest end reads each
+        # batch as one contiguous rowid range (SEARCH ... rowid>? AND
+        # rowid<?) and the walk stops at the first batch with nothing left
+        # to expire
+        deleted = 0
+        after = 0
+        while not self._stop.is_set():
+            with self.db.connect() as conn:
+                last = conn.execute('''
+                    SELECT MAX(id) FROM (
+                        SELECT id FROM checks WHERE id > ? ORDER BY id LIMIT ?
+                    )
+                ''', (after, self.batch_size)).fetchone()[0]
+                if last is None:
+                    break
+                count = conn.execute('''
+                    DELETE FROM checks
+                    WHERE id > ? AND id <= ? AND checked_at < ?
+                ''', (after, last, cutoff)).rowcount
+            deleted += count
+            after = last
+            if count == 0:
+                break
+            time.sleep(self.batch_pause)
+        return deleted
+
+    def expire_rollups(self, granularity, cutoff):
+        # The rollups' only index is their (monitor_id, bucket) key, so
+        # "bucket < ?" on its own scans the whole table on every batch.
+        # Each monitor's expired buckets are a range at the start of its
+        # key instead, found with a primary key search; monitors are only
+        # ever deactivated, so the monitors table lists every monitor_id.
+        table = f'check_rollups_{granularity}'
+        with self.db.connect() as conn:
+            monitor_ids = [row[0] for row in conn.execute('SELECT id FROM monitors ORDER BY id')]
+        deleted = 0
+        position = 0
+        while position < len(monitor_ids) and not self._stop.is_set():
+            count = 0
+            visited = 0
+            with self.db.connect() as conn:
+                while position < len(monitor_ids) and count < self.batch_size and visited < MONITORS_PER_BATCH:
+                    monitor_id = monitor_ids[position]
+                    limit = self.batch_size - count
+                    removed = conn.execute(f'''
+                        DELETE FROM {table}
+                        WHERE monitor_id = ? AND bucket IN (
+                            SELECT bucket FROM {table}
+                            WHERE monitor_id = ? AND bucket < ? ORDER BY bucket LIMIT ?
+                        )
+                    ''', (monitor_id, monitor_id, cutoff, limit)).rowcount
+                    count += removed
+                    visited += 1
+                    if removed < limit:
+                        position += 1
+            deleted += count
+            time.sleep(self.batch_pause)
+        return deleted
+
+    def expire_alerts(self, cutoff):
+        return self._delete_batches('''
+            DELETE FROM alerts
+            WHERE id IN (SELECT id FROM alerts WHERE sent_at < ? ORDER BY id LIMIT ?)
+        ''', cutoff)
+
+    def expire_changes(self, cutoff):
+        # Schedulers fully resync every few minutes, so a day of change log is plenty
+        return self._delete_batches('''
+            DELETE FROM monitor_changes
+            WHERE id IN (SELECT id FROM monitor_changes WHERE changed_at < ? ORDER BY id LIMIT ?)
+        ''', cutoff)
+
+    def _delete_batches(self, query, cutoff):
+        deleted = 0
+        while not self._stop.is_set():
+            with self.db.connect() as conn:
+                count = conn.execute(query, (cutoff, self.batch_size)).rowcount
+            deleted += count
+            if count < self.batch_size:
+                break
+            time.sleep(self.batch_pause)
+        return deleted
+
+    def vacuum(self):
+        """Release free pages in small steps; returns bytes reclaimed.
+        Databases created before auto_vacuum was enabled need a one-off
+        enable_incremental_vacuum() first, until then this is a no-op."""
+        with self.db.connect() as conn:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                return 0
+            page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+            before = conn.execute('PRAGMA page_count').fetchone()[0]
+        while not self._stop.is_set():
+            with self.db.connect() as conn:
+                if conn.execute('PRAGMA freelist_count').fetchone()[0] == 0:
+                    break
+                conn.execute(f'PRAGMA incremental_vacuum({VACUUM_PAGES})').fetchall()
+            time.sleep(self.batch_pause)
+        with self.db.connect() as conn:
+            after = conn.execute('PRAGMA page_count').fetchone()[0]
+        return (before - after) * page_size
+
+    def enable_incremental_vacuum(self):
+        """Switch an existing database to auto_vacuum=INCREMENTAL. This runs
+        a full VACUUM, which blocks writers for its duration, so it is a
+        manual step rather than part of the regular job."""
+        conn = self.db.connection()
+        conn.commit()
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('VACUUM')
+
+    def run_forever(self, interval=None):
+        interval = Config.RETENTION_INTERVAL if interval is None else interval
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Retention error: {e}")
+            self._stop.wait(interval)
+
+    def start(self, interval=None):
+        thread = threading.Thread(target=self.run_forever, args=(interval,),
+                                  name='retention', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+    from db import Database
+
+    parser = argparse.ArgumentParser(description='Expire old check history')
+    parser.add_argument('--db', default=os.environ.get('DATABASE_PATH', '/tmp/api_monitor.db'))
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help='one-off VACUUM to switch an existing database over')
+    args = parser.parse_args()
+
+    job = RetentionJob(Database(args.db))
+    if args.enable_incremental_vacuum:
+        job.enable_incremental_vacuum()
+    job.run_once()
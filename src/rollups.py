@@ -0,0 +1,252 @@
+"""
+Pre-aggregated check statistics
+Per-minute and per-hour rollups of checks are kept up to date by the check
+writer, so window stats read a few dozen rollup rows instead of every raw
+check. Raw checks are only read for the partial minute at the start of a
+window. Each bucket also keeps a latency sketch (see sketch.py) so window
+percentiles come from merging sketches rather than sorting raw rows, and
+per-phase time sums (DNS, connect, TLS, first byte, transfer) over the
+checks that got a response, for average phase breakdowns.
+"""
+
+from datetime import datetime, timedelta
+
+try:
+    from .sketch import DDSketch
+except ImportError:  # running from inside src/
+    from sketch import DDSketch
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Stored per check as {phase}_us, whole microseconds (see httpclient.Timings)
+PHASES = ('dns', 'connect', 'tls', 'ttfb', 'transfer')
+END_OF_TIME = '9999-12-31 23:59:59'
+
+# name -> length of the checked_at prefix that identifies the bucket
+GRANULARITIES = {
+    'minute': 16,   # 'YYYY-MM-DD HH:MM'
+    'hour': 13,     # 'YYYY-MM-DD HH'
+}
+STEPS = {'minute': timedelta(minutes=1), 'hour': timedelta(hours=1)}
+
+# Columns added after the first rollup release. Existing rows keep their
+# counts and get the defaults; see backfill.
+ADDED_COLUMNS = [('response_time_sketch', 'BLOB'), ('timed_checks', 'INTEGER NOT NULL DEFAULT 0')] + \
+    [(f'{phase}_us_sum', 'INTEGER NOT NULL DEFAULT 0') for phase in PHASES]
+
+# Aggregates of raw checks in rollup column order. Phase sums cover the
+# checks that got a response; a phase that didn't run (TLS on http, DNS
+# from the cache, anything on a reused connection) adds nothing.
+RAW_AGGREGATES = '''
+        COUNT(*),
+        COUNT(CASE WHEN error_message IS NULL THEN 1 END),
+        SUM(response_time),
+        MIN(response_time),
+        MAX(response_time),
+        sketch_of(response_time),
+        COUNT(status_code),
+        ''' + ',\n        '.join(f'TOTAL(CASE WHEN status_code IS NOT NULL THEN {phase}_us END)'
+                              for phase in PHASES)
+ROLLUP_COLUMNS = ('total_checks', 'successful_checks', 'response_time_sum', 'response_time_min',
+                  'response_time_max', 'response_time_sketch', 'timed_checks') + \
+    tuple(f'{phase}_us_sum' for phase in PHASES)
+
+# Raw stats for checks in (start, end); served by idx_checks_monitor_time
+STATS_QUERY = f'''
+    SELECT {RAW_AGGREGATES}
+    FROM checks
+    WHERE monitor_id = ?
+    AND checked_at > ? AND checked_at < ?
+'''
+
+ROLLUP_QUERY = '''
+    SELECT
+        SUM(total_checks),
+        SUM(successful_checks),
+        SUM(response_time_sum),
+        MIN(response_time_min),
+        MAX(response_time_max),
+        sketch_union(response_time_sketch),
+        SUM(timed_checks),
+        ''' + ',\n        '.join(f'SUM({phase}_us_sum)' for phase in PHASES) + '''
+    FROM check_rollups_{granularity}
+    WHERE monitor_id = ?
+    AND bucket >= ? AND bucket < ?
+'''
+
+
+def bucket(checked_at, granularity):
+    """Bucket key for a 'YYYY-MM-DD HH:MM:SS' timestamp"""
+    prefix = checked_at[:GRANULARITIES[granularity]]
+    return prefix + (':00' if granularity == 'minute' else ':00:00')
+
+
+def create_tables(cursor):
+    """Create the rollup tables, or add the columns of later releases to
+    existing ones; returns True if they were just created (and need building)"""
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'check_rollups_minute'")
+    created = cursor.fetchone()[0] == 0
+    added = False
+    for granularity in GRANULARITIES:
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS check_rollups_{granularity} (
+                monitor_id INTEGER NOT NULL,
+                bucket TIMESTAMP NOT NULL,
+                total_checks INTEGER NOT NULL,
+                successful_checks INTEGER NOT NULL,
+                response_time_sum REAL,
+                response_time_min REAL,
+                response_time_max REAL,
+                PRIMARY KEY (monitor_id, bucket)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute(f'PRAGMA table_info(check_rollups_{granularity})')
+        existing = [row[1] for row in cursor.fetchall()]
+        for column, definition in ADDED_COLUMNS:
+            if column not in existing:
+                cursor.execute(f'ALTER TABLE check_rollups_{granularity} ADD COLUMN {column} {definition}')
+                added = True
+    if added and not created:
+        backfill(cursor)
+    return created
+
+
+def _recompute(cursor, granularity, since=None):
+    width = GRANULARITIES[granularity]
+    suffix = ':00' if granularity == 'minute' else ':00:00'
+    cursor.execute(f'''
+        INSERT OR REPLACE INTO check_rollups_{granularity} (monitor_id, bucket, {', '.join(ROLLUP_COLUMNS)})
+        SELECT monitor_id, substr(checked_at, 1, {width}) || '{suffix}', {RAW_AGGREGATES}
+        FROM checks
+        WHERE checked_at >= ?
+        GROUP BY 1, 2
+    ''', (since or '',))
+
+
+def rebuild(cursor):
+    """Recompute every rollup from the raw checks table. Buckets older
+    than raw retention are lost; on a pruned database use backfill."""
+    for granularity in GRANULARITIES:
+        cursor.execute(f'DELETE FROM check_rollups_{granularity}')
+        _recompute(cursor, granularity)
+
+
+def backfill(cursor):
+    """Recompute the buckets the raw checks still fully cover, filling in
+    columns added since they were written. Older buckets (raw checks gone
+    to retention) keep their counts, with the new columns at their defaults."""
+    first = cursor.execute('SELECT MIN(checked_at) FROM checks').fetchone()[0]
+    if first is None:
+        return
+    for granularity in GRANULARITIES:
+        # Retention may have taken part of the oldest check's bucket
+        start = datetime.strptime(bucket(first, granularity), TIMESTAMP_FORMAT) + STEPS[granularity]
+        _recompute(cursor, granularity, start.strftime(TIMESTAMP_FORMAT))
+
+
+def aggregate(checks, granularity=None):
+    """Rollup rows (ROLLUP_COLUMNS order) for update() tuples, keyed by
+    (monitor_id, bucket), or by monitor_id alone without a granularity"""
+    buckets = {}
+    for monitor_id, checked_at, succeeded, response_time, phases in checks:
+        key = monitor_id if granularity is None else (monitor_id, bucket(checked_at, granularity))
+        agg = buckets.get(key)
+        if agg is None:
+            agg = buckets[key] = [0, 0, None, None, None, DDSketch(), 0] + [0] * len(PHASES)
+        agg[0] += 1
+        agg[1] += int(succeeded)
+        # Checks that were never sent (circuit open) have no response time
+        if response_time is not None:
+            if agg[2] is None:
+                agg[2:5] = [0.0, response_time, response_time]
+            agg[2] += response_time
+            agg[3] = min(agg[3], response_time)
+            agg[4] = max(agg[4], response_time)
+            agg[5].add(response_time)
+        if phases is not None:
+            agg[6] += 1
+            for i, micros in enumerate(phases, 7):
+                agg[i] += micros or 0
+    return {key: tuple(agg[:5]) + (agg[5].to_bytes(),) + tuple(agg[6:]) for key, agg in buckets.items()}
+
+
+def update(cursor, checks):
+    """Fold (monitor_id, checked_at, succeeded, response_time, phases)
+    tuples into the rollups; phases are microseconds in PHASES order (None
+    for a phase that didn't run), or None if the check got no response.
+    Called in the same transaction as the raw inserts."""
+    for granularity in GRANULARITIES:
+        buckets = aggregate(checks, granularity)
+        cursor.executemany(f'''
+            INSERT INTO check_rollups_{granularity} (monitor_id, bucket, {', '.join(ROLLUP_COLUMNS)})
+            VALUES ({', '.join('?' * (len(ROLLUP_COLUMNS) + 2))})
+            ON CONFLICT (monitor_id, bucket) DO UPDATE SET
+                total_checks = total_checks + excluded.total_checks,
+                successful_checks = successful_checks + excluded.successful_checks,
+                response_time_sum = coalesce(response_time_sum + excluded.response_time_sum,
+                                             response_time_sum, excluded.response_time_sum),
+                response_time_min = coalesce(min(response_time_min, excluded.response_time_min),
+                                             response_time_min, excluded.response_time_min),
+                response_time_max = coalesce(max(response_time_max, excluded.response_time_max),
+                                             response_time_max, excluded.response_time_max),
+                response_time_sketch = sketch_merge(response_time_sketch, excluded.response_time_sketch),
+                timed_checks = timed_checks + excluded.timed_checks,
+                {', '.join(f'{phase}_us_sum = {phase}_us_sum + excluded.{phase}_us_sum' for phase in PHASES)}
+        ''', [key + row for key, row in buckets.items()])
+
+
+def window_bounds(start):
+    """Split the window (start, now] into a raw head, whole minutes up to
+    the next hour, and whole hours from there on"""
+    start_dt = datetime.strptime(start, TIMESTAMP_FORMAT)
+    # The minute containing `start` is partial: checks at exactly `start` are excluded
+    first_minute = start_dt.replace(second=0) + timedelta(minutes=1)
+    first_hour = first_minute
+    if first_hour.minute:
+        first_hour = first_hour.replace(minute=0) + timedelta(hours=1)
+    return first_minute.strftime(TIMESTAMP_FORMAT), first_hour.strftime(TIMESTAMP_FORMAT)
+
+
+def window_stats(cursor, monitor_id, hours):
+    """Stats (as from combine) for checks in the last `hours` hours,
+    matching checked_at > datetime('now', -hours)"""
+    start = cursor.execute("SELECT datetime('now', '-' || ? || ' hours')", (hours,)).fetchone()[0]
+    first_minute, first_hour = window_bounds(start)
+
+    parts = [
+        cursor.execute(STATS_QUERY, (monitor_id, start, first_minute)).fetchone(),
+        cursor.execute(ROLLUP_QUERY.format(granularity='minute'),
+                       (monitor_id, first_minute, first_hour)).fetchone(),
+        cursor.execute(ROLLUP_QUERY.format(granularity='hour'),
+                       (monitor_id, first_hour, END_OF_TIME)).fetchone(),
+    ]
+    return combine(parts)
+
+
+def combine(parts):
+    """(total, successful, response_time_sum, min, max, sketch, timed_checks,
+    phase sums in microseconds)"""
+    total = successful = timed = 0
+    rt_sum = rt_min = rt_max = None
+    sketch = DDSketch()
+    phase_sums = [0] * len(PHASES)
+    for part in parts:
+        if not part[0]:
+            continue
+        total += part[0]
+        successful += part[1]
+        if part[2] is not None:
+            rt_sum = part[2] if rt_sum is None else rt_sum + part[2]
+            rt_min = part[3] if rt_min is None else min(rt_min, part[3])
+            rt_max = part[4] if rt_max is None else max(rt_max, part[4])
+        if part[5] is not None:
+            sketch.merge(DDSketch.from_bytes(part[5]))
+        timed += part[6] or 0
+        for i, value in enumerate(part[7:]):
+            phase_sums[i] += value or 0
+    return total, successful, rt_sum, rt_min, rt_max, sketch, timed, phase_sums
+
+
+def as_row(stats):
+    """combine() output back as a rollup row (ROLLUP_COLUMNS order)"""
+    total, successful, rt_sum, rt_min, rt_max, sketch, timed, phase_sums = stats
+    return (total, successful, rt_sum, rt_min, rt_max, sketch.to_bytes(), timed) + tuple(phase_sums)
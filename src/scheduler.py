@@ -0,0 +1,171 @@
+"""
+Per-monitor deadline scheduler
+Keeps monitors in a min-heap ordered by next due time so each one fires on
+its own check_interval. Start times are spread with jitter to avoid every
+monitor firing in the same second after a restart.
+"""
+
+import heapq
+import itertools
+import random
+import time
+from collections import deque
+
+MIN_INTERVAL = 1
+
+
+class LagStats:
+    """Scheduling lag (actual - intended fire time) over recent fires"""
+
+    def __init__(self, window=1024):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def record(self, lag):
+        self.count += 1
+        self.total += lag
+        self.max = max(self.max, lag)
+        self.recent.append(lag)
+
+    def summary(self):
+        recent = sorted(self.recent)
+        return {
+            'fires': self.count,
+            'avg_lag': self.total / self.count if self.count else 0.0,
+            'max_lag': self.max,
+            'p99_lag': recent[min(len(recent) - 1, int(len(recent) * 0.99))] if recent else 0.0,
+        }
+
+
+class Scheduler:
+    def __init__(self, jitter=1.0, clock=time.monotonic, rng=None):
+        """jitter is the fraction of its interval a monitor's first fire may
+        be delayed by (1.0 spreads first fires across a whole interval)"""
+        self.jitter = jitter
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self.lag = LagStats()
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._dead = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, monitor_id):
+        return monitor_id in self._entries
+
+    def add(self, monitor_id, interval, due=None):
+        """Schedule a monitor. Re-adding an existing monitor reschedules it."""
+        interval = max(MIN_INTERVAL, interval or MIN_INTERVAL)
+        if due is None:
+            due = self.clock() + self.rng.uniform(0, interval * self.jitter)
+        self.remove(monitor_id)
+        entry = [due, next(self._counter), monitor_id, interval]
+        self._entries[monitor_id] = entry
+        heapq.heappush(self._heap, entry)
+
+    def remove(self, monitor_id):
+        # Lazy deletion: mark the heap entry dead and skip it when popped
+        entry = self._entries.pop(monitor_id, None)
+        if entry is not None:
+            entry[2] = None
+            self._dead += 1
+            if self._dead > len(self._entries) + 64:
+                self._compact()
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if entry[2] is not None]
+        heapq.heapify(self._heap)
+        self._dead = 0
+
+    def interval(self, monitor_id):
+        entry = self._entries.get(monitor_id)
+        return entry[3] if entry else None
+
+    def update(self, monitor_id, interval, start_in=None):
+        """Change a monitor's interval, keeping its current phase where possible.
+        start_in sets the first fire of a monitor not scheduled yet."""
+        entry = self._entries.get(monitor_id)
+        if entry is None:
+            self.add(monitor_id, interval, due=None if start_in is None else self.clock() + start_in)
+        elif entry[3] != interval:
+            self.add(monitor_id, interval, due=min(entry[0], self.clock() + interval))
+
+    def expedite(self, monitor_id, delay):
+        """Fire a scheduled monitor within `delay` seconds if it isn't due
+        sooner anyway; it then carries on at its interval from there"""
+        entry = self._entries.get(monitor_id)
+        due = self.clock() + delay
+        if entry is not None and entry[0] > due:
+            self.add(monitor_id, entry[3], due=due)
+
+    def sync(self, schedule, start_in=None):
+        """Reconcile with a {monitor_id: check_interval} mapping of active
+        monitors. start_in maps new monitors to seconds until their first
+        fire; new monitors not in it get a jittered start."""
+        start_in = start_in or {}
+        for monitor_id in [m for m in self._entries if m not in schedule]:
+            self.remove(monitor_id)
+        for monitor_id, interval in schedule.items():
+            self.update(monitor_id, interval, start_in.get(monitor_id))
+
+    def apply(self, changes, start_in=None):
+        """Apply {monitor_id: check_interval, or None to drop it} changes"""
+        start_in = start_in or {}
+        for monitor_id, interval in changes.items():
+            if interval is None:
+                self.remove(monitor_id)
+            else:
+                self.update(monitor_id, interval, start_in.get(monitor_id))
+
+    def next_due(self):
+        """Due time of the earliest live entry, or None if nothing is scheduled"""
+        heap = self._heap
+        while heap and heap[0][2] is None:
+            heapq.heappop(heap)
+            self._dead -= 1
+        return heap[0][0] if heap else None
+
+    def time_until_next(self, default=1.0):
+        due = self.next_due()
+        if due is None:
+            return default
+        return max(0.0, due - self.clock())
+
+    def pop_due(self, now=None):
+        """Return (monitor_id, intended_fire_time) for monitors due at `now`
+        and reschedule each one interval after its intended fire time
+        (fixed rate, no drift)."""
+        now = self.clock() if now is None else now
+        heap = self._heap
+        fired = []
+        while heap and heap[0][0] <= now:
+            due, _, monitor_id, interval = heapq.heappop(heap)
+            if monitor_id is None:
+                self._dead -= 1
+                continue
+            fired.append((monitor_id, due))
+
+            next_due = due + interval
+            if next_due <= now:
+                # Fell more than a whole interval behind; skip missed fires
+                # rather than firing a burst to catch up
+                next_due = now + interval
+            entry = [next_due, next(self._counter), monitor_id, interval]
+            self._entries[monitor_id] = entry
+            heapq.heappush(heap, entry)
+        return fired
+
+    def record_fire(self, intended, actual=None):
+        """Record when a fired monitor actually started running; returns the lag"""
+        actual = self.clock() if actual is None else actual
+        lag = max(0.0, actual - intended)
+        self.lag.record(lag)
+        return lag
+
+    def lag_stats(self):
+        return self.lag.summary()
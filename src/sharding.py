@@ -0,0 +1,60 @@
+"""
+Consistent hashing of monitors onto worker shards
+Each shard owns many points on a hash ring and a monitor belongs to the
+first point at or after its own hash. Adding or removing a shard only moves
+the monitors between its points and their neighbours; everything else
+stays where it is, keeping its scheduler slot and pooled connections.
+"""
+
+import bisect
+import hashlib
+
+VIRTUAL_NODES = 160
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    def __init__(self, nodes=(), vnodes=VIRTUAL_NODES):
+        self.vnodes = vnodes
+        self._nodes = set()
+        self._points = []
+        self._owners = []
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self):
+        return sorted(self._nodes)
+
+    def add(self, node):
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        for i in range(self.vnodes):
+            point = _hash(f'{node}#{i}')
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node):
+        if node not in self._nodes:
+            return
+        self._nodes.discard(node)
+        kept = [(p, o) for p, o in zip(self._points, self._owners) if o != node]
+        self._points = [p for p, _ in kept]
+        self._owners = [o for _, o in kept]
+
+    def node_for(self, key):
+        if not self._points:
+            raise LookupError('Hash ring is empty')
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, node):
+        return node in self._nodes
@@ -0,0 +1,174 @@
+"""
+Mergeable latency sketch (DDSketch)
+Values are counted in logarithmically sized bins, so any quantile comes
+back within RELATIVE_ACCURACY of the exact value and two sketches merge by
+adding bin counts. Rollup buckets store one serialized sketch each, which
+lets a 7-day p99 be answered by merging stored sketches.
+"""
+
+import math
+
+RELATIVE_ACCURACY = 0.01
+# Bins are collapsed from the low end past this many, which bounds memory
+# at the cost of accuracy for the very lowest quantiles only
+MAX_BINS = 1024
+# Smaller values (including 0) all land in the zero bin
+MIN_VALUE = 1e-6
+FORMAT_VERSION = 1
+
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+
+class DDSketch:
+    __slots__ = ('bins', 'zero_count', 'count')
+
+    def __init__(self):
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value, count=1):
+        if value is None:
+            return
+        if value <= MIN_VALUE:
+            self.zero_count += count
+        else:
+            index = math.ceil(math.log(value) / _LOG_GAMMA)
+            self.bins[index] = self.bins.get(index, 0) + count
+            if len(self.bins) > MAX_BINS:
+                self._collapse()
+        self.count += count
+
+    def merge(self, other):
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        if len(self.bins) > MAX_BINS:
+            self._collapse()
+        return self
+
+    def _collapse(self):
+        indexes = sorted(self.bins)
+        excess = len(indexes) - MAX_BINS
+        target = indexes[excess]
+        for index in indexes[:excess]:
+            self.bins[target] += self.bins.pop(index)
+
+    def quantile(self, q):
+        """Value at quantile q (0..1), or None for an empty sketch"""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                # Midpoint of the bin in relative terms
+                return 2 * _GAMMA ** index / (_GAMMA + 1)
+        return 2 * _GAMMA ** max(self.bins) / (_GAMMA + 1)
+
+    def to_bytes(self):
+        out = bytearray([FORMAT_VERSION])
+        _put_varint(out, self.zero_count)
+        _put_varint(out, len(self.bins))
+        previous = 0
+        for index in sorted(self.bins):
+            # Neighbouring bins are close together, so deltas stay small
+            _put_varint(out, _zigzag(index - previous))
+            _put_varint(out, self.bins[index])
+            previous = index
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data):
+        sketch = cls()
+        if not data:
+            return sketch
+        if data[0] != FORMAT_VERSION:
+            raise ValueError(f"Unknown sketch format {data[0]}")
+        pos = 1
+        sketch.zero_count, pos = _get_varint(data, pos)
+        nbins, pos = _get_varint(data, pos)
+        index = 0
+        total = sketch.zero_count
+        for _ in range(nbins):
+            delta, pos = _get_varint(data, pos)
+            count, pos = _get_varint(data, pos)
+            index += _unzigzag(delta)
+            sketch.bins[index] = count
+            total += count
+        sketch.count = total
+        return sketch
+
+
+def merge_bytes(a, b):
+    """Merge two serialized sketches; either may be None"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return DDSketch.from_bytes(a).merge(DDSketch.from_bytes(b)).to_bytes()
+
+
+class SketchOf:
+    """SQLite aggregate: sketch of a column of values"""
+
+    def __init__(self):
+        self.sketch = DDSketch()
+
+    def step(self, value):
+        self.sketch.add(value)
+
+    def finalize(self):
+        return self.sketch.to_bytes() if self.sketch.count else None
+
+
+class SketchUnion:
+    """SQLite aggregate: merge of a column of serialized sketches"""
+
+    def __init__(self):
+        self.sketch = DDSketch()
+
+    def step(self, data):
+        if data is not None:
+            self.sketch.merge(DDSketch.from_bytes(data))
+
+    def finalize(self):
+        return self.sketch.to_bytes() if self.sketch.count else None
+
+
+def register(conn):
+    """Make sketch_merge(), sketch_of() and sketch_union() available in SQL"""
+    conn.create_function('sketch_merge', 2, merge_bytes, deterministic=True)
+    conn.create_aggregate('sketch_of', 1, SketchOf)
+    conn.create_aggregate('sketch_union', 1, SketchUnion)
+
+
+def _zigzag(n):
+    return n * 2 if n >= 0 else -n * 2 - 1
+
+
+def _unzigzag(n):
+    return n // 2 if n % 2 == 0 else -(n + 1) // 2
+
+
+def _put_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
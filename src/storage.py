@@ -0,0 +1,603 @@
+"""
+Storage backends
+APIMonitor keeps monitors, checks, alerts and their rollups in a Storage.
+SQLiteStorage is the default: one database file, written by the single
+check writer (see db.py). PostgresStorage (pg_storage.py) implements the
+same interface for deployments that outgrow one file.
+
+Leases, retention, alert delivery and export still work on the SQLite
+database directly (SQLiteStorage.db), so open_storage doesn't accept
+postgres:// URLs yet: a web process on Postgres would have no worker.
+PostgresStorage is passed to APIMonitor directly by the tests and
+benchmarks until those parts are ported.
+"""
+
+import calendar
+import time
+from abc import ABC, abstractmethod
+
+try:
+    from . import leases, rollups, sketch
+    from .db import Database
+    from .validation import FIELDS
+except ImportError:  # running from inside src/
+    import leases
+    import rollups
+    import sketch
+    from db import Database
+    from validation import FIELDS
+
+# Check row columns, in the order insert_checks takes them
+CHECK_COLUMNS = ('monitor_id', 'status_code', 'response_time', 'error_message', 'connection_reused',
+                 'checked_at') + tuple(f'{phase}_us' for phase in rollups.PHASES)
+# Alert row columns, in the order insert_alerts takes them; rows go in pending
+ALERT_COLUMNS = ('monitor_id', 'alert_type', 'message', 'event', 'recipient', 'next_attempt_at')
+
+
+def rollup_checks(rows):
+    """rollups.update tuples for check rows in CHECK_COLUMNS order"""
+    return [(row[0], row[5], row[3] is None, row[2], None if row[1] is None else tuple(row[6:]))
+            for row in rows]
+
+
+class Storage(ABC):
+    """What APIMonitor needs from a database. Monitors passed in have been
+    through validation.validate_monitors; rows come back as mappings
+    (row['url']) with the monitors table's columns."""
+
+    # Errors worth retrying a write batch on (lock timeouts, lost connections)
+    transient_errors = ()
+
+    @abstractmethod
+    def connect(self):
+        """Context manager yielding a connection inside a transaction, for
+        insert_checks, set_alert_states and insert_alerts"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    @abstractmethod
+    def init_schema(self):
+        """Create or migrate the schema"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def insert_monitors(self, monitors, check=None):
+        """Insert monitors in one transaction; returns their ids in order.
+        check(monitors, limits) runs first in the same transaction, with
+        the monitors' tenants locked against concurrent inserts and tier
+        changes, and raises to write nothing; limits is {tenant_id: (tier,
+        active monitors)} for those tenants (tier None if there is no such
+        tenant)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_monitors(self, updates, check=None):
+        """Apply partial updates ({'id': ..., field: value}) in one
+        transaction; returns the set of ids that don't exist, in which
+        case nothing is written. check(updates, limits, owners) is called
+        as for insert_monitors, with owners {monitor_id: tenant_id}."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def deactivate_monitors(self, monitor_ids):
+        """Deactivate the monitors that are active; returns their ids"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def change_version(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_changes(self, since):
+        """(version, {monitor_id: check_interval, or None once inactive})
+        for monitors changed after change version `since`"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_monitors(self, monitor_ids):
+        """Active monitor rows for the given ids"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def active_monitors(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_schedule(self):
+        """Map of active monitor id to its check_interval in seconds"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def last_checked(self, monitor_ids):
+        """{monitor_id: (check_interval, epoch seconds of its last check or None)}"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def insert_checks(self, conn, rows):
+        """Insert check rows (CHECK_COLUMNS order) and fold them into the rollups"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_alert_states(self, conn, states):
+        """(alert_state, monitor_id) pairs"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def insert_alerts(self, conn, rows):
+        """Queue alert rows (ALERT_COLUMNS order) for delivery"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def last_check_id(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def checked_monitors_after(self, check_id):
+        """(highest check id, ids of the monitors with checks above check_id)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def checks_after(self, check_id, limit):
+        """Up to `limit` check rows with ids above check_id, oldest first,
+        with an 'id' and CHECK_COLUMNS (checked_at as text)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def window_stats(self, monitor_id, hours):
+        """Stats as from rollups.combine for the last `hours` hours"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def rebuild_rollups(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def data_version(self):
+        """Cheap fingerprint that changes whenever checks land or monitors
+        change, including writes from other processes"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_tenant(self, name, tier):
+        """Returns the new tenant's id"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_tenants(self):
+        """Rows with each tenant's id, name, tier and created_at"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_tenant(self, tenant_id):
+        """The tenant's row, or None"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_tenant_tier(self, tenant_id, tier, min_interval):
+        """Move a tenant to another tier, raising its monitors' check
+        intervals to at least min_interval; returns False if there is no
+        such tenant"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def tenant_monitor_counts(self):
+        """{tenant_id: number of active monitors}"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_usage(self, conn, rows):
+        """Add (tenant_id, hour, checks, failed_checks) rows to tenant_usage"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def tenant_usage(self, tenant_id, since):
+        """Rows of hour (text), checks and failed_checks from hour `since` on"""
+        raise NotImplementedError
+
+
+# Monitor rows with their tenant's tier
+MONITORS_QUERY = '''
+    SELECT m.*, t.tier FROM monitors m LEFT JOIN tenants t ON t.id = m.tenant_id
+'''
+
+
+class SQLiteStorage(Storage):
+    transient_errors = Database.transient_errors
+
+    def __init__(self, path):
+        self.path = path
+        self.db = Database(path, setup=sketch.register)
+
+    def connect(self):
+        return self.db.connect()
+
+    def close(self):
+        self.db.close()
+
+    def init_schema(self):
+        with self.db.connect() as conn:
+            cursor = conn.cursor()
+
+            # Create tables
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS monitors (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    method TEXT DEFAULT 'GET',
+                    expected_status INTEGER DEFAULT 200,
+                    timeout INTEGER DEFAULT 30,
+                    check_interval INTEGER DEFAULT 300,
+                    email_alerts TEXT,
+                    is_active BOOLEAN DEFAULT 1,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    keep_alive BOOLEAN DEFAULT 0
+                )
+            ''')
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS checks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    monitor_id INTEGER,
+                    status_code INTEGER,
+                    response_time REAL,
+                    error_message TEXT,
+                    checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    connection_reused BOOLEAN,
+                    FOREIGN KEY (monitor_id) REFERENCES monitors (id)
+                )
+            ''')
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS alerts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    monitor_id INTEGER,
+                    alert_type TEXT,
+                    message TEXT,
+                    sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (monitor_id) REFERENCES monitors (id)
+                )
+            ''')
+
+            # Accounts owning monitors; the tier sets their limits (see tenants.py)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS tenants (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    tier TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Checks per tenant per hour, flushed from memory by the check writer
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS tenant_usage (
+                    tenant_id INTEGER NOT NULL,
+                    hour TIMESTAMP NOT NULL,
+                    checks INTEGER NOT NULL,
+                    failed_checks INTEGER NOT NULL,
+                    PRIMARY KEY (tenant_id, hour)
+                )
+            ''')
+
+            # Every create/update/deactivate, so schedulers can follow
+            # changes without re-reading the monitors table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS monitor_changes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    monitor_id INTEGER NOT NULL,
+                    change TEXT NOT NULL,
+                    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Columns added after the first release
+            self._ensure_column(cursor, 'monitors', 'keep_alive', 'BOOLEAN DEFAULT 0')
+            self._ensure_column(cursor, 'checks', 'connection_reused', 'BOOLEAN')
+            self._ensure_column(cursor, 'monitors', 'alert_state', "TEXT DEFAULT 'up'")
+            # Alerts double as the delivery queue; rows from before the
+            # queue existed have no delivery_status and are never sent
+            self._ensure_column(cursor, 'alerts', 'event', 'TEXT')
+            self._ensure_column(cursor, 'alerts', 'recipient', 'TEXT')
+            self._ensure_column(cursor, 'alerts', 'delivery_status', 'TEXT')
+            self._ensure_column(cursor, 'alerts', 'attempts', 'INTEGER DEFAULT 0')
+            self._ensure_column(cursor, 'alerts', 'next_attempt_at', 'REAL')
+            self._ensure_column(cursor, 'alerts', 'delivered_at', 'TIMESTAMP')
+            # Request headers, assertions and steps as JSON (see assertions.py)
+            self._ensure_column(cursor, 'monitors', 'headers', 'TEXT')
+            self._ensure_column(cursor, 'monitors', 'assertions', 'TEXT')
+            self._ensure_column(cursor, 'monitors', 'steps', 'TEXT')
+            # Seconds a DNS answer for the monitor's host may be reused
+            self._ensure_column(cursor, 'monitors', 'dns_ttl', 'INTEGER DEFAULT 0')
+            # Monitors from before tenants have none, and no limits
+            self._ensure_column(cursor, 'monitors', 'tenant_id', 'INTEGER REFERENCES tenants (id)')
+            # Where each check's time went, in whole microseconds
+            for phase in rollups.PHASES:
+                self._ensure_column(cursor, 'checks', f'{phase}_us', 'INTEGER')
+
+            # Indexes for the per-monitor time window queries
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_checks_monitor_time
+                ON checks (monitor_id, checked_at)
+            ''')
+            # Exports across all monitors page on (checked_at, id)
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_checks_time
+                ON checks (checked_at)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_alerts_monitor_time
+                ON alerts (monitor_id, sent_at)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_alerts_delivery
+                ON alerts (delivery_status, next_attempt_at)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_monitors_tenant
+                ON monitors (tenant_id, is_active)
+            ''')
+
+            # Per-minute/hour aggregates behind get_monitor_stats
+            if rollups.create_tables(cursor):
+                rollups.rebuild(cursor)
+
+            # Which worker node checks which monitor
+            leases.create_tables(cursor)
+
+    @staticmethod
+    def _ensure_column(cursor, table, column, definition):
+        cursor.execute(f'PRAGMA table_info({table})')
+        if column not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+    @staticmethod
+    def _tenant_limits(conn, tenant_ids):
+        # Call with the write lock held (BEGIN IMMEDIATE), so nothing else
+        # can add monitors or change tiers until the transaction ends
+        limits = {}
+        for tenant_id in set(tenant_ids) - {None}:
+            row = conn.execute('''
+                SELECT t.tier, (SELECT COUNT(*) FROM monitors m WHERE m.tenant_id = t.id AND m.is_active = 1)
+                FROM tenants t WHERE t.id = ?
+            ''', (tenant_id,)).fetchone()
+            limits[tenant_id] = tuple(row) if row else (None, 0)
+        return limits
+
+    def insert_monitors(self, monitors, check=None):
+        columns = list(FIELDS)
+        with self.db.connect() as conn:
+            if check is not None:
+                conn.execute('BEGIN IMMEDIATE')
+                check(monitors, self._tenant_limits(conn, [monitor['tenant_id'] for monitor in monitors]))
+            conn.executemany(f'''
+                INSERT INTO monitors ({', '.join(columns)})
+                VALUES ({', '.join('?' * len(columns))})
+            ''', [[monitor[c] for c in columns] for monitor in monitors])
+            # One transaction holds the write lock, so the ids are consecutive
+            last = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+            ids = list(range(last - len(monitors) + 1, last + 1))
+            self._log_changes(conn, ids, 'create')
+        return ids
+
+    def update_monitors(self, updates, check=None):
+        with self.db.connect() as conn:
+            ids = [update['id'] for update in updates]
+            missing = set(ids) - set(self._existing_ids(conn, ids))
+            if missing:
+                return missing
+            if check is not None:
+                conn.execute('BEGIN IMMEDIATE')
+                owners = {}
+                for i in range(0, len(ids), 500):
+                    chunk = ids[i:i + 500]
+                    owners.update(conn.execute(f'''
+                        SELECT id, tenant_id FROM monitors WHERE id IN ({','.join('?' * len(chunk))})
+                    ''', chunk).fetchall())
+                check(updates, self._tenant_limits(conn, owners.values()), owners)
+            # One executemany per distinct set of fields being changed
+            groups = {}
+            for update in updates:
+                fields = tuple(sorted(f for f in update if f != 'id'))
+                groups.setdefault(fields, []).append([update[f] for f in fields] + [update['id']])
+            for fields, rows in groups.items():
+                conn.executemany(f'''
+                    UPDATE monitors SET {', '.join(f'{f} = ?' for f in fields)} WHERE id = ?
+                ''', rows)
+            self._log_changes(conn, ids, 'update')
+        return set()
+
+    def deactivate_monitors(self, monitor_ids):
+        with self.db.connect() as conn:
+            active = self._existing_ids(conn, list(monitor_ids), active_only=True)
+            conn.executemany('UPDATE monitors SET is_active = 0 WHERE id = ?', [(i,) for i in active])
+            self._log_changes(conn, active, 'deactivate')
+        return active
+
+    @staticmethod
+    def _existing_ids(conn, ids, active_only=False):
+        found = []
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            found.extend(row[0] for row in conn.execute(f'''
+                SELECT id FROM monitors WHERE id IN ({','.join('?' * len(chunk))})
+                {'AND is_active = 1' if active_only else ''}
+            ''', chunk))
+        return found
+
+    @staticmethod
+    def _log_changes(conn, monitor_ids, change):
+        conn.executemany('INSERT INTO monitor_changes (monitor_id, change) VALUES (?, ?)',
+                         [(monitor_id, change) for monitor_id in monitor_ids])
+
+    def change_version(self):
+        with self.db.connect() as conn:
+            return conn.execute('SELECT COALESCE(MAX(id), 0) FROM monitor_changes').fetchone()[0]
+
+    def get_changes(self, since):
+        with self.db.connect() as conn:
+            rows = conn.execute('''
+                SELECT c.id, c.monitor_id, m.is_active, m.check_interval
+                FROM monitor_changes c LEFT JOIN monitors m ON m.id = c.monitor_id
+                WHERE c.id > ?
+                ORDER BY c.id
+            ''', (since,)).fetchall()
+        changes = {}
+        for version, monitor_id, is_active, interval in rows:
+            since = version
+            changes[monitor_id] = interval if is_active else None
+        return since, changes
+
+    def get_monitors(self, monitor_ids):
+        monitors = []
+        ids = list(monitor_ids)
+        with self.db.connect() as conn:
+            # Stay well below SQLITE_MAX_VARIABLE_NUMBER
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                monitors.extend(conn.execute(
+                    MONITORS_QUERY + f'WHERE m.is_active = 1 AND m.id IN ({placeholders})', chunk))
+        return monitors
+
+    def active_monitors(self):
+        with self.db.connect() as conn:
+            return conn.execute(MONITORS_QUERY + 'WHERE m.is_active = 1').fetchall()
+
+    def get_schedule(self):
+        with self.db.connect() as conn:
+            rows = conn.execute('SELECT id, check_interval FROM monitors WHERE is_active = 1')
+            return {row[0]: row[1] for row in rows}
+
+    def last_checked(self, monitor_ids):
+        found = {}
+        ids = list(monitor_ids)
+        with self.db.connect() as conn:
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                # The correlated MAX is a single seek on idx_checks_monitor_time
+                rows = conn.execute(f'''
+                    SELECT id, check_interval,
+                           (SELECT MAX(checked_at) FROM checks WHERE monitor_id = monitors.id)
+                    FROM monitors WHERE id IN ({placeholders})
+                ''', chunk)
+                for monitor_id, interval, last in rows:
+                    if last is not None:
+                        last = calendar.timegm(time.strptime(last, rollups.TIMESTAMP_FORMAT))
+                    found[monitor_id] = (interval, last)
+        return found
+
+    def insert_checks(self, conn, rows):
+        conn.executemany(f'''
+            INSERT INTO checks ({', '.join(CHECK_COLUMNS)})
+            VALUES ({', '.join('?' * len(CHECK_COLUMNS))})
+        ''', rows)
+        rollups.update(conn, rollup_checks(rows))
+
+    def set_alert_states(self, conn, states):
+        conn.executemany('UPDATE monitors SET alert_state = ? WHERE id = ?', states)
+
+    def insert_alerts(self, conn, rows):
+        conn.executemany(f'''
+            INSERT INTO alerts ({', '.join(ALERT_COLUMNS)}, delivery_status)
+            VALUES ({', '.join('?' * len(ALERT_COLUMNS))}, 'pending')
+        ''', rows)
+
+    def last_check_id(self):
+        with self.db.connect() as conn:
+            return conn.execute('SELECT COALESCE(MAX(id), 0) FROM checks').fetchone()[0]
+
+    def checked_monitors_after(self, check_id):
+        with self.db.connect() as conn:
+            rows = conn.execute('''
+                SELECT monitor_id, MAX(id) FROM checks WHERE id > ? GROUP BY monitor_id
+            ''', (check_id,)).fetchall()
+        return max((row[1] for row in rows), default=check_id), {row[0] for row in rows}
+
+    def checks_after(self, check_id, limit):
+        with self.db.connect() as conn:
+            return conn.execute(f'''
+                SELECT id, {', '.join(CHECK_COLUMNS)}
+                FROM checks WHERE id > ? ORDER BY id LIMIT ?
+            ''', (check_id, limit)).fetchall()
+
+    def window_stats(self, monitor_id, hours):
+        with self.db.connect() as conn:
+            # Whole minutes and hours come from the rollups; only the
+            # partial minute at the start of the window reads raw checks
+            return rollups.window_stats(conn, monitor_id, hours)
+
+    def rebuild_rollups(self):
+        with self.db.connect() as conn:
+            rollups.rebuild(conn)
+
+    def data_version(self):
+        with self.db.connect() as conn:
+            return tuple(conn.execute('''
+                SELECT (SELECT MAX(id) FROM checks),
+                       (SELECT MAX(id) FROM monitors),
+                       (SELECT MAX(id) FROM monitor_changes)
+            ''').fetchone())
+
+    def add_tenant(self, name, tier):
+        with self.db.connect() as conn:
+            return conn.execute('INSERT INTO tenants (name, tier) VALUES (?, ?)', (name, tier)).lastrowid
+
+    def get_tenants(self):
+        with self.db.connect() as conn:
+            return conn.execute('SELECT id, name, tier, created_at FROM tenants').fetchall()
+
+    def get_tenant(self, tenant_id):
+        with self.db.connect() as conn:
+            return conn.execute('SELECT id, name, tier, created_at FROM tenants WHERE id = ?',
+                                (tenant_id,)).fetchone()
+
+    def set_tenant_tier(self, tenant_id, tier, min_interval):
+        with self.db.connect() as conn:
+            if not conn.execute('UPDATE tenants SET tier = ? WHERE id = ?', (tier, tenant_id)).rowcount:
+                return False
+            conn.execute('UPDATE monitors SET check_interval = MAX(check_interval, ?) WHERE tenant_id = ?',
+                         (min_interval, tenant_id))
+            # Workers pick up the new tier and intervals like any other change
+            ids = [row[0] for row in conn.execute(
+                'SELECT id FROM monitors WHERE tenant_id = ? AND is_active = 1', (tenant_id,))]
+            self._log_changes(conn, ids, 'update')
+        return True
+
+    def tenant_monitor_counts(self):
+        with self.db.connect() as conn:
+            return dict(conn.execute('''
+                SELECT tenant_id, COUNT(*) FROM monitors
+                WHERE tenant_id IS NOT NULL AND is_active = 1
+                GROUP BY tenant_id
+            ''').fetchall())
+
+    def add_usage(self, conn, rows):
+        conn.executemany('''
+            INSERT INTO tenant_usage (tenant_id, hour, checks, failed_checks) VALUES (?, ?, ?, ?)
+            ON CONFLICT (tenant_id, hour) DO UPDATE SET
+                checks = checks + excluded.checks,
+                failed_checks = failed_checks + excluded.failed_checks
+        ''', rows)
+
+    def tenant_usage(self, tenant_id, since):
+        with self.db.connect() as conn:
+            return conn.execute('''
+                SELECT hour, checks, failed_checks FROM tenant_usage
+                WHERE tenant_id = ? AND hour >= ? ORDER BY hour
+            ''', (tenant_id, since)).fetchall()
+
+
+def open_storage(url):
+    """Storage for a sqlite:/// URL or a plain SQLite path. The schema is
+    not touched."""
+    if url.startswith(('postgres://', 'postgresql://')):
+        raise ValueError("PostgreSQL isn't supported as DATABASE_PATH yet: the backend in "
+                         "pg_storage.py is experimental, and leases, retention, alert delivery "
+                         "and export only run on SQLite")
+    if url.startswith('sqlite:///'):
+        url = url[len('sqlite:///'):]
+    return SQLiteStorage(url)
@@ -0,0 +1,140 @@
+"""
+Tenants and their tiers
+Every monitor may belong to a tenant; the tenant's tier caps how many
+active monitors it has, how often they are checked (including adaptive
+rechecks) and its share of check slots on shared workers (see
+fairqueue.py). Monitors without a tenant predate tenants and have no
+limits; the API only creates and changes monitors that have one, and
+only an admin can set a tenant's tier (see app.py).
+
+Quotas are checked inside the transaction that creates or changes the
+monitors, against the tier and active monitor count read there with the
+tenant locked (see Storage.insert_monitors), so concurrent requests and
+other processes can't both take a tenant's last slot. Check usage is
+counted in memory by the check writer and flushed to tenant_usage per hour.
+"""
+
+import threading
+import time
+
+try:
+    from .config import Config
+except ImportError:  # running from inside src/
+    from config import Config
+
+
+class Tier:
+    __slots__ = ('name', 'max_monitors', 'min_interval', 'min_recheck', 'weight')
+
+    def __init__(self, name, max_monitors, min_interval, min_recheck, weight):
+        """max_monitors: None for unlimited; weight: relative share of
+        check slots when tenants compete for them"""
+        self.name = name
+        self.max_monitors = max_monitors
+        self.min_interval = min_interval
+        self.min_recheck = min_recheck
+        self.weight = weight
+
+
+TIERS = {
+    'free': Tier('free', max_monitors=5, min_interval=300, min_recheck=60, weight=1),
+    'pro': Tier('pro', max_monitors=50, min_interval=60, min_recheck=15, weight=4),
+    'business': Tier('business', max_monitors=None, min_interval=30, min_recheck=10, weight=16),
+}
+# Share of check slots for monitors without a tenant
+UNOWNED_WEIGHT = 1
+
+
+def _field(monitor, name):
+    # Rows from before tenants (and hand-built dicts) don't have the fields
+    try:
+        return monitor[name]
+    except (KeyError, IndexError):
+        return None
+
+
+def tenant_of(monitor):
+    return _field(monitor, 'tenant_id')
+
+
+def tier_of(monitor):
+    """The monitor's Tier, or None for monitors without a tenant"""
+    return TIERS.get(_field(monitor, 'tier'))
+
+
+def weight_of(monitor):
+    tier = tier_of(monitor)
+    return UNOWNED_WEIGHT if tier is None else tier.weight
+
+
+def quota_problems(monitors, limits, owners=None, require_tenant=False):
+    """ValidationError entries for monitors (validated dicts: new ones, or
+    updates of the monitors in owners, {monitor_id: tenant_id}) that their
+    tenants' tiers don't allow. limits: {tenant_id: (tier name, or None if
+    there is no such tenant, active monitors)}, as Storage.insert_monitors
+    and update_monitors read them. require_tenant: monitors without a
+    tenant are refused rather than left unlimited."""
+    errors = []
+    added = {}
+    for index, monitor in enumerate(monitors):
+        tenant_id = monitor.get('tenant_id') if owners is None else owners.get(monitor['id'])
+        if tenant_id is None:
+            if require_tenant:
+                errors.append({'index': index, 'field': 'tenant_id',
+                               'message': "is required" if owners is None else "monitor has no tenant"})
+            continue
+        tier_name, active = limits.get(tenant_id, (None, 0))
+        tier = TIERS.get(tier_name)
+        if tier is None:
+            errors.append({'index': index, 'field': 'tenant_id', 'message': "no such tenant"})
+            continue
+        interval = monitor.get('check_interval')
+        if interval is not None and interval < tier.min_interval:
+            errors.append({'index': index, 'field': 'check_interval',
+                           'message': f"must be at least {tier.min_interval} on the {tier.name} tier"})
+        if owners is None and tier.max_monitors is not None:
+            added[tenant_id] = added.get(tenant_id, 0) + 1
+            if active + added[tenant_id] > tier.max_monitors:
+                errors.append({'index': index, 'field': 'tenant_id',
+                               'message': f"the {tier.name} tier allows {tier.max_monitors} monitors"})
+    return errors
+
+
+class TenantUsage:
+    """Checks and failed checks per tenant per hour, counted in memory on
+    the check writer thread and written out every flush_interval seconds"""
+
+    def __init__(self, flush_interval=None, clock=time.monotonic):
+        self.flush_interval = Config.USAGE_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self._pending = {}
+        self._flushed_at = clock()
+
+    def count(self, tenant_id, checked_at, failed):
+        """checked_at: 'YYYY-MM-DD HH:MM:SS'"""
+        key = (tenant_id, checked_at[:13] + ':00:00')
+        with self.lock:
+            counts = self._pending.get(key)
+            if counts is None:
+                counts = self._pending[key] = [0, 0]
+            counts[0] += 1
+            counts[1] += int(failed)
+
+    def due(self):
+        return bool(self._pending) and self.clock() - self._flushed_at >= self.flush_interval
+
+    def take(self):
+        """Pending (tenant_id, hour, checks, failed_checks) rows; resets the counters"""
+        with self.lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = self.clock()
+        return [key + tuple(counts) for key, counts in pending.items()]
+
+    def restore(self, rows):
+        """Put back rows from take() that couldn't be written"""
+        with self.lock:
+            for tenant_id, hour, checks, failed in rows:
+                counts = self._pending.setdefault((tenant_id, hour), [0, 0])
+                counts[0] += checks
+                counts[1] += failed
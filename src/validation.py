@@ -0,0 +1,170 @@
+"""
+Validation of monitor definitions coming in over the API
+validate_monitors checks a whole batch and reports every problem at once,
+keyed by position, so a 5,000-row import can be fixed in one round trip.
+"""
+
+import ipaddress
+import json
+import re
+from urllib.parse import urlsplit
+
+try:
+    from . import assertions
+    from .scheduler import MIN_INTERVAL
+except ImportError:  # running from inside src/
+    import assertions
+    from scheduler import MIN_INTERVAL
+
+METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+MAX_TIMEOUT = 120
+MAX_INTERVAL = 86400
+MAX_NAME_LENGTH = 200
+MAX_URL_LENGTH = 2048
+MAX_DNS_TTL = 86400
+
+EMAIL_RE = re.compile(r'^[^@\s,]+@[^@\s,]+\.[^@\s,]+$')
+
+# Column -> default for new monitors; also the set of writable columns
+FIELDS = {
+    'name': None,
+    'url': None,
+    'method': 'GET',
+    'expected_status': 200,
+    'timeout': 30,
+    'check_interval': 300,
+    'email_alerts': None,
+    'keep_alive': False,
+    # 0: resolve the host on every check, so DNS time is always measured
+    'dns_ttl': 0,
+    'headers': None,
+    'assertions': None,
+    'steps': None,
+    # Set at creation only; the tenant's tier limits the monitor (see tenants.py)
+    'tenant_id': None,
+}
+REQUIRED = ('name', 'url')
+# Stored as JSON text (see assertions.py)
+JSON_FIELDS = ('headers', 'assertions', 'steps')
+
+
+def private_host(hostname):
+    """True for localhost names and literal loopback, private, link-local
+    and other non-global addresses, which API users mustn't point checks at"""
+    hostname = hostname.rstrip('.').lower()
+    if hostname == 'localhost' or hostname.endswith('.localhost'):
+        return True
+    try:
+        address = ipaddress.ip_address(hostname)
+    except ValueError:
+        return False
+    if getattr(address, 'ipv4_mapped', None):
+        address = address.ipv4_mapped
+    return not address.is_global or address.is_multicast
+
+
+class ValidationError(ValueError):
+    def __init__(self, errors):
+        """errors: list of {'index', 'field', 'message'} dicts"""
+        self.errors = errors
+        super().__init__(f"{len(errors)} invalid field(s): " + '; '.join(
+            f"[{e['index']}] {e['field']}: {e['message']}" for e in errors[:5]))
+
+
+def _integer(value, low, high):
+    if isinstance(value, bool) or not isinstance(value, int):
+        return "must be an integer"
+    if not low <= value <= high:
+        return f"must be between {low} and {high}"
+
+
+def _check(field, value, public_only=False):
+    """Error message for one field, or None if it's valid"""
+    if field == 'name':
+        if not isinstance(value, str) or not value.strip():
+            return "is required"
+        if len(value) > MAX_NAME_LENGTH:
+            return f"must be at most {MAX_NAME_LENGTH} characters"
+    elif field == 'url':
+        if not isinstance(value, str) or len(value) > MAX_URL_LENGTH:
+            return "must be an http(s) URL"
+        parts = urlsplit(value)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            return "must be an http(s) URL"
+        if public_only and private_host(parts.hostname):
+            return "must not point at a private or local address"
+    elif field == 'method':
+        if value not in METHODS:
+            return f"must be one of {', '.join(METHODS)}"
+    elif field == 'expected_status':
+        return _integer(value, 100, 599)
+    elif field == 'timeout':
+        return _integer(value, 1, MAX_TIMEOUT)
+    elif field == 'check_interval':
+        return _integer(value, MIN_INTERVAL, MAX_INTERVAL)
+    elif field == 'dns_ttl':
+        return _integer(value, 0, MAX_DNS_TTL)
+    elif field == 'email_alerts':
+        if value is None:
+            return None
+        if not isinstance(value, str):
+            return "must be a comma-separated list of email addresses"
+        addresses = [a.strip() for a in value.split(',') if a.strip()]
+        if not all(EMAIL_RE.match(a) for a in addresses):
+            return "must be a comma-separated list of email addresses"
+    elif field == 'keep_alive':
+        if not isinstance(value, bool):
+            return "must be true or false"
+    elif field == 'tenant_id':
+        if value is not None:
+            return _integer(value, 1, 2 ** 63 - 1)
+    elif field in JSON_FIELDS:
+        return assertions.problem(field, value)
+    return None
+
+
+def validate_monitors(specs, partial=False, public_only=False):
+    """Normalized copies of `specs`. New monitors (partial=False) get
+    defaults for missing fields; updates (partial=True) need an 'id' and
+    keep only the fields given. public_only refuses URLs on private and
+    local addresses. Raises ValidationError listing every problem in the
+    batch."""
+    errors = []
+    cleaned = []
+    for index, spec in enumerate(specs):
+        if not isinstance(spec, dict):
+            errors.append({'index': index, 'field': None, 'message': "must be an object"})
+            continue
+        item = {}
+        if partial:
+            monitor_id = spec.get('id')
+            if isinstance(monitor_id, bool) or not isinstance(monitor_id, int):
+                errors.append({'index': index, 'field': 'id', 'message': "is required"})
+            item['id'] = monitor_id
+        for field in spec:
+            if field != 'id' and field not in FIELDS:
+                errors.append({'index': index, 'field': field, 'message': "is not a monitor field"})
+        for field, default in FIELDS.items():
+            if field in spec:
+                value = spec[field]
+                if field == 'method' and isinstance(value, str):
+                    value = value.upper()
+            elif partial:
+                continue
+            elif field in REQUIRED:
+                errors.append({'index': index, 'field': field, 'message': "is required"})
+                continue
+            else:
+                value = default
+            message = "can't be changed" if partial and field == 'tenant_id' else _check(field, value, public_only)
+            if message:
+                errors.append({'index': index, 'field': field, 'message': message})
+            if field in JSON_FIELDS and value is not None:
+                value = json.dumps(value, separators=(',', ':'))
+            item[field] = value
+        if partial and len(item) == 1:
+            errors.append({'index': index, 'field': None, 'message': "has nothing to update"})
+        cleaned.append(item)
+    if errors:
+        raise ValidationError(errors)
+    return cleaned
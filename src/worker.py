@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Dedicated monitoring worker
+Splits active monitors across N shard processes by consistent hashing of
+monitors.id. Each shard runs its own CheckEngine and scheduler over the
+monitors it owns and sends results back over a queue; the parent process
+owns the single CheckWriter, so there is still exactly one writer per
+database. The web process runs no checks at all.
+
+Scaling: `--shards N` at start, or at runtime SIGUSR1 adds a shard and
+SIGUSR2 removes one. Shards pick up the new membership on their next
+schedule refresh and only the monitors whose ring owner changed move.
+
+Metrics for the whole worker, shards included, are served on
+--metrics-port; SIGPROF toggles the sampling profiler (see profiler.py).
+
+Several workers (dynos, containers) can share one database: each node
+leases its share of the monitors (see leases.py) and its shards only
+schedule monitors leased to it, so each monitor is checked by one node.
+"""
+
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+
+try:
+    from . import metrics, profiler
+    from .alerts import AlertDelivery
+    from .config import Config
+    from .engine import CheckEngine
+    from .leases import LeaseManager, owned_schedule
+    from .monitor import APIMonitor
+    from .retention import RetentionJob
+    from .scheduler import Scheduler
+    from .sharding import HashRing
+except ImportError:  # running from inside src/
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import metrics
+    import profiler
+    from alerts import AlertDelivery
+    from config import Config
+    from engine import CheckEngine
+    from leases import LeaseManager, owned_schedule
+    from monitor import APIMonitor
+    from retention import RetentionJob
+    from scheduler import Scheduler
+    from sharding import HashRing
+
+# Spawned, not forked: the parent has a writer thread and open SQLite
+# connections that must not be copied into children
+_mp = multiprocessing.get_context('spawn')
+
+# Marks a shard's metrics snapshot on the results queue
+METRICS = 'metrics'
+# Seconds between metrics snapshots from each shard
+METRICS_INTERVAL = 5
+# Seconds after a deactivation during which results still arriving for
+# the monitor (checks in flight, queued writes) are written but not observed
+GONE_FOR = 300
+
+
+def shard_names(count):
+    return [f'shard-{i}' for i in range(count)]
+
+
+class ResultQueue:
+    """Stands in for the CheckWriter inside a shard and forwards results
+    to the parent. Rows become plain dicts so they can be pickled. The
+    shard's metrics ride along every METRICS_INTERVAL seconds."""
+
+    def __init__(self, results, name=None):
+        self._results = results
+        self.name = name
+        self._next_metrics = 0
+
+    def submit(self, item):
+        monitor, result, checked_at = item
+        self._results.put((dict(monitor), result, checked_at))
+        now = time.monotonic()
+        if self.name is not None and now >= self._next_metrics:
+            self._next_metrics = now + METRICS_INTERVAL
+            self._results.put((METRICS, self.name, metrics.REGISTRY.snapshot()))
+
+    def qsize(self):
+        try:
+            return self._results.qsize()
+        except NotImplementedError:  # macOS
+            return 0
+
+    def flush(self, timeout=None):
+        return True
+
+
+class ShardMonitor(APIMonitor):
+    """The APIMonitor a shard's engine sees: it schedules only the monitors
+    the ring assigns to this shard (out of those leased to `owner`, if
+    given) and never writes to the database"""
+
+    def __init__(self, db_path, name, nodes, results, control, owner=None, margin=0):
+        self.name = name
+        self.ring = HashRing(nodes)
+        self.owner = owner
+        self.margin = margin
+        self._control = control
+        self._parent = os.getppid()
+        super().__init__(db_path)
+        self._writer = ResultQueue(results, name)
+
+    def init_database(self):
+        # The parent sets the schema up before any shard starts
+        pass
+
+    def get_schedule(self):
+        if os.getppid() != self._parent:
+            # Orphaned by a crashed parent; nobody would write our results
+            print(f"{self.name}: parent exited, stopping")
+            os._exit(1)
+        self._apply_membership()
+        if self.owner is None:
+            schedule = super().get_schedule()
+        else:
+            with self.db.connect() as conn:
+                schedule = owned_schedule(conn, self.owner, self.margin)
+        return {monitor_id: interval for monitor_id, interval in schedule.items()
+                if self.ring.node_for(monitor_id) == self.name}
+
+    def get_changes(self, since):
+        version, changes = super().get_changes(since)
+        changes = {monitor_id: interval for monitor_id, interval in changes.items()
+                   if self.ring.node_for(monitor_id) == self.name}
+        if changes and self.owner is not None:
+            # New or edited monitors only count once leased to this node
+            with self.db.connect() as conn:
+                owned = owned_schedule(conn, self.owner, self.margin)
+            changes = {monitor_id: interval for monitor_id, interval in changes.items()
+                       if interval is None or monitor_id in owned}
+        return version, changes
+
+    def _apply_membership(self):
+        nodes = None
+        while True:
+            try:
+                nodes = self._control.get_nowait()
+            except queue.Empty:
+                break
+        if nodes is not None and nodes != self.ring.nodes:
+            self.ring = HashRing(nodes)
+
+
+class ParentMonitor(APIMonitor):
+    """The APIMonitor in the worker's parent process. It observes every
+    shard's results but holds no registry, so it follows the change log
+    itself to drop the series and tracker state of deactivated monitors."""
+
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self._version = self.change_version()
+        self._gone = {}  # monitor_id -> time.monotonic() of its deactivation
+
+    def follow_changes(self):
+        """Apply deactivations logged since the last call; returns the changes"""
+        self._version, changes = self.get_changes(self._version)
+        now = time.monotonic()
+        for monitor_id, interval in changes.items():
+            if interval is None:
+                self._gone[monitor_id] = now
+                self.forget_monitor(monitor_id)
+            else:
+                self._gone.pop(monitor_id, None)
+        for monitor_id in [m for m, since in self._gone.items() if now - since > GONE_FOR]:
+            del self._gone[monitor_id]
+        return changes
+
+    def _held(self, monitor_id):
+        return monitor_id not in self._gone
+
+
+def run_shard(db_path, name, nodes, results, control, refresh_interval, owner=None, margin=0):
+    # Ctrl-C goes to the whole process group; let the parent shut us down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    profiler.install(name)
+    monitor = ShardMonitor(db_path, name, nodes, results, control, owner, margin)
+    print(f"{name}: started (pid {os.getpid()})")
+    CheckEngine(monitor).run_forever(Scheduler(), refresh_interval=refresh_interval)
+
+
+class Worker:
+    def __init__(self, db_path, refresh_interval=60, lease_ttl=None, owner=None):
+        self.db_path = db_path
+        self.monitor = ParentMonitor(db_path)
+        if self.monitor.db is None:
+            # Leases, retention and alert delivery are SQLite-only for now
+            raise ValueError("The worker needs a SQLite database")
+        lease_ttl = lease_ttl or Config.LEASE_TTL
+        # Shards must notice a lost lease before anyone else can claim it
+        self.refresh_interval = min(refresh_interval, lease_ttl / 3)
+        self.leases = LeaseManager(self.monitor.db, owner, ttl=lease_ttl, margin=self.refresh_interval)
+        self.results = _mp.Queue()
+        self.shards = {}  # name -> (process, control queue)
+        self.nodes = []
+        self._drainer = threading.Thread(target=self._drain, name='shard-results', daemon=True)
+        self._drainer.start()
+
+    def scale(self, count):
+        """Run exactly `count` shards, telling the survivors about the change"""
+        wanted = self.nodes = shard_names(max(1, count))
+        for name in set(self.shards) - set(wanted):
+            self._stop_shard(name)
+        for name in wanted:
+            if name not in self.shards:
+                self._start_shard(name, wanted)
+        for _, control in self.shards.values():
+            control.put(wanted)
+        print(f"Worker: running {len(wanted)} shards")
+
+    def _start_shard(self, name, nodes):
+        control = _mp.Queue()
+        process = _mp.Process(target=run_shard, name=name, daemon=True,
+                              args=(self.db_path, name, nodes, self.results, control,
+                                    self.refresh_interval, self.leases.owner, self.leases.margin))
+        process.start()
+        self.shards[name] = (process, control)
+
+    def _stop_shard(self, name):
+        process, _ = self.shards.pop(name)
+        process.terminate()
+        process.join(5)
+        metrics.REGISTRY.forget(name)
+
+    def _drain(self):
+        while True:
+            item = self.results.get()
+            if item is None:
+                return
+            if item[0] == METRICS:
+                metrics.REGISTRY.merge(item[1], item[2])
+                continue
+            self.monitor.writer.submit(item)
+
+    def supervise(self):
+        """Restart shards that died and catch up on deactivations; one pass"""
+        for name, (process, _) in list(self.shards.items()):
+            if not process.is_alive():
+                print(f"Worker: {name} exited with {process.exitcode}, restarting")
+                self._start_shard(name, self.nodes)
+        try:
+            self.monitor.follow_changes()
+        except Exception as e:
+            print(f"Worker: change log error: {e}")
+
+    def start(self, shards):
+        self.leases.run_once()
+        self.leases.start()
+        self.scale(shards)
+
+    def stop(self):
+        self.leases.stop()
+        for name in list(self.shards):
+            self._stop_shard(name)
+        self.results.put(None)
+        self._drainer.join(5)
+        self.monitor.writer.close()
+        self.monitor.flush_usage()
+        self.leases.release_all()
+
+
+def seed_demo_monitors(monitor):
+    with monitor.db.connect() as conn:
+        count = conn.execute('SELECT COUNT(*) FROM monitors').fetchone()[0]
+
+    if count == 0:
+        print("Adding initial monitors...")
+        monitor.add_monitor("GitHub API", "https://api.github.com", check_interval=300)
+        monitor.add_monitor("JSONPlaceholder", "https://jsonplaceholder.typicode.com/posts/1", check_interval=300)
+        monitor.add_monitor("httpbin.org", "https://httpbin.org/status/200", check_interval=300)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run the monitoring worker')
+    parser.add_argument('--db', default=os.environ.get('DATABASE_PATH', '/tmp/api_monitor.db'))
+    parser.add_argument('--shards', type=int, default=Config.WORKER_SHARDS)
+    parser.add_argument('--lease-ttl', type=float, default=Config.LEASE_TTL)
+    parser.add_argument('--metrics-port', type=int, default=Config.METRICS_PORT,
+                        help='serve /metrics on this port (0 to turn off)')
+    args = parser.parse_args()
+
+    worker = Worker(args.db, lease_ttl=args.lease_ttl)
+    if args.metrics_port:
+        try:
+            metrics.serve(args.metrics_port)
+        except OSError as e:
+            # e.g. a second worker on the same host; checks matter more
+            print(f"Metrics: not serving on port {args.metrics_port}: {e}")
+    seed_demo_monitors(worker.monitor)
+    RetentionJob(worker.monitor.db).start()
+    AlertDelivery(worker.monitor.db).start()
+
+    worker.start(args.shards)
+    pending = []
+    stopping = threading.Event()
+
+    def resize(delta):
+        return lambda signum, frame: pending.append(max(1, len(worker.shards) + delta))
+
+    signal.signal(signal.SIGUSR1, resize(+1))
+    signal.signal(signal.SIGUSR2, resize(-1))
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+
+    def profile_shards():
+        for process, _ in list(worker.shards.values()):
+            os.kill(process.pid, signal.SIGPROF)
+
+    profiler.install('worker', also=profile_shards)
+
+    try:
+        while not stopping.is_set():
+            if pending:
+                worker.scale(pending.pop())
+                pending.clear()
+            worker.supervise()
+            stopping.wait(5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.stop()
+
+
+if __name__ == '__main__':
+    main()
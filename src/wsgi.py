@@ -7,7 +7,9 @@ import sys
 # Add the src directory to Python path
 sys.path.insert(0, os.path.dirname(__file__))
 
-from app import app
+from app import create_app
+
+app = create_app()
 
 if __name__ == "__main__":
     app.run()
@@ -0,0 +1,25 @@
+import pytest
+import sqlite3
+from contextlib import contextmanager
+
+
+@pytest.fixture
+def flaky_commit(monkeypatch):
+    """flaky_commit(monitor) makes the first transaction on the monitor's
+    storage fail at commit, after everything in it has run, as a locked
+    database would; returns the list that gets one entry per attempt"""
+    def install(monitor):
+        connect = monitor.storage.connect
+        attempts = []
+
+        @contextmanager
+        def flaky():
+            with connect() as conn:
+                yield conn
+                attempts.append(1)
+                if len(attempts) == 1:
+                    raise sqlite3.OperationalError('database is locked')
+
+        monkeypatch.setattr(monitor.storage, 'connect', flaky)
+        return attempts
+    return install
@@ -0,0 +1,122 @@
+import pytest
+import sys
+import os
+import asyncio
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.adaptive import AdaptivePolicy, CIRCUIT_OPEN, CONNECTION_ERROR, TIMED_OUT
+from src.engine import CheckEngine
+from src.monitor import APIMonitor
+from src.scheduler import Scheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def result(error=None):
+    return {'status_code': None if error else 200, 'response_time': 0.1, 'error': error,
+            'connection_reused': False}
+
+
+def policy(clock):
+    return AdaptivePolicy(confirm=2, min_recheck=10, min_timeout=2, circuit_failures=3,
+                          cooldown=30, clock=clock)
+
+
+def test_timeouts_back_off_then_circuit_opens():
+    clock = FakeClock()
+    adaptive = policy(clock)
+    host = 'http://dead:80'
+    assert adaptive.admit(host, 30) == 30
+    adaptive.record_host(host, result(TIMED_OUT))
+    assert adaptive.admit(host, 30) == 15
+    adaptive.record_host(host, result(CONNECTION_ERROR))
+    assert adaptive.admit(host, 30) == 7.5
+    adaptive.record_host(host, result(TIMED_OUT))
+    assert adaptive.is_open(host)
+    assert adaptive.admit(host, 30) is None
+
+    # One probe with the full timeout after the cooldown; a failure doubles it
+    clock.now += 30
+    assert adaptive.admit(host, 30) == 30
+    assert adaptive.admit(host, 30) is None
+    adaptive.record_host(host, result(TIMED_OUT))
+    clock.now += 59
+    assert adaptive.admit(host, 30) is None
+    clock.now += 1
+    assert adaptive.admit(host, 30) == 30
+    adaptive.record_host(host, result("Expected status 200, got 503"))
+    assert not adaptive.is_open(host)
+    assert adaptive.admit(host, 30) == 30
+
+
+def test_rechecks_until_confirmed():
+    adaptive = policy(FakeClock())
+    monitor = {'id': 1, 'check_interval': 300}
+    assert adaptive.recheck_in(monitor, result()) is None
+    assert adaptive.recheck_in(monitor, result("boom")) == 60
+    assert adaptive.recheck_in(monitor, result("boom")) is None  # confirmed down
+    assert adaptive.recheck_in(monitor, result("boom")) is None
+    assert adaptive.recheck_in(monitor, result()) == 60
+    assert adaptive.recheck_in(monitor, result()) is None  # confirmed up
+
+    # Never sooner than the floor, and never slower than the interval
+    assert adaptive.recheck_in({'id': 2, 'check_interval': 30}, result("boom")) == 10
+    assert adaptive.recheck_in({'id': 3, 'check_interval': 10}, result("boom")) is None
+
+
+def test_engine_short_circuits_dead_host(tmp_path):
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    ids = [monitor.add_monitor(f"Dead {i}", f"http://127.0.0.1:9/{i}") for i in range(4)]
+    engine = CheckEngine(monitor, policy=policy(FakeClock()))
+
+    first = [r['error'] for _, r in engine.run(ids)]
+    assert first == [CONNECTION_ERROR] * 4
+    second = [r['error'] for _, r in engine.run(ids)]
+    assert second == [CIRCUIT_OPEN] * 4
+
+    with monitor.db.connect() as conn:
+        errors = [row[0] for row in conn.execute('SELECT error_message FROM checks ORDER BY id')]
+    assert errors.count(CIRCUIT_OPEN) == 4
+
+    # Checks that were never sent have no response time, and stay out of
+    # the latency stats (but not out of uptime)
+    with monitor.db.connect() as conn:
+        [timed] = [row[0] for row in conn.execute('SELECT response_time FROM checks WHERE monitor_id = ?',
+                                                  (ids[0],)) if row[0] is not None]
+        rollup = conn.execute('''
+            SELECT total_checks, response_time_sum, response_time_min FROM check_rollups_hour
+            WHERE monitor_id = ?
+        ''', (ids[0],)).fetchone()
+    assert tuple(rollup) == (2, timed, timed)
+    stats = monitor.get_monitor_stats(ids[0])
+    assert stats['total_checks'] == 2
+    assert stats['avg_response_time'] == stats['min_response_time'] == timed
+
+
+def test_scheduled_engine_forgets_dropped_monitors(tmp_path):
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    ids = [monitor.add_monitor(f"Dead {i}", f"http://127.0.0.1:9/{i}", check_interval=1) for i in range(2)]
+    adaptive = policy(FakeClock())
+    engine = CheckEngine(monitor, policy=adaptive)
+
+    async def run():
+        task = asyncio.ensure_future(engine.run_scheduled(Scheduler(), refresh_interval=3600, tick=0.05))
+        try:
+            while set(adaptive._monitors) != set(ids):
+                await asyncio.sleep(0.05)
+            monitor.deactivate_monitors([ids[0]])
+            while ids[0] in adaptive._monitors:
+                await asyncio.sleep(0.05)
+            # and isn't brought back by a check that was in flight
+            await asyncio.sleep(1.5)
+            assert set(adaptive._monitors) == {ids[1]}
+        finally:
+            task.cancel()
+
+    asyncio.run(asyncio.wait_for(run(), 15))
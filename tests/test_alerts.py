@@ -0,0 +1,190 @@
+import pytest
+import sys
+import os
+import socketserver
+import threading
+import time
+from email import message_from_string
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.monitor import APIMonitor
+from src.alerts import AlertTracker, AlertDelivery, SMTPSender, UP, DOWN, FLAPPING
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept mail from smtplib"""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        sink = self.server
+        self.reply('220 sink ready')
+        mail_from, rcpt = None, []
+        while True:
+            line = self.rfile.readline().decode().rstrip('\r\n')
+            if not line:
+                return
+            command = line.split(' ', 1)[0].upper()
+            if command in ('EHLO', 'HELO'):
+                self.reply('250 sink')
+            elif command == 'MAIL':
+                mail_from, rcpt = line, []
+                self.reply('250 OK')
+            elif command == 'RCPT':
+                rcpt.append(line.split(':', 1)[1].strip('<> '))
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while True:
+                    chunk = self.rfile.readline().decode()
+                    if chunk in ('.\r\n', '.\n'):
+                        break
+                    data.append(chunk)
+                if sink.failures > 0:
+                    sink.failures -= 1
+                    self.reply('451 Try again later')
+                else:
+                    sink.messages.append((rcpt, message_from_string(''.join(data))))
+                    self.reply('250 Queued')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+@pytest.fixture
+def smtp_sink():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SMTPSinkHandler)
+    server.daemon_threads = True
+    server.messages = []
+    server.failures = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_alerts_only_on_confirmed_transitions():
+    tracker = AlertTracker(failures=2, window=3)
+    results = [True, False, True, False, False, False, False, True, True, True]
+    transitions = [tracker.observe(1, ok) for ok in results]
+    assert [t for t in transitions if t] == [(UP, DOWN), (DOWN, UP)]
+    # Confirmed on the second failure in a row of three, and back up on the second success
+    assert transitions.index((UP, DOWN)) == 3
+    assert transitions.index((DOWN, UP)) == 8
+
+
+def test_flapping_suppresses_up_down_alerts():
+    tracker = AlertTracker(failures=2, window=3)
+    transitions = [tracker.observe(1, i % 2 == 0) for i in range(40)]
+    flapping = [i for i, t in enumerate(transitions) if t and t[1] == FLAPPING]
+    assert flapping == [9]
+    assert not any(transitions[10:])
+    assert tracker.state(1) == FLAPPING
+    # Once stable again, one alert says where it settled
+    settled = [t for t in (tracker.observe(1, True) for _ in range(20)) if t]
+    assert settled == [(FLAPPING, UP)]
+
+
+def test_state_survives_restart(tmp_path):
+    path = str(tmp_path / 'test.db')
+    monitor = APIMonitor(path)
+    monitor_id = monitor.add_monitor("Test API", "https://example.com", email_alerts="ops@example.com")
+    down = {'status_code': 500, 'response_time': 0.1, 'error': 'Expected status 200, got 500',
+            'connection_reused': False}
+    for _ in range(2):
+        monitor.record_checks([(monitor.get_monitors([monitor_id])[0], down)])
+
+    restarted = APIMonitor(path)
+    restarted.record_checks([(restarted.get_monitors([monitor_id])[0], down)])
+    with restarted.db.connect() as conn:
+        assert conn.execute('SELECT alert_state FROM monitors').fetchone()[0] == DOWN
+        assert conn.execute('SELECT COUNT(*) FROM alerts').fetchone()[0] == 1
+
+
+def test_retried_batch_keeps_its_alert(tmp_path, flaky_commit):
+    """A batch retried after a transient error is observed only once, so the
+    transition it confirms still gets its alert"""
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    monitor_id = monitor.add_monitor("Test API", "https://example.com", email_alerts="ops@example.com")
+    down = {'status_code': 500, 'response_time': 0.1, 'error': 'Expected status 200, got 500',
+            'connection_reused': False}
+    monitor.record_checks([(monitor.get_monitors([monitor_id])[0], down)])
+
+    attempts = flaky_commit(monitor)
+    monitor.record_checks([(monitor.get_monitors([monitor_id])[0], down)])
+    assert len(attempts) == 2
+    with monitor.db.connect() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM checks').fetchone()[0] == 2
+        assert conn.execute('SELECT alert_state FROM monitors').fetchone()[0] == DOWN
+        assert [tuple(row) for row in conn.execute('SELECT event FROM alerts')] == [(DOWN,)]
+
+
+def queue_alerts(monitor, count, recipient="ops@example.com"):
+    with monitor.db.connect() as conn:
+        for i in range(count):
+            monitor._insert_alert(conn, i + 1, f"API {i}", f"https://example.com/{i}",
+                                  "Connection error", recipient, batch_delay=0)
+
+
+def test_delivery_batches_per_recipient(tmp_path, smtp_sink):
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    queue_alerts(monitor, 3, "ops@example.com, dev@example.com")
+    send = SMTPSender('127.0.0.1', smtp_sink.server_address[1], starttls=False, username='')
+    delivery = AlertDelivery(monitor.db, send=send)
+
+    assert delivery.deliver_once() == 2
+    assert sorted(rcpt[0] for rcpt, _ in smtp_sink.messages) == ['dev@example.com', 'ops@example.com']
+    message = smtp_sink.messages[0][1]
+    assert message['Subject'] == '3 monitor alerts (3 down)'
+    assert message.get_payload().count('is DOWN') == 3
+    with monitor.db.connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM alerts WHERE delivery_status = 'sent'").fetchone()[0] == 6
+    assert delivery.deliver_once() == 0
+
+
+def test_delivery_retries_with_backoff(tmp_path, smtp_sink):
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    queue_alerts(monitor, 1)
+    smtp_sink.failures = 1
+    clock = FakeClock()
+    send = SMTPSender('127.0.0.1', smtp_sink.server_address[1], starttls=False, username='')
+    delivery = AlertDelivery(monitor.db, send=send, clock=clock)
+    clock.now = time.time() + 1
+
+    assert delivery.deliver_once() == 0
+    assert delivery.deliver_once() == 0  # backing off
+    clock.now += 30
+    assert delivery.deliver_once() == 1
+    assert len(smtp_sink.messages) == 1
+    with monitor.db.connect() as conn:
+        assert tuple(conn.execute('SELECT attempts, delivery_status FROM alerts').fetchone()) == (1, 'sent')
+
+
+def test_delivery_rate_limit_folds_alerts_together(tmp_path):
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    clock = FakeClock()
+    clock.now = time.time() + 1
+    sent = []
+    delivery = AlertDelivery(monitor.db, send=lambda *email: sent.append(email), rate=1, per=60, clock=clock)
+
+    queue_alerts(monitor, 1)
+    assert delivery.deliver_once() == 1
+    queue_alerts(monitor, 2)
+    assert delivery.deliver_once() == 0  # over the limit: held back
+    queue_alerts(monitor, 1)
+    clock.now += 60
+    assert delivery.deliver_once() == 1
+    assert [subject for _, subject, _ in sent] == [
+        "Monitor 'API 0' is DOWN: Connection error", '3 monitor alerts (3 down)']
@@ -0,0 +1,86 @@
+import pytest
+import sys
+import os
+import random
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.anomaly import LatencyBaseline, WARMUP, CONFIRM
+from src.alerts import DEGRADED, RECOVERED
+from src.monitor import APIMonitor
+
+
+def noisy(rng, median, count, spread=0.2):
+    """Log-normal latencies around `median` seconds"""
+    return [median * rng.lognormvariate(0, spread) for _ in range(count)]
+
+
+def run(trace):
+    baseline = LatencyBaseline()
+    return [(i, event) for i, latency in enumerate(trace)
+            if (event := baseline.observe(latency)) is not None]
+
+
+def test_steady_traffic_never_alerts():
+    rng = random.Random(1)
+    for median, spread in ((0.08, 0.2), (0.005, 0.5), (1.5, 0.3)):
+        assert run(noisy(rng, median, 20000, spread)) == []
+
+
+def test_isolated_spikes_are_ignored():
+    rng = random.Random(2)
+    trace = noisy(rng, 0.08, 2000)
+    for i in range(100, 2000, 50):
+        trace[i] = 2.0
+        trace[i + 1] = 2.0
+    assert run(trace) == []
+
+
+def test_step_regression_is_caught_and_cleared():
+    rng = random.Random(3)
+    trace = noisy(rng, 0.08, 200) + noisy(rng, 2.0, 50) + noisy(rng, 0.08, 50)
+    assert run(trace) == [(200 + CONFIRM - 1, DEGRADED), (250 + CONFIRM - 1, RECOVERED)]
+
+
+def test_gradual_drift_is_not_an_anomaly():
+    rng = random.Random(4)
+    # Twice as slow over 2,000 checks
+    trace = [latency * (1 + i / 2000) for i, latency in enumerate(noisy(rng, 0.08, 2000))]
+    assert run(trace) == []
+
+
+def test_permanent_shift_becomes_the_new_normal():
+    rng = random.Random(5)
+    events = run(noisy(rng, 0.08, 200) + noisy(rng, 0.4, 5000))
+    assert [event for _, event in events] == [DEGRADED, RECOVERED]
+    assert events[0][0] == 200 + CONFIRM - 1
+
+
+def test_nothing_before_warmup():
+    assert run([0.05] * (WARMUP - 1) + [5.0] * WARMUP)[0][0] >= WARMUP
+
+
+def test_degraded_alert_is_queued(tmp_path):
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    monitor_id = monitor.add_monitor("Slow", "https://example.com", email_alerts="ops@example.com")
+    [row] = monitor.get_monitors([monitor_id])
+    rng = random.Random(6)
+    ok = {'status_code': 200, 'error': None, 'connection_reused': False}
+    monitor.record_checks([(row, dict(ok, response_time=latency))
+                           for latency in noisy(rng, 0.08, 50) + [2.0] * CONFIRM])
+
+    with monitor.db.connect() as conn:
+        alerts = conn.execute('SELECT event, message FROM alerts').fetchall()
+    assert len(alerts) == 1
+    assert alerts[0]['event'] == DEGRADED
+    assert "is DEGRADED: response time 2000ms, usually 8" in alerts[0]['message']
+
+
+def test_retried_batch_feeds_the_baseline_once(tmp_path, flaky_commit):
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    monitor_id = monitor.add_monitor("Flaky disk", "https://example.com")
+    [row] = monitor.get_monitors([monitor_id])
+    attempts = flaky_commit(monitor)
+    ok = {'status_code': 200, 'error': None, 'connection_reused': False}
+    monitor.record_checks([(row, dict(ok, response_time=0.05)) for _ in range(10)])
+    assert len(attempts) == 2
+    assert monitor.latency.baseline(monitor_id).count == 10
@@ -0,0 +1,57 @@
+import pytest
+import sys
+import os
+import subprocess
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def loaded_modules(statement):
+    code = f"import sys; sys.path.insert(0, 'src'); {statement}; print(' '.join(sys.modules))"
+    return set(subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.split())
+
+
+def test_each_mode_imports_only_what_it_runs():
+    web = loaded_modules("from app import create_app; create_app()")
+    assert not web & {'engine', 'httpclient', 'asyncio', 'smtplib', 'worker', 'multiprocessing'}
+    worker = loaded_modules("import worker")
+    assert not worker & {'flask', 'werkzeug', 'app'}
+
+
+def test_create_app_is_lazy(tmp_path):
+    sys.path.insert(0, os.path.join(ROOT, 'src'))
+    import app as web
+    path = tmp_path / 'test.db'
+    client = web.create_app(str(path)).test_client()
+    assert not path.exists()
+
+    response = client.get('/api/monitors')
+    assert response.status_code == 200
+    assert path.exists()
+    assert response.get_json()['monitors'] == []
+
+
+def test_streams_beyond_the_limit_are_refused(tmp_path, monkeypatch):
+    sys.path.insert(0, os.path.join(ROOT, 'src'))
+    import app as web
+    from config import Config
+    monkeypatch.setattr(Config, 'MAX_STREAMS', 1)
+    application = web.create_app(str(tmp_path / 'test.db'))
+    client = application.test_client()
+
+    # The first stream is still open when the second one arrives
+    stream = client.get('/api/stream', buffered=False)
+    assert stream.status_code == 200
+    assert next(stream.response) == b'retry: 3000\n\n'
+    refused = client.get('/api/stream')
+    assert refused.status_code == 503 and refused.headers['Retry-After'] == '30'
+    stream.close()
+    reopened = client.get('/api/stream', buffered=False)
+    assert reopened.status_code == 200
+    reopened.close()
+
+    # A refused dashboard polls every 30s and tries to stream again later
+    page = client.get('/').get_data(as_text=True)
+    assert 'stream.onerror' in page and 'pollEvery(30000)' in page
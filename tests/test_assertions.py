@@ -0,0 +1,163 @@
+import pytest
+import sys
+import os
+import json
+import threading
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.assertions import BodyReader, Expectations, parse_path
+from src.config import Config
+from src.engine import CheckEngine
+from src.monitor import APIMonitor
+from src.validation import ValidationError
+
+
+class AppHandler(BaseHTTPRequestHandler):
+    """/login hands out a token that /me requires; /big is 8 MiB; /gzip and
+    /deflate are compressed if the client allows it"""
+    protocol_version = 'HTTP/1.1'
+
+    def reply(self, status, body, content_type='application/json', headers=()):
+        body = body.encode() if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except ConnectionError:
+            pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if payload.get('password') != 'secret':
+            return self.reply(401, '{"error": "bad password"}')
+        self.reply(200, json.dumps({'access_token': 'abc123'}), headers=[('X-Request-Id', 'r-1')])
+
+    def do_GET(self):
+        if self.path == '/me':
+            if self.headers.get('Authorization') != 'Bearer abc123':
+                return self.reply(401, '{}')
+            return self.reply(200, json.dumps({'user': {'roles': ['admin']}, 'status': 'ok'}))
+        if self.path in ('/gzip', '/deflate'):
+            body = json.dumps({'status': 'ok', 'padding': 'x' * 100000}).encode()
+            if self.path.lstrip('/') not in self.headers.get('Accept-Encoding', ''):
+                return self.reply(200, body)
+            packer = zlib.compressobj(wbits=31 if self.path == '/gzip' else 15)
+            return self.reply(200, packer.compress(body) + packer.flush(),
+                              headers=[('Content-Encoding', self.path.lstrip('/'))])
+        if self.path == '/big':
+            return self.reply(200, b'version=2.1;' + b'x' * (8 * 1024 * 1024), 'text/plain')
+        self.reply(200, '<html>healthy</html>', 'text/html')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), AppHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+
+
+@pytest.fixture
+def monitor(tmp_path):
+    return APIMonitor(str(tmp_path / 'test.db'))
+
+
+def check(monitor, spec):
+    [monitor_id] = monitor.add_monitors([dict({'name': 'm'}, **spec)])
+    [(_, result)] = CheckEngine(monitor).run([monitor_id])
+    return result
+
+
+def test_json_paths():
+    assert parse_path("$.data[0]['first name'].id") == ('data', 0, 'first name', 'id')
+    assert parse_path('$') == ()
+    with pytest.raises(ValueError):
+        parse_path('$.data[x]')
+
+
+def test_invalid_definitions_are_rejected(monitor):
+    with pytest.raises(ValidationError) as e:
+        monitor.add_monitors([{'name': 'm', 'url': 'https://example.com',
+                               'assertions': [{'type': 'body', 'equals': 'ok'}],
+                               'steps': [{'url': 'https://example.com', 'extract': {'t': {'xpath': '//a'}}}],
+                               'headers': {'X-Bad': 1}}])
+    assert {err['field'] for err in e.value.errors} == {'assertions', 'steps', 'headers'}
+
+
+def test_body_reader_stops_once_settled():
+    reader = BodyReader(Expectations([{'type': 'body', 'contains': 'needle'}]), limit=1024 * 1024)
+    assert reader.feed(b'hay' * 100) is False
+    # Split across chunks
+    assert reader.feed(b'nee') is False
+    assert reader.feed(b'dle and more') is True
+    reader.finish(False)
+    assert len(reader.found) == 1
+
+    # JSON needs the whole body, and never more than the limit is kept
+    reader = BodyReader(Expectations([{'type': 'json', 'path': '$.a'}]), limit=10)
+    assert reader.feed(b'{"a": ') is False
+    assert reader.feed(b'"long value"}') is True
+    assert len(reader.data) == 10
+
+
+def test_assertions(monitor, server):
+    result = check(monitor, {'url': f"{server}/", 'assertions': [
+        {'type': 'header', 'name': 'Content-Type', 'contains': 'html'},
+        {'type': 'body', 'matches': 'heal\\w+'},
+    ]})
+    assert result['error'] is None
+
+    result = check(monitor, {'url': f"{server}/", 'assertions': [{'type': 'body', 'contains': 'down'}]})
+    assert result['error'] == "Assertion failed: body does not contain 'down'"
+    assert result['status_code'] == 200
+
+
+def test_multi_step_check_passes_the_token(monitor, server):
+    login = {'name': 'login', 'method': 'POST', 'url': f"{server}/login",
+             'body': '{"password": "secret"}', 'headers': {'Content-Type': 'application/json'},
+             'extract': {'token': {'json': '$.access_token'}, 'request': {'header': 'X-Request-Id'}}}
+    spec = {'url': f"{server}/me", 'steps': [login],
+            'headers': {'Authorization': 'Bearer {{token}}'},
+            'assertions': [{'type': 'json', 'path': '$.user.roles[0]', 'equals': 'admin'}]}
+    assert check(monitor, spec)['error'] is None
+
+    spec['assertions'] = [{'type': 'json', 'path': '$.status', 'equals': 'down'}]
+    assert check(monitor, spec)['error'] == "Assertion failed: $.status is 'ok', expected it to equal 'down'"
+
+    spec['steps'] = [dict(login, body='{"password": "wrong"}')]
+    result = check(monitor, spec)
+    assert result['error'] == "login: Expected status 200, got 401"
+    assert result['status_code'] == 401
+
+
+def test_large_bodies_are_read_only_as_far_as_needed(monitor, server):
+    # The match is in the first chunk; the other 8 MiB are never read
+    result = check(monitor, {'url': f"{server}/big", 'keep_alive': True,
+                             'assertions': [{'type': 'body', 'matches': 'version=2\\.'}]})
+    assert result['error'] is None
+
+    result = check(monitor, {'url': f"{server}/big", 'assertions': [{'type': 'body', 'contains': 'missing'}]})
+    assert result['error'] == (f"Assertion failed: body does not contain 'missing' "
+                               f"in its first {Config.MAX_BODY_BYTES} bytes")
+
+    result = check(monitor, {'url': f"{server}/big", 'assertions': [{'type': 'json', 'path': '$.a'}]})
+    assert result['error'] == f"Assertion failed: body is not valid JSON in its first {Config.MAX_BODY_BYTES} bytes"
+
+
+def test_compressed_bodies_are_decoded(monitor, server):
+    for path in ('gzip', 'deflate'):
+        result = check(monitor, {'url': f"{server}/{path}", 'assertions': [
+            {'type': 'header', 'name': 'Content-Encoding', 'equals': path},
+            {'type': 'json', 'path': '$.status', 'equals': 'ok'},
+        ]})
+        assert result['error'] is None
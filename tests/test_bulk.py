@@ -0,0 +1,144 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.monitor import APIMonitor
+from src.scheduler import Scheduler
+from src.validation import ValidationError, validate_monitors
+
+
+@pytest.fixture
+def monitor(tmp_path):
+    return APIMonitor(str(tmp_path / 'test.db'))
+
+
+def test_validation_reports_every_problem():
+    with pytest.raises(ValidationError) as e:
+        validate_monitors([
+            {'name': 'ok', 'url': 'https://example.com'},
+            {'name': '', 'url': 'ftp://example.com', 'check_interval': 0},
+            {'url': 'https://example.com', 'method': 'fetch', 'colour': 'red'},
+        ])
+    assert {(err['index'], err['field']) for err in e.value.errors} == {
+        (1, 'name'), (1, 'url'), (1, 'check_interval'),
+        (2, 'name'), (2, 'method'), (2, 'colour'),
+    }
+
+    [spec] = validate_monitors([{'name': 'a', 'url': 'http://a.test', 'method': 'head'}])
+    assert spec['method'] == 'HEAD' and spec['check_interval'] == 300 and spec['keep_alive'] is False
+
+
+def test_api_urls_must_be_public():
+    private = ['http://127.0.0.1:8080/', 'http://localhost/', 'http://api.localhost/',
+               'http://10.1.2.3/', 'http://192.168.0.1/', 'http://169.254.169.254/latest/',
+               'http://[::1]/', 'http://[fe80::1]/', 'http://[::ffff:10.0.0.1]/', 'http://0.0.0.0/']
+    specs = [{'name': 'x', 'url': url} for url in private]
+    with pytest.raises(ValidationError) as e:
+        validate_monitors(specs, public_only=True)
+    assert [err['index'] for err in e.value.errors] == list(range(len(private)))
+    assert validate_monitors(specs)  # only the API refuses them
+    assert validate_monitors([{'name': 'x', 'url': 'https://93.184.216.34/'},
+                              {'name': 'y', 'url': 'https://example.com/'}], public_only=True)
+
+
+def test_bulk_create_is_one_transaction(monitor):
+    ids = monitor.add_monitors([{'name': f'm{i}', 'url': f'https://example.com/{i}'}
+                                for i in range(1000)])
+    assert ids == list(range(1, 1001))
+    assert [m['name'] for m in monitor.get_monitors([1, 1000])] == ['m0', 'm999']
+
+    with pytest.raises(ValidationError):
+        monitor.add_monitors([{'name': 'new', 'url': 'https://example.com'}, {'name': 'bad'}])
+    with monitor.db.connect() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM monitors').fetchone()[0] == 1000
+
+
+def test_update_and_deactivate(monitor):
+    ids = monitor.add_monitors([{'name': f'm{i}', 'url': 'https://example.com'} for i in range(3)])
+    assert monitor.update_monitors([{'id': ids[0], 'check_interval': 60},
+                                    {'id': ids[1], 'name': 'renamed', 'timeout': 5}]) == 2
+    first, second, _ = monitor.get_monitors(ids)
+    assert first['check_interval'] == 60 and first['name'] == 'm0'
+    assert second['name'] == 'renamed' and second['timeout'] == 5
+
+    with pytest.raises(ValidationError) as e:
+        monitor.update_monitors([{'id': ids[0], 'timeout': 10}, {'id': 999, 'timeout': 10}])
+    assert e.value.errors == [{'index': 1, 'field': 'id', 'message': "no such monitor"}]
+    assert monitor.get_monitors([ids[0]])[0]['timeout'] == 30
+
+    assert monitor.deactivate_monitors([ids[0], ids[0], 999]) == 1
+    assert monitor.deactivate_monitors([ids[0]]) == 0
+    assert set(monitor.get_schedule()) == set(ids[1:])
+
+
+def test_change_feed_drives_scheduler(monitor):
+    scheduler = Scheduler()
+    version = monitor.change_version()
+    scheduler.sync(monitor.get_schedule())
+    assert len(scheduler) == 0
+
+    ids = monitor.add_monitors([{'name': f'm{i}', 'url': 'https://example.com'} for i in range(3)])
+    version, changes = monitor.get_changes(version)
+    assert changes == {ids[0]: 300, ids[1]: 300, ids[2]: 300}
+    scheduler.apply(changes)
+    assert len(scheduler) == 3
+
+    monitor.update_monitors([{'id': ids[0], 'check_interval': 30}])
+    monitor.deactivate_monitors([ids[1]])
+    monitor.update_monitors([{'id': ids[1], 'check_interval': 60}])
+    version, changes = monitor.get_changes(version)
+    # A deactivated monitor stays out however it was edited afterwards
+    assert changes == {ids[0]: 30, ids[1]: None}
+    scheduler.apply(changes)
+    assert ids[1] not in scheduler and len(scheduler) == 2
+
+    assert monitor.get_changes(version) == (version, {})
+
+
+def test_bulk_endpoints(tmp_path, monkeypatch):
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+    import app as web
+    # The app imports modules from src/ directly, so its ValidationError is that one
+    monitor = web.APIMonitor(str(tmp_path / 'test.db'))
+    client = web.create_app(monitor=monitor).test_client()
+    tenant_id = monitor.add_tenant('Acme', 'business')
+
+    # Admin-only, and off until a token is configured
+    spec = {'name': 'a', 'url': 'https://a.example.com', 'tenant_id': tenant_id}
+    monkeypatch.setattr(web.Config, 'ADMIN_TOKEN', None)
+    assert client.post('/api/monitors/bulk', json={'monitors': [spec]}).status_code == 403
+    monkeypatch.setattr(web.Config, 'ADMIN_TOKEN', 's3cret')
+    for method, path in (('post', '/api/monitors/bulk'), ('patch', '/api/monitors/bulk'),
+                         ('post', '/api/monitors/bulk/deactivate')):
+        assert getattr(client, method)(path, json={'monitors': [spec], 'ids': [1]}).status_code == 401
+    assert monitor.get_schedule() == {}
+    client.environ_base['HTTP_AUTHORIZATION'] = 'Bearer s3cret'
+
+    response = client.post('/api/monitors/bulk', json={'monitors': [
+        dict(spec, url='http://169.254.169.254/latest/meta-data/')]})
+    assert response.get_json()['errors'] == [
+        {'index': 0, 'field': 'url', 'message': "must not point at a private or local address"}]
+
+    response = client.post('/api/monitors/bulk', json={'monitors': [
+        {'name': 'a', 'url': 'https://a.example.com', 'tenant_id': tenant_id},
+        {'name': 'b', 'url': 'https://b.example.com', 'check_interval': 60, 'tenant_id': tenant_id},
+    ]})
+    assert response.status_code == 201
+    assert response.get_json() == {'ids': [1, 2]}
+
+    response = client.post('/api/monitors/bulk', json={'monitors': [{'name': 'c'}]})
+    assert response.status_code == 400
+    assert response.get_json()['errors'] == [{'index': 0, 'field': 'url', 'message': "is required"}]
+    assert client.post('/api/monitors/bulk', json={'monitors': 'nope'}).status_code == 400
+
+    response = client.patch('/api/monitors/bulk', json={'monitors': [{'id': 2, 'url': 'http://10.0.0.5/'}]})
+    assert response.status_code == 400
+    response = client.patch('/api/monitors/bulk', json={'monitors': [{'id': 2, 'check_interval': 120}]})
+    assert response.get_json() == {'updated': 1}
+    assert monitor.get_schedule() == {1: 300, 2: 120}
+
+    response = client.post('/api/monitors/bulk/deactivate', json={'ids': [1]})
+    assert response.get_json() == {'deactivated': 1}
+    assert client.post('/api/monitors/bulk/deactivate', json={'ids': ['1']}).status_code == 400
+    assert monitor.get_schedule() == {2: 120}
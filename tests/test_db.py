@@ -0,0 +1,50 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.db import Database, CheckWriter
+
+
+def test_file_database_uses_wal(tmp_path):
+    db = Database(str(tmp_path / 'test.db'))
+    with db.connect() as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+        assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+
+
+def test_writer_batches_and_flushes(tmp_path):
+    """Items queued before flush() are committed when it returns"""
+    db = Database(str(tmp_path / 'test.db'))
+    with db.connect() as conn:
+        conn.execute('CREATE TABLE t (n INTEGER)')
+
+    batches = []
+
+    def write_batch(conn, items):
+        batches.append(len(items))
+        conn.executemany('INSERT INTO t (n) VALUES (?)', [(n,) for n in items])
+
+    writer = CheckWriter(db, write_batch, batch_size=100)
+    for n in range(250):
+        writer.submit(n)
+    writer.flush()
+
+    with db.connect() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 250
+    assert sum(batches) == 250
+    assert max(batches) <= 100
+    writer.close()
+
+
+def test_memory_database_is_shared():
+    """':memory:' keeps one database across threads instead of one per connect"""
+    db = Database(':memory:')
+    with db.connect() as conn:
+        conn.execute('CREATE TABLE t (n INTEGER)')
+    writer = CheckWriter(db, lambda conn, items: conn.executemany('INSERT INTO t VALUES (?)', [(n,) for n in items]))
+    writer.submit(1)
+    writer.flush()
+    with db.connect() as conn:
+        assert conn.execute('SELECT n FROM t').fetchall()[0][0] == 1
@@ -0,0 +1,98 @@
+import pytest
+import sys
+import os
+import json
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.events import EventBroker, CheckPublisher, CheckTailer, TooManySubscribers
+from src.monitor import APIMonitor
+
+
+def parse(message):
+    events = []
+    for block in message.strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.split('\n') if ': ' in line)
+        events.append((fields.get('event'), json.loads(fields['data']) if 'data' in fields else None))
+    return events
+
+
+def test_subscribers_share_published_events():
+    broker = EventBroker()
+    first, second = broker.subscribe(keepalive=0.01), broker.subscribe(keepalive=0.01)
+    assert next(first).startswith('retry:') and next(second).startswith('retry:')
+
+    broker.publish('check', {'monitor_id': 1})
+    broker.publish('check', {'monitor_id': 2})
+    assert parse(next(first)) == parse(next(second)) == [('check', {'monitor_id': 1}), ('check', {'monitor_id': 2})]
+    assert next(first) == ": keepalive\n\n"
+
+
+def test_subscriber_limit_counts_streams_not_yet_read():
+    broker = EventBroker()
+    first = broker.subscribe(limit=2)
+    second = broker.subscribe(limit=2)
+    with pytest.raises(TooManySubscribers):
+        broker.subscribe(limit=2)
+    # Closed without ever being read: the slot still comes back, once
+    first.close()
+    first.close()
+    assert broker.subscribers == 1
+    broker.subscribe(limit=2).close()
+    second.close()
+    assert broker.subscribers == 0
+
+
+def test_resume_from_last_event_id_and_reset():
+    broker = EventBroker(history=3)
+    for n in range(3):
+        broker.publish('check', {'n': n})
+    resumed = broker.subscribe(last_id='1', keepalive=0.01)
+    next(resumed)
+    assert [data['n'] for _, data in parse(next(resumed))] == [1, 2]
+
+    lagging = broker.subscribe(last_id='0', keepalive=0.01)
+    next(lagging)
+    for n in range(3, 6):
+        broker.publish('check', {'n': n})
+    assert parse(next(lagging)) == [('reset', {})]
+
+
+def test_committed_checks_are_published(tmp_path):
+    broker = EventBroker()
+    stream = broker.subscribe(keepalive=0.01)
+    next(stream)
+
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    monitor.add_listener(CheckPublisher(broker))
+    monitor_id = monitor.add_monitor("API", "https://api.example.com")
+    [row] = monitor.get_monitors([monitor_id])
+    monitor.record_checks([(row, {'status_code': 500, 'response_time': 0.2,
+                                  'error': 'Expected status 200, got 500', 'connection_reused': False})])
+
+    events = parse(next(stream))
+    assert [event for event, _ in events] == ['check', 'status']
+    assert events[0][1]['monitor_id'] == monitor_id
+    assert events[1][1] == {'monitor_id': monitor_id, 'up': False, 'error': 'Expected status 200, got 500'}
+
+
+def test_tailer_publishes_rows_written_elsewhere(tmp_path):
+    """The web process sees checks committed by the worker process"""
+    path = str(tmp_path / 'test.db')
+    worker_side = APIMonitor(path)
+    monitor_id = worker_side.add_monitor("Test API", "https://example.com")
+    row = worker_side.get_monitors([monitor_id])[0]
+    worker_side.record_checks([(row, {'status_code': 200, 'response_time': 0.1, 'error': None,
+                                      'connection_reused': False})])
+
+    broker = EventBroker()
+    stream = broker.subscribe(keepalive=0.01)
+    next(stream)
+    tailer = CheckTailer(APIMonitor(path), CheckPublisher(broker))
+    assert tailer.poll() == 0  # history isn't replayed
+
+    worker_side.record_checks([(row, {'status_code': None, 'response_time': 0.2, 'error': 'Connection error',
+                                      'connection_reused': False})])
+    assert tailer.poll() == 1
+    events = parse(next(stream))
+    assert [name for name, _ in events] == ['check', 'status']
+    assert events[1][1] == {'monitor_id': monitor_id, 'up': False, 'error': 'Connection error'}
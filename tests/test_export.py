@@ -0,0 +1,105 @@
+import pytest
+import sys
+import os
+import csv
+import io
+import json
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.monitor import APIMonitor
+from src.export import export_checks, iter_pages, ExportError
+
+
+@pytest.fixture
+def monitor(tmp_path):
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    for name in ("A", "B"):
+        monitor_id = monitor.add_monitor(name, "https://example.com")
+        row = monitor.get_monitors([monitor_id])[0]
+        # Several checks per second, so pages split inside a single timestamp
+        monitor.record_checks([(row, {'status_code': 200, 'response_time': i / 100, 'error': None,
+                                      'connection_reused': False,
+                                      'checked_at': f'2024-03-01 10:00:{i // 4:02d}'})
+                               for i in range(50)])
+    return monitor
+
+
+def test_keyset_pages_cover_range_exactly_once(monitor):
+    pages = list(iter_pages(monitor.db, [1, 2], page_size=7))
+    assert max(len(page) for page in pages) == 7
+    rows = [row for page in pages for row in page]
+    assert len(rows) == 100
+    assert len({row[0] for row in rows}) == 100
+    assert [row[1] for row in rows] == [1] * 50 + [2] * 50
+
+    window = [row for page in iter_pages(monitor.db, [1], '2024-03-01 10:00:02', '2024-03-01 10:00:05', 3)
+              for row in page]
+    assert {row[2] for row in window} == {'2024-03-01 10:00:02', '2024-03-01 10:00:03', '2024-03-01 10:00:04'}
+    assert len(window) == 12
+
+    everything = [row for page in iter_pages(monitor.db, page_size=9) for row in page]
+    assert sorted(row[0] for row in everything) == sorted(row[0] for row in rows)
+    assert [(row[2], row[0]) for row in everything] == sorted((row[2], row[0]) for row in rows)
+
+
+def test_csv_and_ndjson(monitor):
+    chunks = list(export_checks(monitor.db, 'csv', [1], page_size=20))
+    assert len(chunks) == 3
+    rows = list(csv.DictReader(io.StringIO(b''.join(chunks).decode())))
+    assert len(rows) == 50
+    assert rows[0]['checked_at'] == '2024-03-01 10:00:00' and rows[0]['status_code'] == '200'
+
+    lines = b''.join(export_checks(monitor.db, 'ndjson', [2])).decode().splitlines()
+    assert len(lines) == 50
+    assert json.loads(lines[-1])['response_time'] == 0.49
+
+    with pytest.raises(ExportError):
+        export_checks(monitor.db, 'xlsx')
+
+
+class Unread:
+    """A database the export mustn't touch yet"""
+
+    def connect(self):
+        raise AssertionError("read before the response started")
+
+
+def test_exports_read_nothing_until_iterated(monkeypatch):
+    for fmt in ('csv', 'ndjson'):
+        export_checks(Unread(), fmt)
+    pytest.importorskip('pyarrow')
+    for fmt in ('arrow', 'parquet'):
+        export_checks(Unread(), fmt)
+
+    # A missing pyarrow is still reported up front
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+    for fmt in ('arrow', 'parquet'):
+        with pytest.raises(ExportError, match='need pyarrow'):
+            export_checks(Unread(), fmt)
+
+
+def test_parquet(monitor):
+    pq = pytest.importorskip('pyarrow.parquet')
+    data = b''.join(export_checks(monitor.db, 'parquet', [1, 2], page_size=30))
+    parquet = pq.ParquetFile(io.BytesIO(data))
+    assert parquet.metadata.num_rows == 100
+    assert parquet.num_row_groups == 1
+    assert parquet.read().column('connection_reused').to_pylist()[0] is False
+
+
+def test_export_endpoint_streams(monitor):
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+    import app as web
+    client = web.create_app(monitor=monitor).test_client()
+
+    response = client.get('/api/checks/export?monitor_id=1&start=2024-03-01T10:00:10')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'text/csv'
+    assert len(response.get_data().decode().splitlines()) == 1 + 10
+
+    # The fixture's checks are older than raw retention, so this range is flagged
+    assert response.headers['X-Export-Truncated-Before'] > '2024-03-01'
+    assert client.get('/api/checks/export?format=xlsx').status_code == 400
+    assert client.get('/api/checks/export?end=2024-03-02').status_code == 400
+    assert client.get('/api/checks/export?start=yesterday').status_code == 400
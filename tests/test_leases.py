@@ -0,0 +1,118 @@
+import pytest
+import sys
+import os
+import signal
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.monitor import APIMonitor
+from src.leases import LeaseManager, owned_schedule
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        return self.now
+
+
+def owned(monitor, manager):
+    with monitor.db.connect() as conn:
+        return set(owned_schedule(conn, manager.owner, 0, now=manager.clock()))
+
+
+def test_nodes_split_monitors_and_fail_over(tmp_path):
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    ids = {monitor.add_monitor(f"API {i}", f"https://example.com/{i}") for i in range(100)}
+    clock = FakeClock()
+    a = LeaseManager(monitor.db, 'a', ttl=30, batch_size=7, clock=clock)
+    b = LeaseManager(monitor.db, 'b', ttl=30, batch_size=7, clock=clock)
+
+    assert a.run_once() == 100
+    # b joins: a hands back its excess, which b may claim after the margin
+    assert b.run_once() == 0
+    assert a.run_once() == 50
+    assert b.run_once() == 0
+    clock.now += a.margin
+    assert b.run_once() == 50
+    assert owned(monitor, a) | owned(monitor, b) == ids
+    assert not owned(monitor, a) & owned(monitor, b)
+
+    # a dies: b takes everything once a's leases run out
+    clock.now += 10
+    b.run_once()
+    assert b.held() == 50
+    clock.now += 21
+    assert b.run_once() == 100
+    assert owned(monitor, b) == ids
+
+
+def test_shards_stop_before_lease_runs_out(tmp_path):
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    monitor.add_monitor("API", "https://example.com")
+    clock = FakeClock()
+    node = LeaseManager(monitor.db, 'a', ttl=30, margin=10, clock=clock)
+    node.run_once()
+    with monitor.db.connect() as conn:
+        assert owned_schedule(conn, 'a', 10, now=clock.now + 19)
+        assert not owned_schedule(conn, 'a', 10, now=clock.now + 21)
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    hits = defaultdict(list)
+
+    def do_GET(self):
+        self.hits[self.path].append(time.monotonic())
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def test_worker_processes_check_each_monitor_once(tmp_path):
+    """Three worker nodes on one database file; one is killed halfway"""
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), CountingHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{httpd.server_port}"
+
+    path = str(tmp_path / 'test.db')
+    monitor = APIMonitor(path)
+    interval = 2
+    for i in range(12):
+        monitor.add_monitor(f"API {i}", f"{base}/{i}", check_interval=interval)
+
+    def node():
+        return subprocess.Popen([sys.executable, 'src/worker.py', '--db', path, '--shards', '1',
+                                 '--lease-ttl', '3', '--metrics-port', '0'], cwd=ROOT,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    nodes = [node() for _ in range(3)]
+    try:
+        time.sleep(8)
+        nodes[0].send_signal(signal.SIGKILL)
+        killed_at = time.monotonic()
+        time.sleep(8)
+    finally:
+        for process in nodes:
+            process.kill()
+            process.wait()
+        httpd.shutdown()
+
+    hits = {path: sorted(times) for path, times in CountingHandler.hits.items()}
+    assert len(hits) == 12
+    for times in hits.values():
+        # Checked again soon after the failover...
+        assert any(t > killed_at + 3 + interval for t in times)
+        # ...and never by two nodes at once
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        assert min(gaps) > interval / 2
@@ -0,0 +1,37 @@
+import pytest
+import sys
+import os
+from argparse import Namespace
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks import loadtest
+
+
+def small_run():
+    return loadtest.run(Namespace(monitors=40, interval=1, duration=3, warmup=1, hosts=2, latency=0.01,
+                                  jitter=0.01, error_rate=0.2, timeout_rate=0.1, timeout=1, readers=1, seed=7))
+
+
+def test_short_run_reports_every_metric():
+    # Memory held by the harness isn't the checking process's
+    ballast = b'x' * (256 * 2 ** 20)
+    results = small_run()
+    assert results['worker_rss_mb'] < len(ballast) / 2 ** 20 < loadtest.peak_rss_mb()
+    del ballast
+    assert set(loadtest.METRICS) <= set(results)
+    assert results['checks'] > 0
+    # The stub's error and timeout distributions reach the checks table
+    assert set(results['outcomes']) == {'ok', 'http_error', 'timeout'}
+    assert results['api_requests'] > 0
+    assert results['worker_rss_mb'] > 0
+    assert loadtest.compare(results, results, tolerance=0) == []
+
+
+def test_regressions_fail_against_the_baseline():
+    baseline = {'settings': {'monitors': 10}, 'checks_per_second': 100.0, 'api_latency_p99': 0.1,
+                'worker_rss_mb': 50.0}
+    results = dict(baseline, checks_per_second=80.0, api_latency_p99=0.105, worker_rss_mb=70.0)
+    regressions = loadtest.compare(results, baseline, tolerance=0.1)
+    assert [r.split(':')[0] for r in regressions] == ['checks_per_second', 'worker_rss_mb']
+
+    assert loadtest.compare(results, dict(baseline, settings={'monitors': 20}), tolerance=0.1)
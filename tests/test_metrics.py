@@ -0,0 +1,118 @@
+import pytest
+import sys
+import os
+import threading
+import time
+import urllib.request
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src import metrics
+from src.metrics import MetricsRegistry
+from src.monitor import APIMonitor
+from src.engine import CheckEngine
+from src.profiler import SamplingProfiler
+
+
+def test_exposition_format():
+    registry = MetricsRegistry()
+    checks = registry.counter('checks_total', 'Checks', ('result',))
+    duration = registry.histogram('duration_seconds', 'Duration', buckets=(0.1, 1.0))
+    checks.inc(labels=('ok',))
+    checks.inc(2, labels=('error',))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        duration.observe(value)
+
+    lines = registry.render().splitlines()
+    assert '# TYPE checks_total counter' in lines
+    assert 'checks_total{result="error"} 2' in lines
+    assert 'checks_total{result="ok"} 1' in lines
+    assert '# TYPE duration_seconds histogram' in lines
+    assert 'duration_seconds_bucket{le="0.1"} 1' in lines
+    assert 'duration_seconds_bucket{le="1.0"} 3' in lines
+    assert 'duration_seconds_bucket{le="+Inf"} 4' in lines
+    assert 'duration_seconds_count 4' in lines
+    assert 'duration_seconds_sum 4.05' in lines
+
+
+def test_merge_adds_other_processes():
+    local = MetricsRegistry()
+    remote = MetricsRegistry()
+    for registry in (local, remote):
+        registry.counter('checks_total', 'Checks').inc(3)
+        registry.histogram('duration_seconds', 'Duration', buckets=(1.0,)).observe(0.5)
+    local.merge('shard-0', remote.snapshot())
+    local.merge('shard-0', remote.snapshot())  # replaces, doesn't add twice
+    lines = local.render().splitlines()
+    assert 'checks_total 6' in lines
+    assert 'duration_seconds_bucket{le="1.0"} 2' in lines
+    local.forget('shard-0')
+    assert 'checks_total 3' in local.render().splitlines()
+
+
+def test_checks_are_instrumented(tmp_path):
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    monitor_id = monitor.add_monitor("Down", "http://127.0.0.1:9/")
+    before = metrics.CHECKS.snapshot().get(('error',), 0)
+    CheckEngine(monitor).run([monitor_id])
+
+    assert metrics.CHECKS.snapshot()[('error',)] == before + 1
+    assert metrics.IN_FLIGHT.snapshot()[()] == 0
+    assert metrics.MONITOR_UP.snapshot()[(monitor_id,)] == 0
+    assert metrics.DB_WRITE.snapshot()[()][2] >= 1
+
+    server = metrics.serve(0, host='127.0.0.1')
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/metrics"
+        with urllib.request.urlopen(url) as response:
+            assert response.headers['Content-Type'] == metrics.CONTENT_TYPE
+            assert f'api_monitor_monitor_up{{monitor_id="{monitor_id}"}} 0' in response.read().decode()
+    finally:
+        server.shutdown()
+
+
+def test_dropped_monitors_lose_their_series(tmp_path):
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    monitor_id = monitor.add_monitor("Down", "http://127.0.0.1:9/")
+    monitor.registry.refresh()
+    CheckEngine(monitor).run([monitor_id])
+    monitor.latency.observe(monitor_id, 0.1)
+    assert (monitor_id,) in metrics.MONITOR_UP.snapshot()
+    assert monitor.alert_states.state(monitor_id) is not None
+
+    [row] = monitor.get_monitors([monitor_id])
+    monitor.deactivate_monitors([monitor_id])
+    monitor.registry.poll()
+    for metric in metrics.PER_MONITOR:
+        assert (monitor_id,) not in metric.snapshot()
+    # Alert and latency state go with it
+    assert monitor.alert_states.state(monitor_id) is None
+    assert monitor.latency.baseline(monitor_id) is None
+
+    # A result that was still in flight doesn't bring any of it back
+    monitor.record_checks([(row, {'status_code': 200, 'response_time': 0.1, 'error': None,
+                                  'connection_reused': False})])
+    assert (monitor_id,) not in metrics.MONITOR_UP.snapshot()
+    assert monitor.alert_states.state(monitor_id) is None
+    assert monitor.latency.baseline(monitor_id) is None
+
+
+def test_profiler_dumps_folded_stacks(tmp_path):
+    def busy_loop(stop):
+        while not stop.is_set():
+            sum(range(1000))
+
+    stop = threading.Event()
+    thread = threading.Thread(target=busy_loop, args=(stop,), name='busy')
+    thread.start()
+    profiler = SamplingProfiler('test', interval=0.001, directory=str(tmp_path))
+    profiler.start()
+    time.sleep(0.3)
+    path = profiler.stop()
+    stop.set()
+    thread.join()
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert profiler.samples > 10
+    assert any(line.startswith('busy;') and 'busy_loop (test_metrics.py:' in line for line in lines)
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
@@ -30,3 +30,20 @@ def test_monitor_stats():
     stats = monitor.get_monitor_stats(monitor_id)
     assert stats['total_checks'] == 0
     assert stats['uptime_percentage'] == 0
+
+def test_stats_query_uses_index():
+    """The window stats query searches idx_checks_monitor_time instead of scanning"""
+    from src.rollups import STATS_QUERY
+    monitor = APIMonitor(':memory:')
+    with monitor.db.connect() as conn:
+        plan = [row[3] for row in conn.execute(
+            'EXPLAIN QUERY PLAN ' + STATS_QUERY, (1, '2024-01-01 00:00:00', '2024-01-01 00:01:00'))]
+    assert any('idx_checks_monitor_time' in step and 'monitor_id=? AND checked_at>? AND checked_at<?' in step for step in plan), plan
+    assert not any(step.startswith('SCAN') for step in plan), plan
+
+def test_alerts_query_uses_index():
+    monitor = APIMonitor(':memory:')
+    with monitor.db.connect() as conn:
+        plan = [row[3] for row in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT * FROM alerts WHERE monitor_id = ? AND sent_at > ?', (1, '2024-01-01'))]
+    assert any('idx_alerts_monitor_time' in step for step in plan), plan
@@ -0,0 +1,66 @@
+import pytest
+import sys
+import os
+import pickle
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.monitor import APIMonitor
+from src import registry as registry_module
+from src.registry import MonitorRecord, MonitorRegistry
+
+
+@pytest.fixture
+def monitor(tmp_path):
+    return APIMonitor(str(tmp_path / 'test.db'))
+
+
+def test_record_reads_like_a_row(monitor):
+    monitor_id = monitor.add_monitor("A", "https://example.com", email_alerts="ops@example.com",
+                                     keep_alive=True)
+    [row] = monitor.get_monitors([monitor_id])
+    record = MonitorRecord(row)
+    assert record['url'] == record.url == row['url']
+    assert record['keep_alive'] is True
+    assert dict(record)['alert_state'] == 'up'
+    assert not hasattr(record, '__dict__')
+    assert pickle.loads(pickle.dumps(record)).email_alerts == "ops@example.com"
+
+
+def test_registry_follows_change_log(monitor):
+    ids = monitor.add_monitors([{'name': f'm{i}', 'url': 'https://example.com'} for i in range(3)])
+    registry = MonitorRegistry(monitor)
+    assert registry.refresh() == {monitor_id: 300 for monitor_id in ids}
+    assert len(registry) == 3
+
+    [new_id] = monitor.add_monitors([{'name': 'new', 'url': 'https://new.example.com'}])
+    monitor.update_monitors([{'id': ids[0], 'url': 'https://moved.example.com'}])
+    monitor.deactivate_monitors([ids[1]])
+    assert registry.poll() == {new_id: 300, ids[0]: 300, ids[1]: None}
+    assert registry.get(ids[0]).url == 'https://moved.example.com'
+    assert ids[1] not in registry and new_id in registry
+    assert registry.poll() == {}
+
+    # A full refresh keeps the records it already holds
+    held = registry.get(ids[2])
+    registry.refresh()
+    assert registry.get(ids[2]) is held
+
+
+
+def test_dropped_records_release_shared_values(monitor):
+    ids = monitor.add_monitors([{'name': f'm{i}', 'url': 'https://example.com', 'timeout': 17,
+                                 'email_alerts': f'ops{i}@example.com'} for i in range(2)])
+    registry = MonitorRegistry(monitor)
+    registry.refresh()
+    assert registry_module._shared[17][1] == 2
+    assert 'ops0@example.com' in registry_module._shared
+
+    # Updated records give back the values they no longer hold
+    monitor.update_monitors([{'id': ids[0], 'email_alerts': 'new@example.com'}])
+    registry.poll()
+    assert 'ops0@example.com' not in registry_module._shared
+
+    monitor.deactivate_monitors(ids)
+    registry.poll()
+    assert 17 not in registry_module._shared
+    assert 'new@example.com' not in registry_module._shared
@@ -0,0 +1,70 @@
+import pytest
+import sys
+import os
+import json
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.monitor import APIMonitor
+from src.report_cache import ReportCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def record_ok(monitor, monitor_id):
+    [row] = monitor.get_monitors([monitor_id])
+    monitor.record_checks([(row, {'status_code': 200, 'response_time': 0.1, 'error': None,
+                                  'connection_reused': False})])
+
+
+def test_new_checks_refresh_only_their_monitors(tmp_path, monkeypatch):
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    checked = monitor.add_monitor("API", "https://api.example.com")
+    idle = monitor.add_monitor("Idle", "https://idle.example.com")
+    cache = ReportCache(monitor)
+
+    body, etag = cache.get()
+    assert cache.get() == (body, etag)
+    assert (cache.builds, cache.refreshes) == (1, 0)
+
+    computed = []
+    get_stats = monitor.get_monitor_stats
+    monkeypatch.setattr(monitor, 'get_monitor_stats', lambda i, hours: computed.append(i) or get_stats(i, hours))
+    record_ok(monitor, checked)
+    new_body, new_etag = cache.get()
+    assert (cache.builds, cache.refreshes) == (1, 1)
+    assert set(computed) == {checked}
+    assert new_etag != etag
+    report = json.loads(new_body)['monitors']
+    assert [m['stats_24h']['total_checks'] for m in report] == [1, 0]
+
+    # Monitor changes rebuild the whole report
+    monitor.deactivate_monitors([idle])
+    assert [m['id'] for m in json.loads(cache.get()[0])['monitors']] == [checked]
+    assert cache.builds == 2
+
+
+def test_expired_rebuild_keeps_etag_when_unchanged(tmp_path):
+    clock = FakeClock()
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    monitor.add_monitor("API", "https://api.example.com")
+    cache = ReportCache(monitor, max_age=60, clock=clock)
+
+    body, etag = cache.get()
+    clock.now += 61
+    assert cache.get() == (body, etag)
+    assert cache.builds == 2
+
+
+def test_build_report_does_not_write_files(tmp_path, monkeypatch):
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    monitor.add_monitor("API", "https://api.example.com")
+    monkeypatch.chdir(tmp_path)
+    before = set(os.listdir(tmp_path))
+    ReportCache(monitor).get()
+    assert set(os.listdir(tmp_path)) == before
@@ -0,0 +1,97 @@
+import pytest
+import sys
+import os
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.monitor import APIMonitor
+from src.db import utc_timestamp
+from src.retention import RetentionJob
+
+DAY = 86400
+
+
+def seed(monitor, days, per_day=200):
+    """Checks spread evenly over the last `days` days, oldest first"""
+    monitor_id = monitor.add_monitor("Test API", "https://example.com")
+    row = monitor.get_monitors([monitor_id])[0]
+    now = time.time()
+    results = []
+    for i in range(days * per_day):
+        ts = now - days * DAY + i * DAY / per_day + 1
+        results.append((row, {'status_code': 200, 'response_time': 0.1, 'error': None,
+                              'connection_reused': False, 'checked_at': utc_timestamp(ts)}))
+    monitor.record_checks(results)
+    return monitor_id
+
+
+def test_expires_raw_checks_but_keeps_stats(tmp_path):
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    monitor_id = seed(monitor, days=10)
+    week = monitor.get_monitor_stats(monitor_id, 168)
+
+    report = RetentionJob(monitor.db, raw_days=8, batch_size=100, batch_pause=0).run_once()
+
+    assert report['checks'] == pytest.approx(2 * 200, abs=1)
+    with monitor.db.connect() as conn:
+        oldest = conn.execute('SELECT MIN(checked_at) FROM checks').fetchone()[0]
+        rollup_oldest = conn.execute('SELECT MIN(bucket) FROM check_rollups_hour').fetchone()[0]
+    assert oldest >= utc_timestamp(time.time() - 8 * DAY - 60)
+    # Older history survives in the rollups
+    assert rollup_oldest < utc_timestamp(time.time() - 9 * DAY)
+    assert monitor.get_monitor_stats(monitor_id, 168) == week
+
+
+def test_expires_rollups_and_alerts(tmp_path):
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    seed(monitor, days=10, per_day=48)
+    with monitor.db.connect() as conn:
+        conn.execute("INSERT INTO alerts (monitor_id, alert_type, message, sent_at) "
+                     "VALUES (1, 'email', 'old', datetime('now', '-5 days'))")
+        conn.execute("INSERT INTO alerts (monitor_id, alert_type, message) VALUES (1, 'email', 'new')")
+
+    job = RetentionJob(monitor.db, raw_days=8, minute_days=2, hour_days=4, alert_days=3,
+                       batch_size=10, batch_pause=0)
+    report = job.run_once()
+
+    assert report['check_rollups_minute'] == pytest.approx(8 * 48, abs=1)
+    assert report['check_rollups_hour'] > 0
+    assert report['alerts'] == 1
+    with monitor.db.connect() as conn:
+        assert conn.execute('SELECT MIN(bucket) FROM check_rollups_hour').fetchone()[0] >= job.cutoff(4)[:13]
+        assert [row[0] for row in conn.execute('SELECT message FROM alerts')] == ['new']
+
+
+def test_rollups_expire_per_monitor_in_batches(tmp_path):
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    first = seed(monitor, days=4, per_day=48)
+    monitor.add_monitor("Never checked", "https://example.com/idle")
+    last = seed(monitor, days=4, per_day=48)
+    job = RetentionJob(monitor.db, minute_days=2, batch_size=7, batch_pause=0)
+    cutoff = job.cutoff(2)
+
+    with monitor.db.connect() as conn:
+        expired = conn.execute('SELECT COUNT(*) FROM check_rollups_minute WHERE bucket < ?',
+                               (cutoff,)).fetchone()[0]
+    assert job.expire_rollups('minute', cutoff) == expired > 7
+    with monitor.db.connect() as conn:
+        kept = dict(conn.execute('''
+            SELECT monitor_id, MIN(bucket) FROM check_rollups_minute GROUP BY monitor_id
+        ''').fetchall())
+    assert set(kept) == {first, last}
+    assert min(kept.values()) >= cutoff
+
+
+def test_incremental_vacuum_reclaims_space(tmp_path):
+    path = str(tmp_path / 'test.db')
+    monitor = APIMonitor(path)
+    seed(monitor, days=20, per_day=500)
+    with monitor.db.connect() as conn:
+        assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2  # INCREMENTAL
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    report = RetentionJob(monitor.db, raw_days=1, batch_pause=0).run_once()
+
+    assert report['bytes_reclaimed'] > 0
+    with monitor.db.connect() as conn:
+        assert conn.execute('PRAGMA freelist_count').fetchone()[0] == 0
@@ -0,0 +1,139 @@
+import pytest
+import sys
+import os
+import random
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.monitor import APIMonitor
+from src.db import utc_timestamp
+from src.rollups import window_bounds
+
+# get_monitor_stats before rollups; the rollup path must agree with it
+RAW_STATS = '''
+    SELECT COUNT(*), COUNT(CASE WHEN error_message IS NULL THEN 1 END),
+           AVG(response_time), MIN(response_time), MAX(response_time)
+    FROM checks
+    WHERE monitor_id = ?
+    AND checked_at > datetime('now', '-' || ? || ' hours')
+'''
+
+
+def raw_stats(monitor, monitor_id, hours):
+    with monitor.db.connect() as conn:
+        total, successful, avg, low, high = conn.execute(RAW_STATS, (monitor_id, hours)).fetchone()
+    return {
+        'total_checks': total,
+        'successful_checks': successful,
+        'uptime_percentage': (successful / total * 100) if total > 0 else 0,
+        'avg_response_time': avg,
+        'min_response_time': low,
+        'max_response_time': high
+    }
+
+
+def test_window_bounds():
+    assert window_bounds('2024-03-01 10:15:30') == ('2024-03-01 10:16:00', '2024-03-01 11:00:00')
+    assert window_bounds('2024-03-01 10:59:00') == ('2024-03-01 11:00:00', '2024-03-01 11:00:00')
+    assert window_bounds('2024-03-01 23:59:59') == ('2024-03-02 00:00:00', '2024-03-02 00:00:00')
+
+
+def test_rollup_stats_match_raw_query(tmp_path):
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    monitor_ids = [monitor.add_monitor(f"API {i}", "https://api.example.com") for i in range(3)]
+    rows = {m['id']: m for m in monitor.get_monitors(monitor_ids)}
+
+    rng = random.Random(7)
+    now = time.time()
+    results = []
+    for _ in range(5000):
+        monitor_id = rng.choice(monitor_ids)
+        error = "Request timed out" if rng.random() < 0.05 else None
+        results.append((rows[monitor_id], {
+            'status_code': None if error else 200,
+            'response_time': rng.uniform(0.01, 2.0),
+            'error': error,
+            'connection_reused': False,
+            # Spread over 8 days, with some landing right around the 24h/7d edges
+            'checked_at': utc_timestamp(now - rng.choice([rng.uniform(0, 8 * 86400),
+                                                           86400 + rng.uniform(-120, 120),
+                                                           7 * 86400 + rng.uniform(-120, 120)])),
+        }))
+    monitor.record_checks(results)
+
+    for monitor_id in monitor_ids:
+        for hours in (1, 24, 168):
+            expected = raw_stats(monitor, monitor_id, hours)
+            stats = monitor.get_monitor_stats(monitor_id, hours)
+            actual = {key: stats[key] for key in expected}
+            assert actual == pytest.approx(expected, rel=1e-12)
+
+
+def test_rebuild_matches_incremental(tmp_path):
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    monitor_id = monitor.add_monitor("API", "https://api.example.com")
+    [row] = monitor.get_monitors([monitor_id])
+    monitor.record_checks([(row, {'status_code': 200, 'response_time': 0.1 * i, 'error': None,
+                                  'connection_reused': False}) for i in range(1, 11)])
+    before = monitor.get_monitor_stats(monitor_id)
+    monitor.rebuild_rollups()
+    assert monitor.get_monitor_stats(monitor_id) == pytest.approx(before)
+    assert before['total_checks'] == 10
+    assert before['max_response_time'] == pytest.approx(1.0)
+
+
+def test_phase_averages_cover_checks_with_a_response(tmp_path):
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    monitor_id = monitor.add_monitor("API", "https://api.example.com")
+    [row] = monitor.get_monitors([monitor_id])
+    timings = {'dns': 0.002, 'connect': 0.01, 'tls': None, 'ttfb': 0.05, 'transfer': 0.001}
+    monitor.record_checks([(row, {'status_code': 200, 'response_time': 0.07, 'error': None,
+                                  'connection_reused': False, 'timings': timings}),
+                           (row, {'status_code': 200, 'response_time': 0.05, 'error': None,
+                                  'connection_reused': True, 'timings': dict(timings, dns=None, connect=None)}),
+                           # Timed out: kept out of the averages
+                           (row, {'status_code': None, 'response_time': 30.0, 'error': "Request timed out",
+                                  'connection_reused': False, 'timings': dict(timings, ttfb=30.0)})])
+    stats = monitor.get_monitor_stats(monitor_id)
+    assert stats['avg_dns_time'] == pytest.approx(0.001)
+    assert stats['avg_connect_time'] == pytest.approx(0.005)
+    assert stats['avg_tls_time'] == 0
+    assert stats['avg_ttfb_time'] == pytest.approx(0.05)
+    monitor.rebuild_rollups()
+    assert monitor.get_monitor_stats(monitor_id) == pytest.approx(stats)
+
+
+def test_new_rollup_columns_keep_older_buckets(tmp_path):
+    path = str(tmp_path / 'test.db')
+    monitor = APIMonitor(path)
+    monitor_id = monitor.add_monitor("API", "https://api.example.com")
+    [row] = monitor.get_monitors([monitor_id])
+    monitor.record_checks([(row, {'status_code': 200, 'response_time': 0.1, 'error': None,
+                                  'connection_reused': False, 'timings': {'ttfb': 0.05}})])
+    with monitor.db.connect() as conn:
+        # An hour whose raw checks retention has already deleted
+        conn.execute('''
+            INSERT INTO check_rollups_hour (monitor_id, bucket, total_checks, successful_checks,
+                                            response_time_sum, response_time_min, response_time_max)
+            VALUES (?, '2020-01-01 10:00:00', 60, 59, 6.0, 0.05, 0.2)
+        ''', (monitor_id,))
+        # The oldest raw check's hour may be partly deleted, so only later
+        # hours are recomputed
+        conn.execute('''
+            INSERT INTO checks (monitor_id, status_code, response_time, checked_at)
+            VALUES (?, 200, 0.3, datetime('now', '-3 hours'))
+        ''', (monitor_id,))
+        # As written before timed_checks existed
+        for granularity in ('minute', 'hour'):
+            conn.execute(f'ALTER TABLE check_rollups_{granularity} DROP COLUMN timed_checks')
+
+    monitor = APIMonitor(path)
+    with monitor.db.connect() as conn:
+        rows = conn.execute('''
+            SELECT bucket, total_checks, response_time_sum, timed_checks FROM check_rollups_hour
+            ORDER BY bucket
+        ''').fetchall()
+    assert [tuple(row) for row in rows][0] == ('2020-01-01 10:00:00', 60, 6.0, 0)
+    assert len(rows) == 2
+    assert tuple(rows[1])[1:] == (1, 0.1, 1)
+    assert monitor.get_monitor_stats(monitor_id)['avg_ttfb_time'] == pytest.approx(0.05)
@@ -0,0 +1,98 @@
+import pytest
+import sys
+import os
+import random
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.scheduler import Scheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def fires_between(scheduler, clock, start, end, step=1.0):
+    fires = {}
+    clock.now = start
+    while clock.now <= end:
+        for monitor_id, _ in scheduler.pop_due():
+            fires.setdefault(monitor_id, []).append(clock.now)
+        clock.now += step
+    return fires
+
+
+def test_each_monitor_fires_on_its_own_interval():
+    """30s, 60s and 300s monitors fire at their own rate"""
+    clock = FakeClock()
+    scheduler = Scheduler(clock=clock, rng=random.Random(1))
+    scheduler.add(1, 30)
+    scheduler.add(2, 60)
+    scheduler.add(3, 300)
+
+    fires = fires_between(scheduler, clock, 1000.0, 1000.0 + 600 - 1)
+    assert len(fires[1]) == 20
+    assert len(fires[2]) == 10
+    assert len(fires[3]) == 2
+    assert all(b - a == 30 for a, b in zip(fires[1], fires[1][1:]))
+
+
+def test_start_times_are_spread():
+    """Jitter spreads first fires across the interval instead of one burst"""
+    clock = FakeClock()
+    scheduler = Scheduler(clock=clock, rng=random.Random(2))
+    for monitor_id in range(1000):
+        scheduler.add(monitor_id, 300)
+    assert len(scheduler.pop_due(clock.now + 30)) < 200
+
+
+def test_remove_and_sync():
+    clock = FakeClock()
+    scheduler = Scheduler(jitter=0, clock=clock)
+    scheduler.sync({1: 60, 2: 60})
+    scheduler.remove(1)
+    assert [m for m, _ in scheduler.pop_due()] == [2]
+
+    scheduler.sync({3: 30})
+    assert 2 not in scheduler and 3 in scheduler
+    assert [m for m, _ in scheduler.pop_due()] == [3]
+
+
+def test_sync_keeps_phase_from_start_in():
+    """Monitors handed over from another node keep their phase"""
+    clock = FakeClock()
+    scheduler = Scheduler(clock=clock, rng=random.Random(1))
+    scheduler.sync({1: 60, 2: 60}, start_in={1: 45})
+    scheduler.sync({1: 60, 2: 60}, start_in={1: 5})  # already scheduled: ignored
+    assert scheduler.next_due() <= 1000.0 + 60
+    assert scheduler._entries[1][0] == 1000.0 + 45
+
+
+def test_lag_is_reported():
+    clock = FakeClock()
+    scheduler = Scheduler(jitter=0, clock=clock)
+    scheduler.add(1, 60)
+    [(monitor_id, intended)] = scheduler.pop_due()
+    clock.now += 0.25
+    scheduler.record_fire(intended)
+    stats = scheduler.lag_stats()
+    assert stats['fires'] == 1
+    assert stats['max_lag'] == pytest.approx(0.25)
+
+
+def test_expedite_only_moves_checks_earlier():
+    clock = FakeClock()
+    scheduler = Scheduler(clock=clock, rng=random.Random(1))
+    scheduler.add(1, 300, due=1100.0)
+    scheduler.expedite(1, 200)
+    assert scheduler.next_due() == 1100.0
+    scheduler.expedite(1, 30)
+    assert scheduler.next_due() == 1030.0
+    scheduler.expedite(2, 30)  # not scheduled: ignored
+    assert 2 not in scheduler
+
+    fires = fires_between(scheduler, clock, 1000.0, 1400.0)
+    assert fires[1] == [1030.0, 1330.0]
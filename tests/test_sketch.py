@@ -0,0 +1,92 @@
+import pytest
+import sys
+import os
+import random
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.sketch import DDSketch, RELATIVE_ACCURACY, merge_bytes
+from src.monitor import APIMonitor
+
+# Serialized size budget for one rollup bucket's sketch
+BUCKET_BUDGET_BYTES = 1024
+
+
+def exact_quantile(values, q):
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+
+def latencies(rng, n):
+    # Mostly fast, with a slow tail and the odd timeout
+    values = []
+    for _ in range(n):
+        r = rng.random()
+        if r < 0.90:
+            values.append(rng.lognormvariate(-2.5, 0.4))
+        elif r < 0.995:
+            values.append(rng.lognormvariate(0, 0.6))
+        else:
+            values.append(30.0)
+    return values
+
+
+@pytest.mark.parametrize('q', [0.5, 0.95, 0.99])
+def test_quantiles_within_relative_accuracy(q):
+    values = latencies(random.Random(3), 20000)
+    sketch = DDSketch()
+    for value in values:
+        sketch.add(value)
+    exact = exact_quantile(values, q)
+    assert sketch.quantile(q) == pytest.approx(exact, rel=RELATIVE_ACCURACY)
+
+
+def test_merged_sketches_match_single_sketch():
+    """Merging per-bucket sketches loses nothing against one big sketch"""
+    rng = random.Random(4)
+    values = latencies(rng, 10000)
+    whole = DDSketch()
+    merged = None
+    for i in range(0, len(values), 100):
+        part = DDSketch()
+        for value in values[i:i + 100]:
+            part.add(value)
+            whole.add(value)
+        merged = merge_bytes(merged, part.to_bytes())
+    merged = DDSketch.from_bytes(merged)
+    assert merged.count == whole.count
+    for q in (0.5, 0.95, 0.99):
+        assert merged.quantile(q) == whole.quantile(q)
+        assert merged.quantile(q) == pytest.approx(exact_quantile(values, q), rel=RELATIVE_ACCURACY)
+
+
+def test_memory_budget_per_monitor():
+    """One hour of 30s checks, and a whole week merged, stay within budget"""
+    rng = random.Random(5)
+    hour = DDSketch()
+    for value in latencies(rng, 120):
+        hour.add(value)
+    assert len(hour.to_bytes()) <= BUCKET_BUDGET_BYTES
+
+    week = DDSketch()
+    for _ in range(168):
+        bucket = DDSketch()
+        for value in latencies(rng, 120):
+            bucket.add(value)
+        week.merge(DDSketch.from_bytes(bucket.to_bytes()))
+    assert len(week.to_bytes()) <= 2 * BUCKET_BUDGET_BYTES
+    assert len(week.bins) <= 1024
+
+
+def test_stats_include_percentiles(tmp_path):
+    monitor = APIMonitor(str(tmp_path / 'test.db'))
+    monitor_id = monitor.add_monitor("API", "https://api.example.com")
+    [row] = monitor.get_monitors([monitor_id])
+    values = [0.01 * i for i in range(1, 101)]
+    monitor.record_checks([(row, {'status_code': 200, 'response_time': value, 'error': None,
+                                  'connection_reused': False}) for value in values])
+    stats = monitor.get_monitor_stats(monitor_id)
+    assert stats['p50_response_time'] == pytest.approx(exact_quantile(values, 0.5), rel=RELATIVE_ACCURACY)
+    assert stats['p99_response_time'] == pytest.approx(exact_quantile(values, 0.99), rel=RELATIVE_ACCURACY)
+
+    empty_id = monitor.add_monitor("Empty", "https://api.example.com")
+    assert monitor.get_monitor_stats(empty_id)['p95_response_time'] is None
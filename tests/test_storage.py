@@ -0,0 +1,281 @@
+"""
+Conformance tests run against every storage backend. PostgreSQL runs only
+when TEST_DATABASE_URL points at a server, e.g.
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost/postgres pytest tests/test_storage.py
+
+Each test gets its own schema there, dropped afterwards.
+"""
+
+import pytest
+import sys
+import os
+import threading
+import time
+import uuid
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src import alerts
+from src.db import utc_timestamp
+from src.events import CheckTailer
+from src.monitor import APIMonitor
+from src.registry import MonitorRecord
+from src.storage import Storage, open_storage
+from src.validation import ValidationError
+
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def monitor(request, tmp_path):
+    if request.param == 'sqlite':
+        monitor = APIMonitor(str(tmp_path / 'test.db'))
+        yield monitor
+        if monitor._writer is not None:
+            monitor._writer.close()
+        return
+
+    url = os.environ.get('TEST_DATABASE_URL')
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    psycopg = pytest.importorskip('psycopg')
+    pytest.importorskip('psycopg_pool')
+    from src.pg_storage import PostgresStorage
+
+    schema = f'test_{uuid.uuid4().hex[:12]}'
+    with psycopg.connect(url, autocommit=True) as admin:
+        admin.execute(f'CREATE SCHEMA {schema}')
+    storage = PostgresStorage(url, schema=schema, pool_size=4)
+    monitor = APIMonitor(url, storage=storage)
+    try:
+        yield monitor
+    finally:
+        if monitor._writer is not None:
+            monitor._writer.close()
+        storage.close()
+        with psycopg.connect(url, autocommit=True) as admin:
+            admin.execute(f'DROP SCHEMA {schema} CASCADE')
+
+
+def result(error=None, response_time=0.1, checked_at=None, status_code=200):
+    return {'status_code': None if error == 'Connection error' else status_code,
+            'response_time': response_time, 'error': error, 'connection_reused': False,
+            'timings': {'dns': 0.001, 'connect': 0.002, 'tls': None, 'ttfb': 0.05, 'transfer': 0.01},
+            'checked_at': checked_at}
+
+
+def count(monitor, table):
+    with monitor.storage.connect() as conn:
+        return conn.execute(f'SELECT COUNT(*) AS n FROM {table}').fetchone()['n']
+
+
+def test_backends_must_implement_the_interface():
+    class Partial(Storage):
+        def connect(self):
+            pass
+
+    with pytest.raises(TypeError, match='init_schema'):
+        Partial()
+
+
+def test_postgres_urls_are_refused_until_every_part_runs_there():
+    with pytest.raises(ValueError, match='only run on SQLite'):
+        open_storage('postgresql://user@localhost/monitor')
+
+
+def test_monitors_and_change_feed(monitor):
+    ids = monitor.add_monitors([{'name': f'api {i}', 'url': f'https://example.com/{i}',
+                                 'assertions': [{'type': 'body', 'contains': 'ok'}]} for i in range(3)])
+    assert len(set(ids)) == 3
+    assert monitor.get_schedule() == {monitor_id: 300 for monitor_id in ids}
+    version, changes = monitor.get_changes(0)
+    assert changes == {monitor_id: 300 for monitor_id in ids}
+
+    # A missing id rejects the whole batch
+    with pytest.raises(ValidationError):
+        monitor.update_monitors([{'id': ids[0], 'check_interval': 60}, {'id': 999999, 'timeout': 5}])
+    assert monitor.get_changes(version) == (version, {})
+
+    assert monitor.update_monitors([{'id': ids[0], 'check_interval': 60, 'keep_alive': True}]) == 1
+    assert monitor.deactivate_monitors([ids[1], ids[1], 999999]) == 1
+    assert monitor.deactivate_monitors([ids[1]]) == 0
+    version, changes = monitor.get_changes(version)
+    assert changes == {ids[0]: 60, ids[1]: None}
+    assert monitor.change_version() == version
+
+    [record] = [MonitorRecord(row) for row in monitor.get_monitors([ids[0], ids[1]])]
+    assert (record.id, record.check_interval, record.keep_alive) == (ids[0], 60, True)
+    assert record.assertions == '[{"type":"body","contains":"ok"}]'
+    assert [row['id'] for row in monitor.storage.active_monitors()] == [ids[0], ids[2]]
+
+
+def test_window_stats_and_rebuild(monitor):
+    [monitor_id] = monitor.add_monitors([{'name': 'api', 'url': 'https://example.com'}])
+    row = monitor.get_monitors([monitor_id])[0]
+    now = time.time()
+    version = monitor.data_version()
+    monitor.record_checks([
+        (row, result(response_time=0.1, checked_at=utc_timestamp(now - 60))),
+        (row, result(response_time=0.3, checked_at=utc_timestamp(now - 2 * 3600))),
+        (row, result('Connection error', response_time=1.0, checked_at=utc_timestamp(now - 30 * 3600))),
+    ])
+    assert monitor.data_version() != version
+    last, checked = monitor.storage.checked_monitors_after(0)
+    assert checked == {monitor_id} and last == monitor.storage.last_check_id()
+    assert monitor.storage.checked_monitors_after(last) == (last, set())
+
+    day, week = monitor.get_monitor_stats(monitor_id, 24), monitor.get_monitor_stats(monitor_id, 168)
+    assert (day['total_checks'], day['successful_checks']) == (2, 2)
+    assert (week['total_checks'], week['successful_checks']) == (3, 2)
+    assert day['avg_response_time'] == pytest.approx(0.2)
+    assert (week['min_response_time'], week['max_response_time']) == (0.1, 1.0)
+    assert week['p50_response_time'] == pytest.approx(0.3, rel=0.02)
+    # Only the two checks that got a response count towards phase times
+    assert week['avg_ttfb_time'] == pytest.approx(0.05)
+    assert week['avg_tls_time'] == 0
+
+    monitor.rebuild_rollups()
+    assert monitor.get_monitor_stats(monitor_id, 168) == week
+
+    # The most recent check keeps the monitor's phase across restarts
+    delays = monitor.get_start_delays([monitor_id], now=now)
+    assert delays[monitor_id] == pytest.approx(240, abs=1)
+
+
+def test_alerts_and_alert_state(monitor):
+    [monitor_id] = monitor.add_monitors([{'name': 'api', 'url': 'https://example.com',
+                                          'email_alerts': 'ops@example.com, dev@example.com'}])
+    for _ in range(2):
+        monitor.record_checks([(monitor.get_monitors([monitor_id])[0], result('Connection error'))])
+    assert monitor.get_monitors([monitor_id])[0]['alert_state'] == alerts.DOWN
+    assert count(monitor, 'alerts') == 2
+    with monitor.storage.connect() as conn:
+        states = {row['delivery_status'] for row in conn.execute('SELECT delivery_status FROM alerts')}
+    assert states == {'pending'}
+
+
+def test_tailer_follows_new_checks(monitor):
+    [monitor_id] = monitor.add_monitors([{'name': 'api', 'url': 'https://example.com'}])
+    row = monitor.get_monitors([monitor_id])[0]
+    monitor.record_checks([(row, result())])
+    batches = []
+    tailer = CheckTailer(monitor, batches.append)
+    assert tailer.poll() == 0
+
+    monitor.record_checks([(row, result()), (row, result('Expected status 200, got 500', status_code=500))])
+    assert tailer.poll() == 2
+    [(_, first, checked_at), (_, second, _)] = batches[0]
+    assert first['timings']['ttfb'] == pytest.approx(0.05)
+    assert second['error'] == 'Expected status 200, got 500'
+    assert len(checked_at) == 19
+
+
+def test_init_adds_columns_missing_from_older_databases(monitor):
+    with monitor.storage.connect() as conn:
+        conn.execute('ALTER TABLE monitors DROP COLUMN dns_ttl')
+        conn.execute('ALTER TABLE checks DROP COLUMN ttfb_us')
+        conn.execute('ALTER TABLE alerts DROP COLUMN recipient')
+    monitor.storage.init_schema()
+
+    [monitor_id] = monitor.add_monitors([{'name': 'api', 'url': 'https://example.com', 'dns_ttl': 60}])
+    row = monitor.get_monitors([monitor_id])[0]
+    assert row['dns_ttl'] == 60
+    monitor.record_checks([(row, result())])
+    assert monitor.get_monitor_stats(monitor_id)['avg_ttfb_time'] == pytest.approx(0.05)
+
+
+def test_check_ids_are_drawn_in_commit_order(monitor):
+    if not hasattr(monitor.storage, 'drop_partitions_before'):
+        pytest.skip("PostgreSQL only")
+    [monitor_id] = monitor.add_monitors([{'name': 'api', 'url': 'https://example.com'}])
+    check = (monitor_id, 200, 0.1, None, False, utc_timestamp()) + (None,) * 5
+
+    def last_id():
+        with monitor.storage.connect() as conn:
+            return conn.execute('SELECT last_value FROM checks_id_seq').fetchone()['last_value']
+
+    def insert():
+        with monitor.storage.connect() as conn:
+            monitor.storage.insert_checks(conn, [check])
+
+    with monitor.storage.connect() as conn:
+        monitor.storage.insert_checks(conn, [check])
+        first = last_id()
+        # A second writer waits for this batch to commit before taking ids
+        second = threading.Thread(target=insert)
+        second.start()
+        time.sleep(0.3)
+        assert last_id() == first
+    second.join()
+    assert last_id() == first + 1
+
+
+def test_ingest_throughput_keeps_every_check(monitor):
+    """A burst of checks across many monitors goes through the writer in
+    large batches and every one of them lands in the checks and rollups"""
+    ids = monitor.add_monitors([{'name': f'api {i}', 'url': f'https://example.com/{i}'} for i in range(50)])
+    rows = monitor.get_monitors(ids)
+    now = time.time()
+    monitor.record_checks([(row, result(None if n % 10 else 'Request timed out',
+                                        checked_at=utc_timestamp(now - n % 3600)))
+                           for n in range(200) for row in rows])
+    assert count(monitor, 'checks') == 10000
+    stats = monitor.get_monitor_stats(ids[0], 24)
+    assert (stats['total_checks'], stats['successful_checks']) == (200, 180)
+
+
+def test_checks_are_partitioned_by_day(monitor):
+    if not hasattr(monitor.storage, 'drop_partitions_before'):
+        pytest.skip("PostgreSQL only")
+    [monitor_id] = monitor.add_monitors([{'name': 'api', 'url': 'https://example.com'}])
+    row = monitor.get_monitors([monitor_id])[0]
+    monitor.record_checks([(row, result(checked_at=f'2024-01-0{day} 12:00:00')) for day in (1, 2, 3)])
+    with monitor.storage.connect() as conn:
+        plan = '\n'.join(r['QUERY PLAN'] for r in conn.execute(
+            "EXPLAIN SELECT * FROM checks WHERE checked_at >= '2024-01-03'"))
+    assert 'checks_p20240103' in plan and 'checks_p20240101' not in plan
+
+    assert monitor.storage.drop_partitions_before('2024-01-03') == ['checks_p20240101', 'checks_p20240102']
+    assert count(monitor, 'checks') == 1
+    # Dropped days are recreated if a late check arrives
+    monitor.record_checks([(row, result(checked_at='2024-01-01 13:00:00'))])
+    assert count(monitor, 'checks') == 2
+
+
+def test_quotas_hold_across_processes(monitor):
+    # Another web process on the same database, with its own memory
+    other = APIMonitor(monitor.db_path, storage=monitor.storage)
+    tenant = monitor.add_tenant('Acme', 'free')
+    spec = {'name': 'api', 'url': 'https://example.com/', 'tenant_id': tenant}
+    monitor.add_monitors([spec] * 4)
+    assert monitor.tenant_stats(tenant)['monitors'] == 4
+
+    other.add_monitors([spec])
+    with pytest.raises(ValidationError):
+        monitor.add_monitors([spec])
+    other.set_tenant_tier(tenant, 'pro')
+    with pytest.raises(ValidationError) as e:
+        monitor.add_monitors([dict(spec, check_interval=30)])
+    assert e.value.errors[0]['message'] == "must be at least 60 on the pro tier"
+    assert monitor.tenant_stats(tenant)['monitors'] == 5
+
+
+def test_tenants_quotas_and_usage(monitor):
+    tenant = monitor.add_tenant('Acme', 'free')
+    ids = monitor.add_monitors([{'name': f'api {i}', 'url': f'https://example.com/{i}', 'tenant_id': tenant}
+                                for i in range(5)])
+    with pytest.raises(ValidationError):
+        monitor.add_monitors([{'name': 'one more', 'url': 'https://example.com/', 'tenant_id': tenant}])
+    assert monitor.storage.tenant_monitor_counts() == {tenant: 5}
+
+    record = MonitorRecord(monitor.get_monitors(ids[:1])[0])
+    assert (record.tenant_id, record.tier) == (tenant, 'free')
+    hour = utc_timestamp()[:13] + ':00:00'
+    monitor.record_checks([(record, result()), (record, result(error='Connection error'))])
+    monitor.flush_usage()
+    monitor.record_checks([(record, result())])
+    monitor.flush_usage()
+    assert [tuple(row[c] for c in ('hour', 'checks', 'failed_checks'))
+            for row in monitor.storage.tenant_usage(tenant, hour)] == [(hour, 3, 1)]
+
+    assert monitor.set_tenant_tier(tenant, 'pro')
+    assert monitor.get_monitors(ids[:1])[0]['tier'] == 'pro'
+    monitor.add_monitors([{'name': 'one more', 'url': 'https://example.com/', 'tenant_id': tenant}])
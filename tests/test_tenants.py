@@ -0,0 +1,204 @@
+import pytest
+import sys
+import os
+import asyncio
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.adaptive import AdaptivePolicy
+from src import app as web
+from src.app import create_app
+from src.fairqueue import FairLimiter
+from src.monitor import APIMonitor
+from src.tenants import TenantUsage
+from src.validation import ValidationError
+
+
+@pytest.fixture
+def monitor(tmp_path):
+    return APIMonitor(str(tmp_path / 'test.db'))
+
+
+def specs(count, tenant_id, interval=300):
+    return [{'name': f'm{i}', 'url': f'https://example.com/{i}', 'check_interval': interval,
+             'tenant_id': tenant_id} for i in range(count)]
+
+
+def test_tier_caps_monitors_per_tenant(monitor):
+    free = monitor.add_tenant('Free Co')
+    business = monitor.add_tenant('Big Co', 'business')
+    assert len(monitor.add_monitors(specs(4, free))) == 4
+
+    # All or nothing: a batch that would go over the cap writes nothing
+    with pytest.raises(ValidationError) as e:
+        monitor.add_monitors(specs(2, free))
+    assert e.value.errors == [{'index': 1, 'field': 'tenant_id', 'message': "the free tier allows 5 monitors"}]
+    [fifth] = monitor.add_monitors(specs(1, free))
+    with pytest.raises(ValidationError):
+        monitor.add_monitors(specs(1, free))
+
+    # Deactivating frees a slot; other tenants and unowned monitors are unaffected
+    assert monitor.deactivate_monitors([fifth]) == 1
+    monitor.add_monitors(specs(1, free))
+    assert len(monitor.add_monitors(specs(100, business, interval=30))) == 100
+    monitor.add_monitors(specs(10, None, interval=10))
+
+    with pytest.raises(ValidationError) as e:
+        monitor.add_monitors(specs(1, 999))
+    assert e.value.errors[0]['message'] == "no such tenant"
+    assert monitor.tenant_stats(free)['monitors'] == 5
+
+
+def test_tier_sets_the_shortest_interval(monitor):
+    pro = monitor.add_tenant('Pro Co', 'pro')
+    with pytest.raises(ValidationError) as e:
+        monitor.add_monitors(specs(1, pro, interval=30))
+    assert e.value.errors[0]['message'] == "must be at least 60 on the pro tier"
+    [monitor_id] = monitor.add_monitors(specs(1, pro, interval=60))
+
+    with pytest.raises(ValidationError):
+        monitor.update_monitors([{'id': monitor_id, 'check_interval': 59}])
+    with pytest.raises(ValidationError) as e:
+        monitor.update_monitors([{'id': monitor_id, 'tenant_id': None}])
+    assert e.value.errors[0]['message'] == "can't be changed"
+
+    # Moving down a tier slows existing monitors to its minimum
+    version = monitor.change_version()
+    assert monitor.set_tenant_tier(pro, 'free')
+    [row] = monitor.get_monitors([monitor_id])
+    assert row['check_interval'] == 300 and row['tier'] == 'free'
+    assert monitor.get_changes(version)[1] == {monitor_id: 300}
+    assert not monitor.set_tenant_tier(999, 'pro')
+
+
+def test_usage_is_counted_in_memory_and_flushed(monitor):
+    tenant = monitor.add_tenant('Acme', 'pro')
+    [monitor_id] = monitor.add_monitors(specs(1, tenant, interval=60))
+    [unowned] = monitor.add_monitors(specs(1, None))
+    rows = monitor.get_monitors([monitor_id, unowned])
+    ok = {'status_code': 200, 'response_time': 0.1, 'error': None, 'connection_reused': False}
+    failed = dict(ok, status_code=500, error="Expected status 200, got 500")
+
+    monitor.record_checks([(rows[0], ok), (rows[0], failed), (rows[1], ok)])
+    assert monitor.tenant_stats(tenant)['checks'] == 0  # not flushed yet
+
+    monitor.flush_usage()
+    stats = monitor.tenant_stats(tenant)
+    assert (stats['checks'], stats['failed_checks']) == (2, 1)
+    assert stats['limits'] == {'max_monitors': 50, 'min_interval': 60}
+
+    # Flushes add to the hour's row rather than replacing it
+    monitor.usage.flush_interval = 0
+    monitor.record_checks([(rows[0], ok)])
+    assert monitor.tenant_stats(tenant)['checks'] == 3
+
+
+def test_usage_survives_a_failed_flush():
+    usage = TenantUsage(flush_interval=60, clock=lambda: 0)
+    usage.count(1, '2026-01-01 10:15:00', False)
+    usage.count(1, '2026-01-01 10:45:00', True)
+    usage.count(1, '2026-01-01 11:00:00', False)
+    assert not usage.due()
+    rows = usage.take()
+    assert sorted(rows) == [(1, '2026-01-01 10:00:00', 2, 1), (1, '2026-01-01 11:00:00', 1, 0)]
+    usage.restore(rows)
+    usage.count(1, '2026-01-01 11:30:00', False)
+    assert sorted(usage.take()) == [(1, '2026-01-01 10:00:00', 2, 1), (1, '2026-01-01 11:00:00', 2, 0)]
+
+
+def test_fair_limiter_shares_slots_by_weight():
+    async def run():
+        limiter = FairLimiter(1)
+        order = []
+
+        async def check(tenant, weight):
+            async with limiter.slot(tenant, weight):
+                order.append(tenant)
+                await asyncio.sleep(0)
+
+        # A free tenant queues a backlog first; a business tenant's checks
+        # still get four slots for every one of the free tenant's
+        tasks = [asyncio.create_task(check('free', 1)) for _ in range(20)]
+        tasks += [asyncio.create_task(check('business', 4)) for _ in range(20)]
+        await asyncio.gather(*tasks)
+        return order
+
+    order = asyncio.run(run())
+    assert len(order) == 40
+    assert 14 <= order[:20].count('business') <= 17
+
+
+def test_fair_limiter_cancelled_waiters_give_back_their_slot():
+    async def run():
+        limiter = FairLimiter(1)
+        await limiter.acquire('a')
+        waiter = asyncio.create_task(limiter.acquire('b'))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        limiter.release()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return limiter.free, limiter.waiting()
+
+    assert asyncio.run(run()) == (1, 0)
+
+
+def test_tier_bounds_recheck_floor():
+    adaptive = AdaptivePolicy(confirm=2, min_recheck=10)
+    failed = {'status_code': 500, 'response_time': 0.1, 'error': "boom", 'connection_reused': False}
+    assert adaptive.recheck_in({'id': 1, 'check_interval': 300, 'tier': None}, failed) == 60
+    assert adaptive.recheck_in({'id': 2, 'check_interval': 60, 'tier': 'business'}, failed) == 12
+    assert adaptive.recheck_in({'id': 3, 'check_interval': 60, 'tier': 'pro'}, failed) == 15
+    assert adaptive.recheck_in({'id': 4, 'check_interval': 300, 'tier': 'free'}, failed) == 60
+    assert adaptive.recheck_in({'id': 5, 'check_interval': 60, 'tier': 'free'}, failed) is None
+
+
+def test_tenant_api(tmp_path, monkeypatch):
+    client = create_app(str(tmp_path / 'test.db')).test_client()
+    admin = {'Authorization': 'Bearer s3cret'}
+    # Tenant writes are admin-only, and off until a token is configured
+    monkeypatch.setattr(web.Config, 'ADMIN_TOKEN', None)
+    assert client.post('/api/tenants', json={'name': 'Acme'}, headers=admin).status_code == 403
+    monkeypatch.setattr(web.Config, 'ADMIN_TOKEN', 's3cret')
+    assert client.post('/api/tenants', json={'name': 'Acme'}).status_code == 401
+    wrong = {'Authorization': 'Bearer nope'}
+    assert client.post('/api/tenants', json={'name': 'Acme'}, headers=wrong).status_code == 401
+
+    response = client.post('/api/tenants', json={'name': 'Acme', 'tier': 'gold'}, headers=admin)
+    assert response.status_code == 400
+    assert response.get_json()['errors'][0]['field'] == 'tier'
+
+    response = client.post('/api/tenants', json={'name': 'Acme'}, headers=admin)
+    assert response.status_code == 201
+    tenant_id = response.get_json()['id']
+
+    response = client.post('/api/monitors/bulk', json={'monitors': specs(6, tenant_id)}, headers=admin)
+    assert response.status_code == 400
+    response = client.post('/api/monitors/bulk', json={'monitors': specs(5, tenant_id)}, headers=admin)
+    assert response.status_code == 201
+
+    assert client.patch(f'/api/tenants/{tenant_id}', json={'tier': 'business'}).status_code == 401
+    assert client.get(f'/api/tenants/{tenant_id}').get_json()['tier'] == 'free'
+    assert client.patch(f'/api/tenants/{tenant_id}', json={'tier': 'pro'}, headers=admin).status_code == 200
+    stats = client.get(f'/api/tenants/{tenant_id}').get_json()
+    assert (stats['tier'], stats['monitors']) == ('pro', 5)
+    assert client.get('/api/tenants/999').status_code == 404
+    assert client.patch('/api/tenants/999', json={'tier': 'pro'}, headers=admin).status_code == 404
+
+
+def test_api_monitors_need_a_tenant(tmp_path, monkeypatch):
+    monitor = web.APIMonitor(str(tmp_path / 'test.db'))
+    client = create_app(monitor=monitor).test_client()
+    monkeypatch.setattr(web.Config, 'ADMIN_TOKEN', 's3cret')
+    client.environ_base['HTTP_AUTHORIZATION'] = 'Bearer s3cret'
+    # Without a tenant there would be no tier to limit the interval
+    response = client.post('/api/monitors/bulk', json={'monitors': specs(2, None, interval=1)})
+    assert response.status_code == 400
+    assert response.get_json()['errors'] == [
+        {'index': 0, 'field': 'tenant_id', 'message': "is required"},
+        {'index': 1, 'field': 'tenant_id', 'message': "is required"},
+    ]
+    # Monitors created without one (from code) can't be changed over the API either
+    [legacy] = monitor.add_monitors(specs(1, None))
+    response = client.patch('/api/monitors/bulk', json={'monitors': [{'id': legacy, 'check_interval': 1}]})
+    assert response.get_json()['errors'] == [{'index': 0, 'field': 'tenant_id', 'message': "monitor has no tenant"}]
+    assert monitor.get_schedule() == {legacy: 300}
@@ -0,0 +1,95 @@
+import pytest
+import sys
+import os
+import queue
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.metrics import REGISTRY
+from src.monitor import APIMonitor
+from src.sharding import HashRing
+from src.worker import ShardMonitor, Worker, shard_names
+
+
+def test_ring_moves_only_affected_monitors():
+    keys = range(10000)
+    before = HashRing(shard_names(4))
+    after = HashRing(shard_names(5))
+    owners = {key: before.node_for(key) for key in keys}
+    moved = [key for key in keys if after.node_for(key) != owners[key]]
+
+    # Only monitors claimed by the new shard move, roughly a fifth of them
+    assert all(after.node_for(key) == 'shard-4' for key in moved)
+    assert 0.12 < len(moved) / len(owners) < 0.28
+
+    after.remove('shard-4')
+    assert all(after.node_for(key) == owners[key] for key in keys)
+
+
+def test_ring_spreads_monitors_evenly():
+    ring = HashRing(shard_names(4))
+    counts = {}
+    for key in range(10000):
+        counts[ring.node_for(key)] = counts.get(ring.node_for(key), 0) + 1
+    assert min(counts.values()) > 10000 / 4 * 0.8
+
+
+def test_shards_partition_the_schedule(tmp_path):
+    path = str(tmp_path / 'test.db')
+    monitor = APIMonitor(path)
+    ids = {monitor.add_monitor(f"API {i}", f"https://example.com/{i}") for i in range(200)}
+
+    nodes = shard_names(3)
+    shards = [ShardMonitor(path, name, nodes, queue.Queue(), queue.Queue()) for name in nodes]
+    schedules = [set(shard.get_schedule()) for shard in shards]
+    assert set().union(*schedules) == ids
+    assert sum(len(s) for s in schedules) == len(ids)
+
+    # A membership change reaches a shard through its control queue
+    shards[0]._control.put(shard_names(1))
+    assert set(shards[0].get_schedule()) == ids
+
+
+def test_worker_processes_write_through_parent(tmp_path):
+    path = str(tmp_path / 'test.db')
+    worker = Worker(path, refresh_interval=1)
+    ids = [worker.monitor.add_monitor(f"Down {i}", "http://127.0.0.1:9/", check_interval=1)
+           for i in range(6)]
+    worker.start(2)
+    try:
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            with worker.monitor.db.connect() as conn:
+                checked = {row[0] for row in conn.execute('SELECT DISTINCT monitor_id FROM checks')}
+            if checked == set(ids):
+                break
+            time.sleep(0.2)
+        assert checked == set(ids)
+
+        # Shard counters reach the parent's /metrics alongside its own
+        deadline = time.time() + 10
+        while time.time() < deadline and 'api_monitor_checks_total{result="error"}' not in REGISTRY.render():
+            time.sleep(0.2)
+        text = REGISTRY.render()
+        assert 'api_monitor_checks_total{result="error"}' in text
+        assert f'api_monitor_monitor_up{{monitor_id="{ids[0]}"}} 0' in text
+
+        # The parent observes the results, so it drops a deactivated
+        # monitor's series, and checks still in flight don't bring it back
+        assert worker.monitor.alert_states.state(ids[0]) is not None
+        worker.monitor.deactivate_monitors([ids[0]])
+        worker.supervise()
+        series = f'monitor_id="{ids[0]}"'
+        assert series not in REGISTRY.render()
+        with worker.monitor.db.connect() as conn:
+            count = lambda: conn.execute('SELECT COUNT(*) FROM checks').fetchone()[0]
+            seen = count()
+            deadline = time.time() + 10
+            while time.time() < deadline and count() < seen + 10:
+                time.sleep(0.2)
+        text = REGISTRY.render()
+        assert series not in text
+        assert worker.monitor.alert_states.state(ids[0]) is None
+        assert f'api_monitor_monitor_up{{monitor_id="{ids[1]}"}} 0' in text
+    finally:
+        worker.stop()